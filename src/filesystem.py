@@ -1,8 +1,9 @@
 """Extract filenames from path recursively."""
 
 import os
+from fnmatch import fnmatchcase
 from os.path import exists, isfile, join
-from typing import Any, Generator
+from typing import Any, Generator, NamedTuple, Sequence
 
 
 def get_files(path: str) -> Generator[str, Any, None]:
@@ -40,3 +41,77 @@ def get_files_recursive(path: str) -> Generator[str, Any, None]:
     yield from get_files(path)
     for subdirectory in get_directories(path):
         yield from get_files_recursive(subdirectory)
+
+
+class FileInfo(NamedTuple):
+    """File path with size and modification time from directory entry."""
+
+    path: str
+    size: int
+    mtime: float
+    mtime_ns: int = 0
+    inode: int = 0
+
+
+def walk_files(
+    path: str,
+    include: Sequence[str] | None = None,
+    exclude: Sequence[str] | None = None,
+    with_stat: bool = False,
+) -> Generator[str | FileInfo, Any, None]:
+    """List all files inside directory recursively using os.scandir.
+
+    Directories are walked by explicit stack, so depth of the tree
+    is not limited by recursion limit. Type and stat information of
+    directory entries is reused. Symbolic links to directories are
+    not followed. Files are listed in the same order as
+    get_files_recursive does.
+
+    :param path: Absolute path for existing directory.
+    :param include: Glob patterns of relative paths (with '/' separator)
+        of files to list. All files are listed if None.
+    :param exclude: Glob patterns of relative paths of files and
+        directories to skip.
+    :param with_stat: Yield FileInfo instead of path if True.
+    :returns: Next filename (or FileInfo) in the directory or raises
+        StopIteration exception.
+    """
+    stack = [(path, '')]
+    while stack:
+        directory, relative_dir = stack.pop()
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                relative_path = '{0}{1}'.format(relative_dir, entry.name)
+                if exclude and match_any(relative_path, exclude):
+                    continue
+
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(
+                        (entry.path, '{0}/'.format(relative_path)),
+                    )
+                elif entry.is_file():
+                    if include and not match_any(relative_path, include):
+                        continue
+                    if with_stat:
+                        st = entry.stat()
+                        yield FileInfo(
+                            entry.path,
+                            st.st_size,
+                            st.st_mtime,
+                            st.st_mtime_ns,
+                            st.st_ino,
+                        )
+                    else:
+                        yield entry.path
+        stack.extend(reversed(subdirectories))
+
+
+def match_any(relative_path: str, patterns: Sequence[str]) -> bool:
+    """Check relative path against glob patterns.
+
+    :param relative_path: Relative path with '/' separator.
+    :param patterns: Glob patterns.
+    :returns: True if path matches any of patterns.
+    """
+    return any(fnmatchcase(relative_path, pattern) for pattern in patterns)
@@ -0,0 +1,305 @@
+"""Download of the whole tree as one archive extracted while streaming."""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import os
+import posixpath
+import queue
+import stat
+import tarfile
+import zlib
+from http import HTTPStatus
+from typing import IO
+
+import aiohttp
+
+from gitea.blob import join_blob_path
+from gitea.config import ARCHIVE_QUEUE_SIZE
+from gitea.fetch_params import GiteaFetchParams
+from gitea.log_message import BraceMessage
+from gitea.metrics import METRICS, Stopwatch
+from gitea.retry import request
+from gitea.url_params import GiteaUrlParams
+
+COPY_BLOCK_SIZE = 1 << 20
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkReader(object):
+    """Blocking file-like reader of gzip chunks fed from the event loop.
+
+    Number of chunks waiting for extraction is bounded by slots awaited
+    on the event loop, so download waits when extraction falls behind
+    without blocking a thread of the loop executor. Chunks are
+    decompressed on read, truncated gzip stream is an error (tarfile
+    does not check it in stream mode).
+    """
+
+    def __init__(self, queue_size: int = ARCHIVE_QUEUE_SIZE) -> None:
+        """Init empty reader.
+
+        :param queue_size: Max number of chunks waiting for extraction.
+        """
+        self._queue = queue.SimpleQueue()
+        self._slots = asyncio.Semaphore(queue_size)
+        self._loop = None
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        self._buffer = bytearray()
+        self._eof = False
+        self._closed = False
+
+    async def put(self, chunk: bytes) -> bool:
+        """Pass chunk to reader, empty chunk means end of stream.
+
+        Waits for a free slot if extraction falls behind.
+
+        :param chunk: Next bytes of stream.
+        :returns: False if reader is closed and chunk is dropped.
+        """
+        self._loop = asyncio.get_running_loop()
+        await self._slots.acquire()
+        if self._closed:
+            return False
+        self._queue.put(chunk)
+        return True
+
+    def abort(self) -> None:
+        """End stream at once without waiting for a free slot."""
+        self._queue.put(b'')
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size decompressed bytes, wait for chunks if needed.
+
+        :param size: Number of bytes to read. All bytes if negative.
+        :returns: Bytes of stream, empty bytes at end of stream.
+        :raises EOFError: Stream ended before end of gzip data.
+        """
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._queue.get()
+            self._release_slot()
+            if not chunk:
+                self._eof = True
+                if not self._decompressor.eof:
+                    raise EOFError('Truncated gzip stream')
+            self._buffer += self._decompressor.decompress(chunk)
+
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def close(self) -> None:
+        """Stop accepting chunks, wake up waiting put."""
+        self._closed = True
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._slots.release)
+
+
+def get_archive_url(sha: str, urlp: GiteaUrlParams) -> str:
+    """Get URL of tar.gz archive of the ref.
+
+    :param sha: SHA of the HEAD or another ref.
+    :param urlp: Base URL parameters for repository.
+    :returns: URL of archive.
+    """
+    return '{0}/repos/{1}/{2}/archive/{3}.tar.gz'.format(
+        urlp.base_api_url,
+        urlp.owner,
+        urlp.project,
+        sha,
+    )
+
+
+async def download_archive(
+    sha: str,
+    sess: aiohttp.ClientSession,
+    urlp: GiteaUrlParams,
+    out_dir: str,
+    fetchp: GiteaFetchParams | None = None,
+) -> dict | None:
+    """Download archive of the ref and extract it while it streams.
+
+    Regular files are extracted with executable bit, symbolic links
+    and other special entries are skipped like by check_mode. SHA-256
+    of each file is calculated while the file is written.
+
+    :param sha: SHA of the HEAD or another ref.
+    :param sess: Active session.
+    :param urlp: Base URL parameters for repository.
+    :param out_dir: Existing directory to extract files to.
+    :param fetchp: Fetching parameters. Defaults are used if None.
+    :returns: Manifest dict of SHA-256 hashes by absolute file path
+        or None if archive is not available.
+    :raises Exception: Archive is broken or can't be written.
+    """
+    if fetchp is None:
+        fetchp = GiteaFetchParams()
+
+    url = get_archive_url(sha, urlp)
+    msg = 'GET archive from {0}'.format(url)
+    logger.info(msg)
+
+    reader = ChunkReader()
+    # Chunked archive of unknown size holds at most the queue of chunks
+    async with request(
+        sess,
+        url,
+        fetchp.retry,
+        size_hint=ARCHIVE_QUEUE_SIZE * fetchp.chunk_size,
+    ) as response:
+        if response.status != HTTPStatus.OK:
+            msg = 'Archive response status: {0}'.format(response.status)
+            logger.warning(msg)
+            return None
+
+        # Extraction blocks its thread while waiting for chunks, so it
+        # has a thread of its own instead of one of the shared executor
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='archive',
+        )
+        extraction = asyncio.get_running_loop().run_in_executor(
+            executor,
+            extract_archive,
+            reader,
+            out_dir,
+        )
+        try:
+            async for chunk in response.content.iter_chunked(
+                fetchp.chunk_size,
+            ):
+                METRICS.inc('downloaded_bytes_total', len(chunk))
+                if not await reader.put(chunk):
+                    break
+            else:
+                await reader.put(b'')
+        except BaseException as ex:
+            reader.abort()
+            await asyncio.gather(extraction, return_exceptions=True)
+            raise ex
+        finally:
+            executor.shutdown(wait=False)
+
+    return await extraction
+
+
+def extract_archive(reader: ChunkReader, out_dir: str) -> dict:
+    """Extract tar.gz stream, strip top-level directory of archive.
+
+    :param reader: Reader of archive stream.
+    :param out_dir: Existing directory to extract files to.
+    :returns: Manifest dict of SHA-256 hashes by absolute file path.
+    :raises EOFError: Archive is truncated.
+    """
+    manifest = {}
+    created = set()
+    try:
+        with tarfile.open(fileobj=reader, mode='r|') as archive:
+            for member in archive:
+                relative_path = get_member_path(member)
+                if relative_path is None:
+                    continue
+
+                path = join_blob_path(relative_path, out_dir)
+                if member.isdir():
+                    make_dirs(path, created)
+                    continue
+
+                make_dirs(os.path.dirname(path), created)
+                manifest[path] = extract_file(
+                    archive.extractfile(member),
+                    path,
+                    member.size,
+                    bool(member.mode & stat.S_IXUSR),
+                )
+    finally:
+        reader.close()
+
+    return manifest
+
+
+def get_member_path(member: tarfile.TarInfo) -> str | None:
+    """Get path of archive entry relative to the repository root.
+
+    :param member: Entry of archive.
+    :returns: Relative path or None if entry must be skipped.
+    """
+    parts = member.name.split('/', 1)
+    if len(parts) < 2 or not parts[1].strip('/'):
+        return None
+    relative_path = posixpath.normpath(parts[1])
+
+    is_outside = relative_path == '..' or relative_path.startswith('../')
+    if posixpath.isabs(relative_path) or is_outside:
+        msg = 'Skipping archive entry outside of tree: {0}'.format(
+            member.name,
+        )
+        logger.warning(msg)
+        return None
+
+    if not member.isfile() and not member.isdir():
+        logger.info(BraceMessage(
+            'Skipping archive entry. path: {0}, type: {1!r}',
+            relative_path,
+            member.type,
+        ))
+        return None
+    return relative_path
+
+
+def make_dirs(path: str, created: set) -> None:
+    """Create directory once per extraction.
+
+    :param path: Path to directory.
+    :param created: Paths of directories already created.
+    """
+    if path not in created:
+        os.makedirs(path, exist_ok=True)
+        created.add(path)
+
+
+def extract_file(
+    fp: IO[bytes],
+    path: str,
+    size: int,
+    is_executable: bool,
+) -> str:
+    """Copy archive entry to file and calculate its SHA-256.
+
+    :param fp: Reader of archive entry.
+    :param path: Path to file.
+    :param size: Size of archive entry in bytes.
+    :param is_executable: chmod +x will be invoked if True
+    :returns: SHA-256 of the file.
+    :raises EOFError: Archive entry is truncated.
+    """
+    logger.info(BraceMessage('Extract blob to file: {0}', path))
+
+    sha256_hash = hashlib.sha256()
+    written = 0
+    stopwatch = Stopwatch()
+    with open(path, 'wb') as out:
+        while True:
+            block = fp.read(COPY_BLOCK_SIZE)
+            if not block:
+                break
+            sha256_hash.update(block)
+            with stopwatch.measure():
+                out.write(block)
+            written += len(block)
+    if written != size:
+        raise EOFError('Truncated archive entry: {0}'.format(path))
+    METRICS.inc('written_files_total')
+    METRICS.observe('write_seconds', stopwatch.elapsed)
+    METRICS.inc('written_bytes_total', written)
+    if is_executable:
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return sha256_hash.hexdigest()
@@ -1,46 +1,126 @@
 """Functions for blob reading from gitea and writing to file."""
 
 import base64
+import contextlib
+import functools
 import logging
 import os
+import posixpath
 import stat
 from http import HTTPStatus
+from typing import Iterable
+from urllib.parse import quote
 
 import aiofiles
 import aiohttp
 
+from gitea.blob_digest import BlobDigest
+from gitea.file_writer import FileWriter
+from gitea.json_loads import DEFAULT_LOADS, JsonLoads
+from gitea.log_message import BraceMessage
+from gitea.metrics import METRICS, Stopwatch
+from gitea.retry import RetryPolicy, fetch
+from gitea.stream_decode import Base64ContentDecoder
+from gitea.url_params import GiteaUrlParams
 
-async def get_blob_data(url: str, sess: aiohttp.ClientSession) -> bytes | None:
+FILE_MODES = frozenset(('100644', '100664', '100755'))
+EXECUTABLE_MODE = '100755'
+EXECUTABLE_BITS = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+BLOB_INFO_FORMAT = (
+    'Page {0}. Processing blob. path: {1}, mode: {2}, ' +
+    'SHA: {3}, size: {4}, url: {5}'
+)
+SKIP_BLOB_FORMAT = 'Page {0}. Skipping blob. path: {1}, mode: {2}, SHA: {3}'
+# Size of blob API response fields other than content (url, sha etc.)
+BLOB_JSON_OVERHEAD = 1024
+
+logger = logging.getLogger(__name__)
+
+
+class BlobDownloadError(ValueError):
+    """Blob of the tree entry is not written after all retries."""
+
+    reason = 'Blob is not downloaded'
+
+    def __init__(self, path: str, sha: str) -> None:
+        """Init error.
+
+        :param path: Relative path of the blob in the repository.
+        :param sha: SHA of the blob.
+        """
+        super().__init__('{0}: {1}, SHA: {2}'.format(self.reason, path, sha))
+        self.path = path
+        self.sha = sha
+
+
+class BlobIntegrityError(BlobDownloadError):
+    """Git blob SHA-1 of written data differs from SHA of the tree entry."""
+
+    reason = 'Blob SHA-1 mismatch'
+
+
+async def get_blob_data(
+    url: str,
+    sess: aiohttp.ClientSession,
+    retry: RetryPolicy | None = None,
+    loads: JsonLoads = DEFAULT_LOADS,
+    size: int | None = None,
+) -> bytes | None:
     r"""Get blob from URL and get bytes decoded from base64 format.
 
     :param url: GET response from URL contains blob's data into
         \'contents\' field encoded in base64.
     :param sess: Active session object
+    :param retry: Retry policy of request. Request is sent once if None.
+    :param loads: Decoder of JSON from raw bytes of response body.
+    :param size: Size of blob from the tree entry, used to reserve
+        bytes of chunked response in concurrency budget.
     :returns: decoded contents of blob
     """
     try:
-        response = await sess.get(url)
+        with METRICS.timer('blob_seconds'):
+            body = await fetch(
+                sess,
+                url,
+                read_blob_body,
+                retry,
+                size_hint=get_blob_response_size(size),
+            )
     except Exception as ex:
         msg = "Can't grab blob: {0}".format(url)
-        logging.exception(msg)
+        logger.exception(msg)
         raise ex
 
-    if response.status != HTTPStatus.OK:
-        msg = "Response status: {0}".format(response.status)
-        logging.error(msg)
+    if body is None:
         return None
 
-    json = await response.json()
+    METRICS.inc('downloaded_bytes_total', len(body))
+    with METRICS.timer('decode_seconds'):
+        json = loads(body)
+        blob_content = json.get('content')
+        encoding = json.get('encoding')
 
-    blob_content = json.get('content')
-    encoding = json.get('encoding')
+        if encoding != 'base64':
+            msg = 'get_blob_data. Unsupported encoding: {0}'.format(encoding)
+            logger.error(msg)
+            return None
 
-    if encoding != 'base64':
-        msg = 'get_blob_data. Unsupported encoding: {0}'.format(encoding)
-        logging.error(msg)
-        return None
+        blob_data = base64.b64decode(blob_content)
+    METRICS.inc('decoded_bytes_total', len(blob_data))
+    return blob_data
 
-    return base64.b64decode(blob_content)
+
+async def read_blob_body(response: aiohttp.ClientResponse) -> bytes | None:
+    """Read body of blob API response.
+
+    :param response: Response of blob API.
+    :returns: Body or None if status is not OK.
+    """
+    if response.status != HTTPStatus.OK:
+        msg = "Response status: {0}".format(response.status)
+        logger.error(msg)
+        return None
+    return await response.read()
 
 
 async def write_blob_to_file(
@@ -48,6 +128,9 @@ async def write_blob_to_file(
     relative_path: str,
     temp_dir: str,
     is_executable: bool,
+    digest: BlobDigest | None = None,
+    create_dirs: bool = True,
+    writer: FileWriter | None = None,
 ) -> bool:
     """Write blob data (file) to newly created file.
 
@@ -56,31 +139,390 @@ async def write_blob_to_file(
         Directory will be created if not exist before call of this func.
     :param temp_dir: Temp directory root. Absolute path.
     :param is_executable: chmod +x will be invoked if True
+    :param digest: Digest updated with written data if not None.
+    :param create_dirs: Create parent directory if needed. Directory
+        must exist if False, see create_directories.
+    :param writer: Pool of threads to write file by. File is written
+        by aiofiles if None.
     :returns: True if no exceptions
     """
-    subdir = os.path.dirname(relative_path)
+    path = get_blob_path(relative_path, temp_dir, create_dirs)
 
-    abs_dir = temp_dir
-    if subdir:
-        abs_dir = temp_dir + os.sep + subdir
-        path = abs_dir + os.sep + os.path.basename(relative_path)
-    else:
-        path = temp_dir + os.sep + os.path.basename(relative_path)
+    logger.info(BraceMessage('Write blob to file: {0}', path))
+    if digest is not None:
+        digest.update(blob_data)
 
-    if not os.path.exists(abs_dir):
-        os.makedirs(abs_dir, exist_ok=True)
+    METRICS.inc('written_files_total')
+    METRICS.inc('written_bytes_total', len(blob_data))
+    with METRICS.timer('write_seconds'):
+        if writer is not None:
+            await writer.write(path, blob_data, is_executable)
+            return True
 
-    msg = 'Write blob to file: {0}'.format(path)
-    logging.info(msg)
-    async with aiofiles.open(path, mode='w+b') as fp:
-        await fp.write(blob_data)
+        async with aiofiles.open(path, mode='w+b') as fp:
+            await fp.write(blob_data)
+
+        if is_executable:
+            set_executable(path)
+
+    return True
+
+
+async def stream_blob_to_file(
+    url: str,
+    sess: aiohttp.ClientSession,
+    relative_path: str,
+    temp_dir: str,
+    is_executable: bool,
+    chunk_size: int,
+    digest: BlobDigest | None = None,
+    retry: RetryPolicy | None = None,
+    create_dirs: bool = True,
+    size: int | None = None,
+) -> bool:
+    r"""Stream blob from blob API to newly created file.
+
+    JSON response is parsed incrementally, \'content\' field is decoded
+    from base64 and written to file chunk by chunk as it arrives.
+
+    :param url: GET response from URL contains blob's data into
+        \'contents\' field encoded in base64.
+    :param sess: Active session object
+    :param relative_path: Relative path to file in the repository.
+    :param temp_dir: Temp directory root. Absolute path.
+    :param is_executable: chmod +x will be invoked if True
+    :param chunk_size: Size of chunk in bytes.
+    :param digest: Digest updated with written data if not None.
+    :param retry: Retry policy of request. Request is sent once if None.
+    :param create_dirs: Create parent directory if needed. Directory
+        must exist if False, see create_directories.
+    :param size: Size of blob from the tree entry, used to reserve
+        bytes of chunked response in concurrency budget.
+    :returns: True if file is written.
+    :raises Exception: Request to URL failed.
+    """
+    path = get_blob_path(relative_path, temp_dir, create_dirs)
+    logger.info(BraceMessage('Stream blob to file: {0}', path))
+    try:
+        encoding = await fetch(
+            sess,
+            url,
+            functools.partial(
+                write_base64_stream,
+                path=path,
+                chunk_size=chunk_size,
+                digest=digest,
+            ),
+            retry,
+            size_hint=get_blob_response_size(size),
+        )
+    except Exception as ex:
+        msg = "Can't grab blob: {0}".format(url)
+        logger.exception(msg)
+        raise ex
+
+    if encoding != 'base64':
+        if encoding is not None:
+            msg = 'stream_blob_to_file. Unsupported encoding: {0}'.format(
+                encoding,
+            )
+            logger.error(msg)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        return False
 
     if is_executable:
-        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        set_executable(path)
 
     return True
 
 
+async def write_base64_stream(
+    response: aiohttp.ClientResponse,
+    path: str,
+    chunk_size: int,
+    digest: BlobDigest | None = None,
+) -> str | None:
+    """Decode blob JSON response body and write content to file.
+
+    File and digest are started from scratch, so the function may be
+    called again for a retried request.
+
+    :param response: Response of blob API.
+    :param path: Path to file.
+    :param chunk_size: Size of chunk in bytes.
+    :param digest: Digest updated with written data if not None.
+    :returns: Encoding of the blob or None if status is not OK or
+        content can't be decoded.
+    """
+    if response.status != HTTPStatus.OK:
+        msg = "Response status: {0}".format(response.status)
+        logger.error(msg)
+        return None
+
+    if digest is not None:
+        digest.reset()
+    decoder = Base64ContentDecoder()
+    stopwatch = Stopwatch()
+    try:
+        async with aiofiles.open(path, mode='w+b') as fp:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                blob_chunk = decoder.feed(chunk)
+                with stopwatch.measure():
+                    await fp.write(blob_chunk)
+                if digest is not None:
+                    digest.update(blob_chunk)
+                METRICS.inc('downloaded_bytes_total', len(chunk))
+                METRICS.inc('decoded_bytes_total', len(blob_chunk))
+                METRICS.inc('written_bytes_total', len(blob_chunk))
+        METRICS.inc('written_files_total')
+        METRICS.observe('write_seconds', stopwatch.elapsed)
+        return decoder.finish().get('encoding')
+    except ValueError:
+        msg = "Can't decode blob: {0}".format(response.url)
+        logger.exception(msg)
+        return None
+
+
+def get_blob_response_size(size: int | None) -> int:
+    """Estimate size of blob API response body.
+
+    :param size: Size of blob from the tree entry.
+    :returns: Size of base64 encoded content and other fields in bytes,
+        0 if size is unknown.
+    """
+    if size is None:
+        return 0
+    return (size + 2) // 3 * 4 + BLOB_JSON_OVERHEAD
+
+
+def get_raw_blob_url(
+    sha: str,
+    relative_path: str,
+    urlp: GiteaUrlParams,
+) -> str:
+    """Get URL of raw file endpoint for file of the ref.
+
+    :param sha: SHA of the HEAD or another ref to read file from.
+    :param relative_path: Relative path to file in the repository.
+    :param urlp: Base URL parameters for repository.
+    :returns: URL of raw contents of the file.
+    """
+    return '{0}/repos/{1}/{2}/raw/{3}?ref={4}'.format(
+        urlp.base_api_url,
+        urlp.owner,
+        urlp.project,
+        quote(relative_path),
+        sha,
+    )
+
+
+async def stream_raw_blob_to_file(
+    url: str,
+    sess: aiohttp.ClientSession,
+    relative_path: str,
+    temp_dir: str,
+    is_executable: bool,
+    chunk_size: int,
+    digest: BlobDigest | None = None,
+    retry: RetryPolicy | None = None,
+    create_dirs: bool = True,
+    size: int | None = None,
+) -> bool:
+    """Stream raw file contents from URL to newly created file.
+
+    Response body is written to disk by chunks, so only one chunk
+    of the file is held in memory.
+
+    :param url: URL of raw file endpoint.
+    :param sess: Active session object
+    :param relative_path: Relative path to file in the repository.
+    :param temp_dir: Temp directory root. Absolute path.
+    :param is_executable: chmod +x will be invoked if True
+    :param chunk_size: Size of chunk in bytes.
+    :param digest: Digest updated with written data if not None.
+    :param retry: Retry policy of request. Request is sent once if None.
+    :param create_dirs: Create parent directory if needed. Directory
+        must exist if False, see create_directories.
+    :param size: Size of blob from the tree entry, used to reserve
+        bytes of chunked response in concurrency budget.
+    :returns: True if file is written, False if caller should fall back
+        to the blob API.
+    """
+    path = get_blob_path(relative_path, temp_dir, create_dirs)
+
+    logger.info(BraceMessage('Stream raw blob to file: {0}', path))
+    try:
+        is_written = await fetch(
+            sess,
+            url,
+            functools.partial(
+                write_raw_stream,
+                path=path,
+                chunk_size=chunk_size,
+                digest=digest,
+            ),
+            retry,
+            size_hint=size or 0,
+        )
+    except Exception:
+        msg = "Can't stream raw blob: {0}".format(url)
+        logger.exception(msg)
+        is_written = False
+
+    if not is_written:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        return False
+
+    if is_executable:
+        set_executable(path)
+
+    return True
+
+
+async def write_raw_stream(
+    response: aiohttp.ClientResponse,
+    path: str,
+    chunk_size: int,
+    digest: BlobDigest | None = None,
+) -> bool:
+    """Write raw file response body to file by chunks.
+
+    File and digest are started from scratch, so the function may be
+    called again for a retried request.
+
+    :param response: Response of raw file endpoint.
+    :param path: Path to file.
+    :param chunk_size: Size of chunk in bytes.
+    :param digest: Digest updated with written data if not None.
+    :returns: True if file is written, False if status is not OK.
+    """
+    if response.status != HTTPStatus.OK:
+        msg = 'Raw response status: {0}, url: {1}'.format(
+            response.status,
+            response.url,
+        )
+        logger.warning(msg)
+        return False
+
+    if digest is not None:
+        digest.reset()
+    stopwatch = Stopwatch()
+    async with aiofiles.open(path, mode='w+b') as fp:
+        async for chunk in response.content.iter_chunked(chunk_size):
+            with stopwatch.measure():
+                await fp.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            METRICS.inc('downloaded_bytes_total', len(chunk))
+            METRICS.inc('written_bytes_total', len(chunk))
+    METRICS.inc('written_files_total')
+    METRICS.observe('write_seconds', stopwatch.elapsed)
+    return True
+
+
+def get_blob_file_path(relative_path: str, temp_dir: str) -> str:
+    """Get absolute path of blob file, create parent directory if needed.
+
+    :param relative_path: Relative path to file in the repository.
+    :param temp_dir: Temp directory root. Absolute path.
+    :returns: Absolute path to file.
+    """
+    path = join_blob_path(relative_path, temp_dir)
+
+    abs_dir = os.path.dirname(path)
+    if not os.path.exists(abs_dir):
+        os.makedirs(abs_dir, exist_ok=True)
+
+    return path
+
+
+def get_blob_path(
+    relative_path: str,
+    temp_dir: str,
+    create_dirs: bool,
+) -> str:
+    """Get absolute path of blob file.
+
+    :param relative_path: Relative path to file in the repository.
+    :param temp_dir: Temp directory root. Absolute path.
+    :param create_dirs: Create parent directory if needed.
+    :returns: Absolute path to file.
+    """
+    if create_dirs:
+        return get_blob_file_path(relative_path, temp_dir)
+    return join_blob_path(relative_path, temp_dir)
+
+
+def plan_directories(relative_paths: Iterable[str]) -> list:
+    """Get parent directories of files ordered by depth.
+
+    :param relative_paths: Relative paths to files in the repository.
+    :returns: Relative paths of all parent directories, each parent
+        goes before its subdirectories.
+    """
+    directories = set()
+    for relative_path in relative_paths:
+        parent = posixpath.dirname(relative_path)
+        while parent and parent not in directories:
+            directories.add(parent)
+            parent = posixpath.dirname(parent)
+    return sorted(
+        directories,
+        key=lambda directory: (directory.count('/'), directory),
+    )
+
+
+def create_directories(plan: Iterable[str], temp_dir: str) -> None:
+    """Create directories of plan, parents first.
+
+    :param plan: Relative paths of directories ordered by depth,
+        see plan_directories.
+    :param temp_dir: Temp directory root. Absolute path.
+    """
+    for directory in plan:
+        try:
+            os.mkdir(join_blob_path(directory, temp_dir))
+        except FileExistsError:
+            continue
+
+
+def join_blob_path(relative_path: str, temp_dir: str) -> str:
+    """Get absolute path of blob file.
+
+    :param relative_path: Relative path to file in the repository.
+    :param temp_dir: Temp directory root. Absolute path.
+    :returns: Absolute path to file.
+    """
+    subdir = os.path.dirname(relative_path)
+    filename = os.path.basename(relative_path)
+    if subdir:
+        return temp_dir + os.sep + subdir + os.sep + filename
+    return temp_dir + os.sep + filename
+
+
+def set_executable(path: str) -> None:
+    """Invoke chmod +x for file.
+
+    :param path: Path to file.
+    """
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+def apply_mode(path: str, mode: str) -> None:
+    """Set or clear executable bits of file according to git mode.
+
+    :param path: Path to file.
+    :param mode: Git mode of the blob. For example 100755.
+    """
+    st_mode = os.stat(path).st_mode
+    if mode == EXECUTABLE_MODE:
+        os.chmod(path, st_mode | stat.S_IEXEC)
+    else:
+        os.chmod(path, st_mode & ~EXECUTABLE_BITS)
+
+
 def check_mode(ref: dict, page: int) -> bool:
     """Check blob mode and ignore symbolic link.
 
@@ -91,15 +533,16 @@ def check_mode(ref: dict, page: int) -> bool:
         group writable), 100755(executable).
         False for 120000 (symbolic link) and other types.
     """
-    path = ref.get('path')
-    sha = ref.get('sha')
     mode = ref.get('mode')
 
-    if mode not in {'100644', '100664', '100755'}:
-        s0 = 'Page {0}. Skipping blob. path: {1}'.format(page, path)
-        s1 = ', mode: {0}, SHA: {1}'.format(mode, sha)
-        s0 = '{0}{1}'.format(s0, s1)
-        logging.info(s0)
+    if mode not in FILE_MODES:
+        logger.info(BraceMessage(
+            SKIP_BLOB_FORMAT,
+            page,
+            ref.get('path'),
+            mode,
+            ref.get('sha'),
+        ))
         return False
     return True
 
@@ -111,15 +554,12 @@ def print_blob_info(ref: dict, page: int) -> None:
     :param page: Page number (paginated reading of the git refs tree)
         for log output.
     """
-    str0 = 'Page {0}. Processing blob. path: {1}, mode: {2}, '.format(
+    logger.info(BraceMessage(
+        BLOB_INFO_FORMAT,
         page,
         ref.get('path'),
         ref.get('mode'),
-    )
-    str1 = 'SHA: {0}, size: {1}, url: {2}'.format(
         ref.get('sha'),
         ref.get('size'),
         ref.get('url'),
-    )
-    msg = '{0}{1}'.format(str0, str1)
-    logging.info(msg)
+    ))
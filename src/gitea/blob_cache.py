@@ -0,0 +1,175 @@
+"""Persistent content-addressed cache of blob files."""
+
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+from typing import Iterator
+
+from gitea.blob_digest import BlobDigest
+from gitea.config import BLOB_CACHE_MAX_SIZE
+from gitea.log_message import BraceMessage
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+LOCK_FILE = '.lock'
+TEMP_PREFIX = '.tmp'
+COPY_BLOCK_SIZE = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+class BlobCache(object):
+    """Cache of blob files on disk keyed by git blob SHA.
+
+    Git blob SHA is immutable, so cached file never changes once
+    stored. Entries are added by atomic rename and eviction runs
+    under an exclusive file lock, so several processes may share
+    the cache directory. Least recently used entries (by mtime) are
+    evicted when total size exceeds max_size.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_size: int = BLOB_CACHE_MAX_SIZE,
+    ) -> None:
+        """Open cache directory, create it if not exists.
+
+        :param directory: Root directory of the cache.
+        :param max_size: Size cap of the cache in bytes.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def get_path(self, sha: str) -> str:
+        """Get path of cache entry for blob.
+
+        :param sha: Git blob SHA.
+        :returns: Absolute path of cached file.
+        """
+        return os.path.join(self.directory, sha[:2], sha)
+
+    def restore(
+        self,
+        sha: str,
+        path: str,
+        digest: BlobDigest | None = None,
+    ) -> bool:
+        """Copy cached blob to path.
+
+        :param sha: Git blob SHA.
+        :param path: Destination file path.
+        :param digest: Digest updated with copied data if not None.
+        :returns: True if blob was found in the cache.
+        """
+        cached_path = self.get_path(sha)
+        try:
+            if digest is None:
+                shutil.copyfile(cached_path, path)
+            else:
+                copy_with_digest(cached_path, path, digest)
+            os.utime(cached_path)
+        except FileNotFoundError:
+            return False
+
+        logger.info(BraceMessage('Blob {0} restored from cache', sha))
+        return True
+
+    def store(self, sha: str, path: str) -> None:
+        """Copy file to the cache as blob with SHA.
+
+        :param sha: Git blob SHA.
+        :param path: Path to file with blob data.
+        """
+        cached_path = self.get_path(sha)
+        if os.path.exists(cached_path):
+            return
+
+        cached_dir = os.path.dirname(cached_path)
+        os.makedirs(cached_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cached_dir, prefix=TEMP_PREFIX)
+        os.close(fd)
+        shutil.copyfile(path, temp_path)
+        os.replace(temp_path, cached_path)
+
+        self._size += os.path.getsize(cached_path)
+        if self._size > self.max_size:
+            self.evict()
+
+    def discard(self, sha: str) -> None:
+        """Remove blob from the cache, for example a corrupted one.
+
+        :param sha: Git blob SHA.
+        """
+        cached_path = self.get_path(sha)
+        try:
+            size = os.path.getsize(cached_path)
+            os.remove(cached_path)
+        except FileNotFoundError:
+            return
+
+        self._size -= size
+        msg = 'Discard blob from cache: {0}'.format(cached_path)
+        logger.warning(msg)
+
+    def evict(self) -> None:
+        """Remove least recently used entries until size fits the cap."""
+        with self._lock():
+            entries = sorted(self._entries())
+            self._size = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if self._size <= self.max_size:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                self._size -= size
+
+                msg = 'Evict blob from cache: {0}'.format(path)
+                logger.info(msg)
+
+    def _entries(self) -> Iterator[tuple]:
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.startswith(TEMP_PREFIX):
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    st = entry.stat()
+                    yield st.st_mtime_ns, st.st_size, entry.path
+
+    @contextlib.contextmanager
+    def _lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+
+        with open(os.path.join(self.directory, LOCK_FILE), 'w') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def copy_with_digest(src_path: str, dst_path: str, digest: BlobDigest) -> None:
+    """Copy file updating digest with its data.
+
+    :param src_path: Path to source file.
+    :param dst_path: Path to destination file.
+    :param digest: Digest updated with copied data.
+    """
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        while True:
+            block = src.read(COPY_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            dst.write(block)
@@ -0,0 +1,58 @@
+"""Digests of blob data calculated while blob is written."""
+
+import hashlib
+
+
+class BlobDigest(object):
+    """Digests updated by chunks of blob data passing to disk.
+
+    SHA-256 of data is always calculated. If git_size is set, git blob
+    SHA-1 (sha1 of "blob <size>\\0" header and data) is calculated too,
+    so data can be verified against SHA of the tree entry without
+    an extra pass over the data.
+    """
+
+    def __init__(self, git_size: int | None = None) -> None:
+        """Create empty digest.
+
+        :param git_size: Size of blob from the tree entry. Git blob
+            SHA-1 is not calculated if None.
+        """
+        self.git_size = git_size
+        self.reset()
+
+    def reset(self) -> None:
+        """Drop data passed so far, for example before download retry."""
+        self._sha256 = hashlib.sha256()
+        self._git_sha1 = None
+        if self.git_size is not None:
+            self._git_sha1 = hashlib.sha1(
+                'blob {0}\0'.format(self.git_size).encode('ascii'),
+                usedforsecurity=False,
+            )
+
+    def update(self, data: bytes) -> None:
+        """Update digest with next chunk of data.
+
+        :param data: Next chunk of blob data.
+        """
+        self._sha256.update(data)
+        if self._git_sha1 is not None:
+            self._git_sha1.update(data)
+
+    def hexdigest(self) -> str:
+        """Get SHA-256 of data passed so far.
+
+        :returns: Hex SHA-256 hash.
+        """
+        return self._sha256.hexdigest()
+
+    def verify(self, sha: str) -> bool:
+        """Check git blob SHA-1 of data passed so far.
+
+        :param sha: Expected git blob SHA from the tree entry.
+        :returns: True if SHA matches or git SHA-1 is not calculated.
+        """
+        if self._git_sha1 is None:
+            return True
+        return self._git_sha1.hexdigest() == sha
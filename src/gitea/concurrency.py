@@ -0,0 +1,115 @@
+"""Global limits of in-flight requests and bytes shared by repositories."""
+
+import asyncio
+import collections
+
+from gitea.config import MAX_INFLIGHT_BYTES, MAX_INFLIGHT_REQUESTS
+
+
+class FairSemaphore(object):
+    """Semaphore serving waiters of different keys in round-robin order.
+
+    Each key (for example a repository) has its own queue of waiters.
+    When capacity is released, the next waiter is taken from the key
+    that was served longest ago, so one key with many waiters can't
+    starve the others.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        """Init semaphore.
+
+        :param capacity: Total amount shared by all keys.
+        """
+        self.capacity = capacity
+        self._available = capacity
+        self._waiters = collections.OrderedDict()
+
+    @property
+    def available(self) -> int:
+        """Amount not acquired by anybody.
+
+        :returns: Available amount.
+        """
+        return self._available
+
+    async def acquire(self, key: str, amount: int = 1) -> int:
+        """Wait for turn of the key and for enough capacity.
+
+        :param key: Key of waiter.
+        :param amount: Amount to acquire. Capped by capacity.
+        :returns: Acquired amount to pass to release.
+        :raises CancelledError: Waiting is cancelled.
+        """
+        amount = min(amount, self.capacity)
+        if not self._waiters and amount <= self._available:
+            self._available -= amount
+            return amount
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, collections.deque()).append(
+            (amount, future),
+        )
+        try:
+            await future
+        except asyncio.CancelledError as ex:
+            if future.done() and not future.cancelled():
+                self.release(amount)
+            else:
+                self._remove(key, (amount, future))
+            raise ex
+        return amount
+
+    def release(self, amount: int = 1) -> None:
+        """Return amount and wake up next waiters.
+
+        :param amount: Amount returned by acquire.
+        """
+        self._available += amount
+        self._wake()
+
+    def _remove(self, key: str, waiter: tuple) -> None:
+        waiters = self._waiters.get(key)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            self._waiters.pop(key)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            key, waiters = next(iter(self._waiters.items()))
+            amount, future = waiters[0]
+            if future.done():
+                # Cancelled waiter is removed before its task runs
+                waiters.popleft()
+                if not waiters:
+                    self._waiters.pop(key)
+                continue
+            if amount > self._available:
+                return
+
+            waiters.popleft()
+            self._waiters.pop(key)
+            if waiters:
+                self._waiters[key] = waiters
+            self._available -= amount
+            future.set_result(None)
+
+
+class ConcurrencyBudget(object):
+    """Limits of requests and response bytes in flight of all keys."""
+
+    def __init__(
+        self,
+        max_requests: int = MAX_INFLIGHT_REQUESTS,
+        max_bytes: int = MAX_INFLIGHT_BYTES,
+    ) -> None:
+        """Init budget.
+
+        :param max_requests: Max number of requests in flight.
+        :param max_bytes: Max total size of response bodies being read.
+            Response larger than max_bytes takes the whole budget.
+        """
+        self.requests = FairSemaphore(max_requests)
+        self.bytes = FairSemaphore(max_bytes)
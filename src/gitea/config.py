@@ -5,4 +5,37 @@ PROJECT_OWNER = 'radium'
 PROJECT = 'project-configuration'
 REF_HEAD = 'refs/heads/master'
 REFS_PER_PAGE = 5
+MAX_REFS_PER_PAGE = 10000
 PARALLEL_DOWNLOADS = 3
+PARALLEL_BLOB_DOWNLOADS = 8
+RAW_BLOB_DOWNLOADS = False
+BLOB_CHUNK_SIZE = 65536
+STREAM_BLOB_DOWNLOADS = False
+BLOB_CACHE_DIR = ''
+BLOB_CACHE_MAX_SIZE = 1 << 30
+HTTP_CACHE_DIR = ''
+VERIFY_BLOBS = False
+VERIFY_RETRIES = 2
+HASH_MANIFEST_PATH = ''
+CONNECTIONS_LIMIT = 100
+CONNECTIONS_PER_HOST = 32
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+TOTAL_TIMEOUT = 0
+CONNECT_TIMEOUT = 30
+READ_TIMEOUT = 60
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+RETRY_BUDGET = 100
+MAX_RETRY_AFTER = 120
+RATE_LIMIT = 0
+RATE_BURST = 10
+FILE_WRITER_THREADS = 4
+FILE_WRITER_QUEUE_SIZE = 64
+ARCHIVE_DOWNLOADS = False
+ARCHIVE_QUEUE_SIZE = 16
+MAX_INFLIGHT_REQUESTS = 64
+MAX_INFLIGHT_BYTES = 256 << 20
+RUN_REPORT_PATH = ''
+PROMETHEUS_REPORT_PATH = ''
@@ -0,0 +1,50 @@
+"""Helper class with fetching options of the gitea package."""
+
+from dataclasses import dataclass
+
+from gitea.blob_cache import BlobCache
+from gitea.config import (
+    BLOB_CHUNK_SIZE,
+    RAW_BLOB_DOWNLOADS,
+    STREAM_BLOB_DOWNLOADS,
+    VERIFY_BLOBS,
+    VERIFY_RETRIES,
+)
+from gitea.file_writer import FileWriter
+from gitea.http_cache import HttpCache
+from gitea.json_loads import DEFAULT_LOADS, JsonLoads
+from gitea.retry import RetryPolicy
+
+
+@dataclass
+class GiteaFetchParams(object):
+    """Shared readonly parameters for fetching of blobs and trees.
+
+    :cvar raw_blobs: Download blobs from raw file endpoint streaming
+        response body to disk. Blob API is used as a fallback.
+    :cvar stream_blobs: Parse blob API response incrementally and write
+        decoded content to disk by chunks instead of loading whole blob.
+    :cvar chunk_size: Size of chunk in bytes for streamed downloads.
+    :cvar verify_blobs: Verify git blob SHA-1 of data while it is written.
+    :cvar verify_retries: Number of download retries on SHA-1 mismatch.
+    :cvar blob_cache: Local cache of blobs consulted before download.
+        Cache is not used if None.
+    :cvar http_cache: Cache of refs and tree pages JSON responses used for
+        conditional requests. Cache is not used if None.
+    :cvar retry: Retry policy and rate limiter shared by all requests.
+        Requests are sent once if None.
+    :cvar loads: Decoder of JSON from raw bytes of response body.
+    :cvar writer: Pool of threads writing downloaded blobs. Blobs are
+        written by aiofiles if None.
+    """
+
+    raw_blobs: bool = RAW_BLOB_DOWNLOADS
+    stream_blobs: bool = STREAM_BLOB_DOWNLOADS
+    chunk_size: int = BLOB_CHUNK_SIZE
+    verify_blobs: bool = VERIFY_BLOBS
+    verify_retries: int = VERIFY_RETRIES
+    blob_cache: BlobCache | None = None
+    http_cache: HttpCache | None = None
+    retry: RetryPolicy | None = None
+    loads: JsonLoads = DEFAULT_LOADS
+    writer: FileWriter | None = None
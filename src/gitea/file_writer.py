@@ -0,0 +1,108 @@
+"""Pool of threads writing blob files to disk."""
+
+import asyncio
+import logging
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+from gitea.config import FILE_WRITER_QUEUE_SIZE, FILE_WRITER_THREADS
+
+logger = logging.getLogger(__name__)
+
+
+class FileWriter(object):
+    """Write files by a sized pool of threads fed by a bounded queue.
+
+    Each file is opened, written, made executable and closed by one
+    call in a worker thread. Writers wait for a free place in the queue,
+    so downloads are slowed down when disk falls behind.
+    """
+
+    def __init__(
+        self,
+        threads: int = FILE_WRITER_THREADS,
+        queue_size: int = FILE_WRITER_QUEUE_SIZE,
+    ) -> None:
+        """Init writer. Use it as async context manager to run workers.
+
+        :param threads: Number of worker threads.
+        :param queue_size: Max number of files waiting to be written.
+        """
+        self.threads = threads
+        self._queue = asyncio.Queue(queue_size)
+        self._pool = None
+        self._workers = []
+
+    async def __aenter__(self) -> 'FileWriter':
+        """Start worker threads.
+
+        :returns: Started writer.
+        """
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.threads,
+            thread_name_prefix='file-writer',
+        )
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self.threads)
+        ]
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        """Wait for queued files and stop worker threads.
+
+        :param exc_info: Exception raised in the context if any.
+        """
+        if exc_info[0] is None:
+            await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._pool.shutdown()
+
+    async def write(self, path: str, data: bytes, is_executable: bool) -> None:
+        """Queue file and wait until it is written.
+
+        :param path: Path to file. Parent directory must exist.
+        :param data: Contents of file.
+        :param is_executable: chmod +x will be invoked if True
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((path, data, is_executable, future))
+        await future
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            path, data, is_executable, future = await self._queue.get()
+            try:
+                await loop.run_in_executor(
+                    self._pool,
+                    write_file,
+                    path,
+                    data,
+                    is_executable,
+                )
+            except Exception as ex:
+                msg = "Can't write file: {0}".format(path)
+                logger.exception(msg)
+                if not future.done():
+                    future.set_exception(ex)
+            else:
+                if not future.done():
+                    future.set_result(None)
+            finally:
+                self._queue.task_done()
+
+
+def write_file(path: str, data: bytes, is_executable: bool) -> None:
+    """Write file and set executable bit in one blocking call.
+
+    :param path: Path to file.
+    :param data: Contents of file.
+    :param is_executable: chmod +x will be invoked if True
+    """
+    with open(path, 'wb') as fp:
+        fp.write(data)
+    if is_executable:
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
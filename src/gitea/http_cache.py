@@ -0,0 +1,154 @@
+"""Conditional GET requests with responses cached on disk."""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from http import HTTPStatus
+
+import aiohttp
+
+from gitea.json_loads import DEFAULT_LOADS, JsonLoads
+from gitea.metrics import METRICS
+from gitea.retry import RetryPolicy, fetch
+
+ENTRY_SUFFIX = '.entry'
+ETAG = 'ETag'
+LAST_MODIFIED = 'Last-Modified'
+
+
+class HttpCache(object):
+    """Cache of JSON responses with their validators (ETag, Last-Modified).
+
+    Validators and body of the response are stored in one file named
+    by SHA-256 of the URL: validators as JSON on the first line, body
+    after it. The file is replaced atomically, so validators always
+    match the body they were sent with.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """Open cache directory, create it if not exists.
+
+        :param directory: Root directory of the cache.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def load(self, url: str) -> tuple | None:
+        """Load cached response.
+
+        :param url: Requested URL.
+        :returns: If-None-Match and If-Modified-Since headers for
+            conditional request and body of cached response or None
+            if not found.
+        """
+        try:
+            with open(self._get_path(url), 'rb') as fp:
+                validators = json.loads(fp.readline())
+                body = fp.read()
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            msg = 'Cached response is corrupted: {0}'.format(url)
+            logging.warning(msg)
+            return None
+
+        headers = {}
+        if validators.get(ETAG):
+            headers['If-None-Match'] = validators.get(ETAG)
+        if validators.get(LAST_MODIFIED):
+            headers['If-Modified-Since'] = validators.get(LAST_MODIFIED)
+        return headers, body
+
+    def store(self, url: str, headers: dict, body: bytes) -> None:
+        """Store response body with its validators.
+
+        Response without validators is not stored.
+
+        :param url: Requested URL.
+        :param headers: Response headers.
+        :param body: Response body.
+        """
+        validators = {
+            name: headers.get(name)
+            for name in (ETAG, LAST_MODIFIED)
+            if headers.get(name)
+        }
+        if not validators:
+            return
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(json.dumps(validators).encode('utf-8'))
+            fp.write(b'\n')
+            fp.write(body)
+        os.replace(temp_path, self._get_path(url))
+
+    def _get_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '{0}{1}'.format(key, ENTRY_SUFFIX))
+
+
+async def get_json(
+    url: str,
+    sess: aiohttp.ClientSession,
+    http_cache: HttpCache | None = None,
+    retry: RetryPolicy | None = None,
+    loads: JsonLoads = DEFAULT_LOADS,
+) -> tuple:
+    """GET JSON from URL, send conditional request if cached.
+
+    Cached body is reused if server responds with 304 Not Modified.
+
+    :param url: Requested URL.
+    :param sess: Active session.
+    :param http_cache: Cache of responses. Plain GET is sent if None.
+    :param retry: Retry policy of request. Request is sent once if None.
+    :param loads: Decoder of JSON from raw bytes of response body.
+    :returns: Response status and parsed JSON. JSON is None if status
+        is not OK.
+    """
+    cached = None
+    if http_cache is not None:
+        cached = await asyncio.to_thread(http_cache.load, url)
+    headers = {} if cached is None else cached[0]
+
+    status, response_headers, body = await fetch(
+        sess,
+        url,
+        read_ok_body,
+        retry,
+        headers,
+    )
+    if status == HTTPStatus.OK:
+        METRICS.inc('downloaded_bytes_total', len(body))
+        if http_cache is not None:
+            await asyncio.to_thread(
+                http_cache.store,
+                url,
+                response_headers,
+                body,
+            )
+        with METRICS.timer('decode_seconds'):
+            return status, loads(body)
+
+    if status == HTTPStatus.NOT_MODIFIED and cached is not None:
+        msg = 'Not modified, use cached response: {0}'.format(url)
+        logging.info(msg)
+        return HTTPStatus.OK, loads(cached[1])
+
+    return status, None
+
+
+async def read_ok_body(response: aiohttp.ClientResponse) -> tuple:
+    """Read body of response with OK status.
+
+    :param response: Response.
+    :returns: Status, headers and body of response. Body is None
+        if status is not OK.
+    """
+    if response.status != HTTPStatus.OK:
+        return response.status, response.headers, None
+    return response.status, response.headers, await response.read()
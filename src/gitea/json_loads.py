@@ -0,0 +1,25 @@
+"""Pluggable JSON decoder of gitea responses."""
+
+import json
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+JsonLoads = Callable[[bytes], Any]
+
+
+def get_default_loads() -> JsonLoads:
+    """Get fastest available decoder of JSON bytes.
+
+    :returns: orjson.loads if orjson is installed, json.loads otherwise.
+        Both accept raw bytes of response body.
+    """
+    if orjson is not None:
+        return orjson.loads
+    return json.loads
+
+
+DEFAULT_LOADS = get_default_loads()
@@ -0,0 +1,27 @@
+"""Lazily formatted log messages."""
+
+
+class BraceMessage(object):
+    """Log message formatted by str.format only when it is emitted.
+
+    Arguments are formatted in the thread of the log handler, so they
+    must not be changed after logging.
+    """
+
+    __slots__ = ('fmt', 'args')
+
+    def __init__(self, fmt: str, *args) -> None:
+        """Keep format string and arguments.
+
+        :param fmt: Format string with {0} style fields.
+        :param args: Arguments of format string.
+        """
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self) -> str:
+        """Format message.
+
+        :returns: Formatted message.
+        """
+        return self.fmt.format(*self.args)
@@ -0,0 +1,299 @@
+"""Counters, gauges and latency histograms of a run."""
+
+import contextlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from typing import Iterator
+
+LATENCY_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+PROMETHEUS_PREFIX = 'gitea_sync_'
+# Report files are read by scrapers running as other users
+REPORT_FILE_MODE = 0o644
+
+
+class Histogram(object):
+    """Histogram of observed values with fixed buckets."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS) -> None:
+        """Init empty histogram.
+
+        :param buckets: Upper bounds of buckets in ascending order.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Add value to histogram.
+
+        :param value: Observed value.
+        """
+        index = len(self.buckets)
+        for bucket_index, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = bucket_index
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self) -> Iterator[tuple]:
+        """Iterate cumulative counts of buckets.
+
+        :yields: Tuple of upper bound and number of values not greater.
+        """
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            yield bound, total
+
+    def to_dict(self) -> dict:
+        """Get summary and cumulative buckets of histogram.
+
+        :returns: JSON serializable dict.
+        """
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0,
+            'max': self.max,
+            'buckets': {
+                format_bound(bound): total
+                for bound, total in self.cumulative()
+            },
+        }
+
+
+class Stopwatch(object):
+    """Total duration of several blocks, for example writes of chunks."""
+
+    def __init__(self) -> None:
+        """Init stopwatch with zero duration."""
+        self.elapsed = 0.0
+
+    @contextlib.contextmanager
+    def measure(self) -> Iterator[None]:
+        """Add duration of the block in seconds.
+
+        :yields: Nothing.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+class Metrics(object):
+    """Registry of metrics of a run, safe to update from threads.
+
+    Metrics recorded in worker processes (process pool of sha256)
+    are not collected.
+    """
+
+    def __init__(self) -> None:
+        """Init empty registry."""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Drop all metrics, start new run."""
+        with self._lock:
+            self.started = time.monotonic()
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+    def inc(self, name: str, amount: float = 1) -> None:
+        """Increment counter.
+
+        :param name: Name of counter.
+        :param amount: Increment.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name: str, value: float) -> None:
+        """Set gauge.
+
+        :param name: Name of gauge.
+        :param value: Value of gauge.
+        """
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """Add value to histogram.
+
+        :param name: Name of histogram.
+        :param value: Observed value.
+        """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[name] = histogram
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Observe duration of the block in seconds.
+
+        :param name: Name of histogram.
+        :yields: Nothing.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def in_flight(self, name: str) -> Iterator[None]:
+        """Count the block in gauge, keep max of gauge in name_max.
+
+        :param name: Name of gauge.
+        :yields: Nothing.
+        """
+        max_name = '{0}_max'.format(name)
+        with self._lock:
+            current = self.gauges.get(name, 0) + 1
+            self.gauges[name] = current
+            self.gauges[max_name] = max(self.gauges.get(max_name, 0), current)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.gauges[name] -= 1
+
+    def to_dict(self, parameters: dict | None = None) -> dict:
+        """Get run report.
+
+        :param parameters: Parameters of the run added to the report.
+        :returns: JSON serializable dict.
+        """
+        with self._lock:
+            return {
+                'elapsed_seconds': time.monotonic() - self.started,
+                'parameters': parameters or {},
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items())),
+                'histograms': {
+                    name: histogram.to_dict()
+                    for name, histogram in sorted(self.histograms.items())
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """Get metrics in Prometheus text format.
+
+        :returns: Text of metrics.
+        """
+        lines = []
+        with self._lock:
+            for name, counter in sorted(self.counters.items()):
+                lines.extend(format_sample(name, 'counter', counter))
+            for name, gauge in sorted(self.gauges.items()):
+                lines.extend(format_sample(name, 'gauge', gauge))
+            for name, histogram in sorted(self.histograms.items()):
+                lines.extend(format_histogram(name, histogram))
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def format_bound(bound: float) -> str:
+    """Format upper bound of bucket like Prometheus.
+
+    :param bound: Upper bound.
+    :returns: Label value.
+    """
+    if bound == math.inf:
+        return '+Inf'
+    return str(bound)
+
+
+def format_sample(name: str, kind: str, sample: float) -> list:
+    """Format counter or gauge in Prometheus text format.
+
+    :param name: Name of metric.
+    :param kind: Type of metric: counter or gauge.
+    :param sample: Value of metric.
+    :returns: Lines of text.
+    """
+    full_name = '{0}{1}'.format(PROMETHEUS_PREFIX, name)
+    return [
+        '# TYPE {0} {1}'.format(full_name, kind),
+        '{0} {1}'.format(full_name, sample),
+    ]
+
+
+def format_histogram(name: str, histogram: Histogram) -> list:
+    """Format histogram in Prometheus text format.
+
+    :param name: Name of metric.
+    :param histogram: Histogram.
+    :returns: Lines of text.
+    """
+    full_name = '{0}{1}'.format(PROMETHEUS_PREFIX, name)
+    lines = ['# TYPE {0} histogram'.format(full_name)]
+    for bound, total in histogram.cumulative():
+        lines.append('{0}_bucket{{le="{1}"}} {2}'.format(
+            full_name,
+            format_bound(bound),
+            total,
+        ))
+    lines.append('{0}_sum {1}'.format(full_name, histogram.sum))
+    lines.append('{0}_count {1}'.format(full_name, histogram.count))
+    return lines
+
+
+def write_text(path: str, text: str) -> None:
+    """Write file atomically, so scrapers never read partial file.
+
+    File is readable by all users (temporary file is created with
+    owner-only permissions, which os.replace keeps).
+
+    :param path: Path to file.
+    :param text: Contents of file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+        fp.write(text)
+    os.chmod(temp_path, REPORT_FILE_MODE)
+    os.replace(temp_path, path)
+
+
+def write_report(
+    metrics: Metrics,
+    report_path: str | None = None,
+    prometheus_path: str | None = None,
+    parameters: dict | None = None,
+) -> dict:
+    """Write JSON run report and optional Prometheus file.
+
+    :param metrics: Metrics of the run.
+    :param report_path: Path to JSON report. Not written if None.
+    :param prometheus_path: Path to Prometheus text file.
+        Not written if None.
+    :param parameters: Parameters of the run added to the report.
+    :returns: Report dict.
+    """
+    report = metrics.to_dict(parameters)
+    if report_path is not None:
+        write_text(report_path, json.dumps(report, indent=2))
+    if prometheus_path is not None:
+        write_text(prometheus_path, metrics.to_prometheus())
+    return report
+
+
+METRICS = Metrics()
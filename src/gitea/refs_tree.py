@@ -1,19 +1,40 @@
 """Functions for parsing of list of git refs through REST API."""
 
 import asyncio
+import collections
+import dataclasses
 import logging
+import os
+from typing import AsyncIterator, Iterable
 
 import aiohttp
 
 from gitea.blob import (
+    EXECUTABLE_MODE,
+    BlobDownloadError,
+    BlobIntegrityError,
     check_mode,
+    create_directories,
     get_blob_data,
+    get_raw_blob_url,
+    join_blob_path,
+    plan_directories,
     print_blob_info,
+    set_executable,
+    stream_blob_to_file,
+    stream_raw_blob_to_file,
     write_blob_to_file,
 )
-from gitea.config import PARALLEL_DOWNLOADS
+from gitea.blob_digest import BlobDigest
+from gitea.config import PARALLEL_BLOB_DOWNLOADS, PARALLEL_DOWNLOADS
+from gitea.fetch_params import GiteaFetchParams
+from gitea.http_cache import get_json
+from gitea.log_message import BraceMessage
+from gitea.metrics import METRICS
 from gitea.url_params import GiteaUrlParams
 
+logger = logging.getLogger(__name__)
+
 
 async def process_tree_refs_pages(
     sha: str,
@@ -21,36 +42,101 @@ async def process_tree_refs_pages(
     urlp: GiteaUrlParams,
     temp_dir: str,
     num_parallel: int = PARALLEL_DOWNLOADS,
-) -> None:
+    num_blob_parallel: int = PARALLEL_BLOB_DOWNLOADS,
+    fetchp: GiteaFetchParams | None = None,
+) -> dict:
     """GET information (paginated) for HEAD or selected ref.
 
     GET ref tree info from gitea repository and parse each ref file entry.
     Decode blobs for files and restore directory structure.
     Load each file to corresponding subdirectory in the temp
-    directory.
+    directory. Pages are processed by a sliding window: a new page
+    is started as soon as any running page finishes, so exactly
+    num_parallel pages are in flight while pages remain. If any page
+    fails, running pages are cancelled and awaited before the error is
+    raised. SHA-256 of each file is calculated while the file is written.
 
     :param sha: SHA of the HEAD or another ref to parse.
     :param sess: Active session.
     :param urlp: Base URL parameters for repository (pagination etc.).
     :param temp_dir: Temporary directory for files loading.
-    :param num_parallel: Number of async aiohttp requests and tasks.
+    :param num_parallel: Number of tree pages processed concurrently.
+    :param num_blob_parallel: Number of blobs downloaded concurrently.
+        The limit is shared by blobs of all pages.
+    :param fetchp: Fetching parameters. Defaults are used if None.
+    :returns: Manifest dict of SHA-256 hashes by absolute file path.
+    :raises ValueError: Tree or its page is not available.
+    :raises BlobDownloadError: Blob is not written after all retries.
     """
-    pages_count = await get_tree_refs_pages_count(sha, sess, urlp)
+    if fetchp is None:
+        fetchp = GiteaFetchParams()
+
+    urlp, pages_count, first_tree, total_count = await get_tree_first_page(
+        sha,
+        sess,
+        urlp,
+        fetchp,
+    )
+    if total_count is None:
+        raise ValueError('Tree {0} is not available'.format(sha))
+    blob_semaphore = asyncio.Semaphore(num_blob_parallel)
 
-    i0 = 1
-    while i0 <= pages_count:
-        j0 = i0
+    manifest = {}
+    pending = {}
+    next_page = 1
+    done_count = 0
+    try:
+        while next_page <= pages_count or pending:
+            while next_page <= pages_count and len(pending) < num_parallel:
+                task = asyncio.create_task(
+                    process_tree_refs_page(
+                        sha,
+                        sess,
+                        temp_dir,
+                        urlp,
+                        next_page,
+                        blob_semaphore=blob_semaphore,
+                        fetchp=fetchp,
+                        tree=first_tree if next_page == 1 else None,
+                    ),
+                )
+                pending[task] = next_page
+                next_page += 1
 
-        tasks = []
-        while j0 < i0 + num_parallel and j0 <= pages_count:
-            task = asyncio.create_task(
-                process_tree_refs_page(sha, sess, temp_dir, urlp, page=j0),
+            done, _ = await asyncio.wait(
+                pending,
+                return_when=asyncio.FIRST_COMPLETED,
             )
-            tasks.append(task)
-            j0 += 1
+            for task in done:
+                page = pending.pop(task)
+                if task.exception() is not None:
+                    raise task.exception()
+                manifest.update(task.result())
+                done_count += 1
+                logger.info(BraceMessage(
+                    'Page {0} done ({1}/{2})',
+                    page,
+                    done_count,
+                    pages_count,
+                ))
+    finally:
+        await cancel_tasks(pending)
+
+    return manifest
+
 
-        await asyncio.gather(*tasks)
-        i0 += num_parallel
+async def cancel_tasks(tasks: Iterable[asyncio.Task]) -> None:
+    """Cancel tasks and wait until they finish.
+
+    Cancelled tasks no longer write files or hold shared limits when
+    this function returns. Finished tasks are not affected.
+
+    :param tasks: Tasks to cancel.
+    """
+    tasks = list(tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
 
 async def process_tree_refs_page(
@@ -59,39 +145,281 @@ async def process_tree_refs_page(
     temp_dir: str,
     urlp: GiteaUrlParams,
     page: int,
-) -> None:
+    blob_semaphore: asyncio.Semaphore | None = None,
+    fetchp: GiteaFetchParams | None = None,
+    tree: list | None = None,
+) -> dict:
     r"""Parse each ref with type \'blob\' from the selected page.
 
     Each blob data grabbed from remote and saved to disk with relative
-    path from remote.
+    path from remote. Parent directories of all blobs of the page are
+    created once before downloads. Blobs of the page are downloaded
+    concurrently, the number of blobs in flight is bounded by
+    blob_semaphore.
     :param sha: SHA of the HEAD or another ref to parse.
     :param sess: Active session.
     :param temp_dir: Temporary directory for files loading.
     :param urlp: Base URL parameters for repository (pagination etc.).
     :param page: Page number for paginated request
+    :param blob_semaphore: Limit of concurrent blob downloads shared
+        between pages. New limit of PARALLEL_BLOB_DOWNLOADS is used if None.
+    :param fetchp: Fetching parameters. Defaults are used if None.
+    :param tree: Already fetched entries of the page. Page is requested
+        if None.
+    :returns: Manifest dict of SHA-256 hashes by absolute file path.
     """
-    msg = 'Processing page: {0}'.format(page)
-    logging.info(msg)
+    logger.info(BraceMessage('Processing page: {0}', page))
 
-    fl = filter(
-        lambda rf: rf.get('type') == 'blob',
-        await get_tree_data(sha, sess, urlp, page),
+    if blob_semaphore is None:
+        blob_semaphore = asyncio.Semaphore(PARALLEL_BLOB_DOWNLOADS)
+    if fetchp is None:
+        fetchp = GiteaFetchParams()
+
+    if tree is None:
+        tree = await get_tree_data(sha, sess, urlp, page, fetchp)
+
+    refs = [
+        ref for ref in tree
+        if ref.get('type') == 'blob' and check_mode(ref, page)
+    ]
+    await asyncio.to_thread(
+        create_directories,
+        plan_directories(ref.get('path') for ref in refs),
+        temp_dir,
     )
 
-    while True:
-        try:
-            ref = next(fl)
-        except StopIteration:
-            break
-        if check_mode(ref, page):
-            print_blob_info(ref, page)
+    tasks = [
+        asyncio.create_task(process_blob(
+            sha,
+            ref,
+            sess,
+            temp_dir,
+            urlp,
+            page,
+            blob_semaphore,
+            fetchp,
+        ))
+        for ref in refs
+    ]
+    try:
+        hashes = await asyncio.gather(*tasks)
+    finally:
+        await cancel_tasks(tasks)
+    return {
+        join_blob_path(ref.get('path'), temp_dir): sha256
+        for ref, sha256 in zip(refs, hashes)
+    }
+
+
+async def process_blob(
+    sha: str,
+    ref: dict,
+    sess: aiohttp.ClientSession,
+    temp_dir: str,
+    urlp: GiteaUrlParams,
+    page: int,
+    blob_semaphore: asyncio.Semaphore,
+    fetchp: GiteaFetchParams,
+) -> str:
+    """Restore blob of the tree entry from cache or download it.
+
+    Parent directory of the file must exist, see create_directories.
+    Downloaded blob is stored in the cache only if its git blob SHA-1
+    matches SHA of the tree entry.
 
-            await write_blob_to_file(
-                await get_blob_data(ref.get('url'), sess),
+    :param sha: SHA of the HEAD or another ref to parse.
+    :param ref: JSON dict contains information about blob.
+    :param sess: Active session.
+    :param temp_dir: Temporary directory for files loading.
+    :param urlp: Base URL parameters for repository.
+    :param page: Page number of the tree entry for log output.
+    :param blob_semaphore: Limit of concurrent blob downloads.
+    :param fetchp: Fetching parameters.
+    :returns: SHA-256 of the written file.
+    :raises BlobDownloadError: Blob is not written or its SHA-1
+        mismatches.
+    """
+    blob_cache = fetchp.blob_cache
+    if blob_cache is not None:
+        path = join_blob_path(ref.get('path'), temp_dir)
+        digest = new_blob_digest(ref, fetchp)
+        is_restored = await asyncio.to_thread(
+            blob_cache.restore,
+            ref.get('sha'),
+            path,
+            digest,
+        )
+        if is_restored and digest.verify(ref.get('sha')):
+            if ref.get('mode') == EXECUTABLE_MODE:
+                set_executable(path)
+            return digest.hexdigest()
+        if is_restored:
+            msg = 'Cached blob SHA-1 mismatch: {0}'.format(ref.get('sha'))
+            logger.warning(msg)
+            await asyncio.to_thread(blob_cache.discard, ref.get('sha'))
+
+    async with blob_semaphore:
+        print_blob_info(ref, page)
+        digest = await download_blob(
+            sha,
+            ref,
+            sess,
+            temp_dir,
+            urlp,
+            fetchp,
+        )
+
+    if blob_cache is not None:
+        if ref.get('size') is not None and digest.verify(ref.get('sha')):
+            await asyncio.to_thread(blob_cache.store, ref.get('sha'), path)
+        else:
+            msg = 'Blob is not verified, not cached: {0}, SHA: {1}'.format(
                 ref.get('path'),
-                temp_dir,
-                is_executable=ref.get('mode') == '100755',
+                ref.get('sha'),
             )
+            logger.warning(msg)
+    return digest.hexdigest()
+
+
+async def download_blob(
+    sha: str,
+    ref: dict,
+    sess: aiohttp.ClientSession,
+    temp_dir: str,
+    urlp: GiteaUrlParams,
+    fetchp: GiteaFetchParams,
+) -> BlobDigest:
+    """Download blob of the tree entry, verify it if needed.
+
+    If fetchp.verify_blobs is set, git blob SHA-1 of the written data
+    is checked against SHA of the tree entry. Blob is downloaded again
+    up to fetchp.verify_retries times on mismatch, then file is removed
+    and the error is raised.
+
+    :param sha: SHA of the HEAD or another ref to parse.
+    :param ref: JSON dict contains information about blob.
+    :param sess: Active session.
+    :param temp_dir: Temporary directory for files loading.
+    :param urlp: Base URL parameters for repository.
+    :param fetchp: Fetching parameters.
+    :returns: Digest of written data.
+    :raises BlobDownloadError: Blob is not written.
+    :raises BlobIntegrityError: Blob SHA-1 mismatches after all retries.
+    """
+    attempts = 1
+    if fetchp.verify_blobs:
+        attempts += fetchp.verify_retries
+
+    for attempt in range(1, attempts + 1):
+        digest = await fetch_blob(sha, ref, sess, temp_dir, urlp, fetchp)
+        if not fetchp.verify_blobs:
+            return digest
+        if digest.verify(ref.get('sha')):
+            return digest
+
+        msg = 'Blob SHA-1 mismatch, attempt {0}/{1}: {2}, SHA: {3}'.format(
+            attempt,
+            attempts,
+            ref.get('path'),
+            ref.get('sha'),
+        )
+        logger.error(msg)
+
+    os.remove(join_blob_path(ref.get('path'), temp_dir))
+    raise BlobIntegrityError(ref.get('path'), ref.get('sha'))
+
+
+async def fetch_blob(
+    sha: str,
+    ref: dict,
+    sess: aiohttp.ClientSession,
+    temp_dir: str,
+    urlp: GiteaUrlParams,
+    fetchp: GiteaFetchParams,
+) -> BlobDigest:
+    """Download blob of the tree entry and write it to file.
+
+    Raw file endpoint is tried first if fetchp.raw_blobs is set,
+    blob API is used otherwise or if raw download fails. Blob API
+    response is streamed to disk if fetchp.stream_blobs is set.
+
+    :param sha: SHA of the HEAD or another ref to parse.
+    :param ref: JSON dict contains information about blob.
+    :param sess: Active session.
+    :param temp_dir: Temporary directory for files loading.
+    :param urlp: Base URL parameters for repository.
+    :param fetchp: Fetching parameters.
+    :returns: Digest of written data.
+    :raises BlobDownloadError: Blob is not written.
+    """
+    relative_path = ref.get('path')
+    is_executable = ref.get('mode') == EXECUTABLE_MODE
+
+    if fetchp.raw_blobs:
+        digest = new_blob_digest(ref, fetchp)
+        if await stream_raw_blob_to_file(
+            get_raw_blob_url(sha, relative_path, urlp),
+            sess,
+            relative_path,
+            temp_dir,
+            is_executable,
+            fetchp.chunk_size,
+            digest,
+            fetchp.retry,
+            create_dirs=False,
+            size=ref.get('size'),
+        ):
+            return digest
+
+    digest = new_blob_digest(ref, fetchp)
+    if fetchp.stream_blobs:
+        is_written = await stream_blob_to_file(
+            ref.get('url'),
+            sess,
+            relative_path,
+            temp_dir,
+            is_executable,
+            fetchp.chunk_size,
+            digest,
+            fetchp.retry,
+            create_dirs=False,
+            size=ref.get('size'),
+        )
+    else:
+        blob_data = await get_blob_data(
+            ref.get('url'),
+            sess,
+            fetchp.retry,
+            fetchp.loads,
+            size=ref.get('size'),
+        )
+        is_written = blob_data is not None and await write_blob_to_file(
+            blob_data,
+            relative_path,
+            temp_dir,
+            is_executable=is_executable,
+            digest=digest,
+            create_dirs=False,
+            writer=fetchp.writer,
+        )
+
+    if not is_written:
+        raise BlobDownloadError(relative_path, ref.get('sha'))
+    return digest
+
+
+def new_blob_digest(ref: dict, fetchp: GiteaFetchParams) -> BlobDigest:
+    """Create digest for blob of the tree entry.
+
+    :param ref: JSON dict contains information about blob.
+    :param fetchp: Fetching parameters.
+    :returns: Digest with git blob SHA-1 if fetchp.verify_blobs or
+        fetchp.blob_cache is set and size of the blob is known.
+    """
+    is_checked = fetchp.verify_blobs or fetchp.blob_cache is not None
+    if is_checked and ref.get('size') is not None:
+        return BlobDigest(git_size=ref.get('size'))
+    return BlobDigest()
 
 
 async def get_tree_data(
@@ -99,6 +427,7 @@ async def get_tree_data(
     sess: aiohttp.ClientSession,
     urlp: GiteaUrlParams,
     page: int,
+    fetchp: GiteaFetchParams | None = None,
 ) -> dict:
     """GET JSON dict for blobs and trees (paginated) from top-level tree.
 
@@ -106,11 +435,16 @@ async def get_tree_data(
     :param sess: Active session.
     :param urlp: Base URL parameters for repository (pagination etc.).
     :param page: Page number for paginated request
+    :param fetchp: Fetching parameters. Defaults are used if None.
     :returns: JSON dict for blobs and trees for page.
+    :raises ValueError: Page is not available.
     """
-    json = await get_tree_refs_page(sha, page, sess, urlp)
+    json = await get_tree_refs_page(sha, page, sess, urlp, fetchp)
     if json is None:
-        return {}
+        raise ValueError('Tree {0} page {1} is not available'.format(
+            sha,
+            page,
+        ))
 
     return json.get('tree')
 
@@ -120,15 +454,24 @@ async def get_tree_refs_page(
     page: int,
     sess: aiohttp.ClientSession,
     urlp: GiteaUrlParams,
+    fetchp: GiteaFetchParams | None = None,
 ) -> dict | None:
     """GET top-level tree object page data.
 
+    Conditional request is sent if fetchp.http_cache is set.
+
     :param sha: SHA of the HEAD or another ref to parse.
     :param page: Page number for paginated request
     :param sess: Active session.
     :param urlp: Base URL parameters for repository (pagination etc.).
-    :returns: JSON dict for blobs and trees (paginated).
+    :param fetchp: Fetching parameters. Defaults are used if None.
+    :returns: JSON dict for blobs and trees (paginated) or None
+        if response status is not OK.
+    :raises Exception: Request failed and retries are exhausted.
     """
+    if fetchp is None:
+        fetchp = GiteaFetchParams()
+
     str0 = '{0}/repos/{1}/{2}/git/trees/{3}'.format(
         urlp.base_api_url,
         urlp.owner,
@@ -142,45 +485,200 @@ async def get_tree_refs_page(
     )
     url = '{0}{1}'.format(str0, str1)
     msg = 'GET tree from {0}'.format(url)
-    logging.info(msg)
+    logger.info(msg)
 
     try:
-        response = await sess.get(url)
+        with METRICS.timer('tree_page_seconds'):
+            status, json = await get_json(
+                url,
+                sess,
+                fetchp.http_cache,
+                fetchp.retry,
+                fetchp.loads,
+            )
     except Exception as ex:
         msg = "Can\'t grab page: {0}".format(page)
-        logging.exception(msg)
-        return None
+        logger.exception(msg)
+        raise ex
 
-    return await response.json()
+    if json is None:
+        msg = 'Page {0}. Response status: {1}'.format(page, status)
+        logger.error(msg)
+    return json
 
 
 async def get_tree_refs_pages_count(
     sha: str,
     sess: aiohttp.ClientSession,
     urlp: GiteaUrlParams,
+    fetchp: GiteaFetchParams | None = None,
 ) -> int:
     """Get number of pages for ref.
 
     :param sha: SHA of the HEAD or another ref to parse.
     :param sess: Active session.
     :param urlp: Base URL parameters for repository (pagination etc.).
+    :param fetchp: Fetching parameters. Defaults are used if None.
     :returns: Number of pages to parse.
     """
-    json = await get_tree_refs_page(sha, 1, sess, urlp)
+    _, pages_count, _, _ = await get_tree_first_page(
+        sha,
+        sess,
+        urlp,
+        fetchp,
+    )
+    return pages_count
+
+
+async def get_tree_first_page(
+    sha: str,
+    sess: aiohttp.ClientSession,
+    urlp: GiteaUrlParams,
+    fetchp: GiteaFetchParams | None = None,
+) -> tuple:
+    """GET first page of the tree and plan the rest of pages.
+
+    If urlp.max_refs_per_page is set, first page is requested with
+    max_refs_per_page elements. Server caps page size by its own limit,
+    so length of the returned tree is the accepted page size unless the
+    whole tree fits the page. Page is capped if it is truncated or
+    shorter than total_count, server may not send truncated flag.
+
+    :param sha: SHA of the HEAD or another ref to parse.
+    :param sess: Active session.
+    :param urlp: Base URL parameters for repository (pagination etc.).
+    :param fetchp: Fetching parameters. Defaults are used if None.
+    :returns: Tuple of URL parameters with page size for the rest of
+        pages, number of pages, entries of the first page and number
+        of entries in the tree. Number of pages is 0, entries and number
+        of entries are None if page is not available.
+    """
+    first_urlp = urlp
+    if urlp.max_refs_per_page:
+        first_urlp = dataclasses.replace(
+            urlp,
+            refs_per_page=urlp.max_refs_per_page,
+        )
+
+    json = await get_tree_refs_page(sha, 1, sess, first_urlp, fetchp)
     if json is None:
-        return 0
+        return urlp, 0, None, None
 
     total_count = json.get('total_count')
     if total_count is None or total_count == 0:
-        logging.error('total_count not found')
-        return 0
+        logger.error('total_count not found')
+        return urlp, 0, None, None
 
-    if total_count < urlp.refs_per_page:
-        pages_count = 1
-    else:
-        pages_count = int(total_count / urlp.refs_per_page)
-        if total_count % urlp.refs_per_page != 0:
-            pages_count += 1
+    tree = json.get('tree') or []
+    if urlp.max_refs_per_page and tree:
+        refs_per_page = urlp.max_refs_per_page
+        if json.get('truncated') or len(tree) < total_count:
+            refs_per_page = len(tree)
+        urlp = dataclasses.replace(urlp, refs_per_page=refs_per_page)
+
+        msg = 'Negotiated page size: {0}'.format(refs_per_page)
+        logger.info(msg)
+
+    pages_count = calc_pages_count(total_count, urlp.refs_per_page)
+    msg = 'Pages count: {0}'.format(pages_count)
+    logger.info(msg)
+    METRICS.set('tree_page_size', urlp.refs_per_page)
+    return urlp, pages_count, tree, total_count
+
+
+def calc_pages_count(total_count: int, refs_per_page: int) -> int:
+    """Calculate number of pages for tree entries.
+
+    :param total_count: Number of entries in the tree.
+    :param refs_per_page: Number of entries in the page.
+    :returns: Number of pages.
+    """
+    if total_count < refs_per_page:
+        return 1
 
-    logging.info('Pages count: {pc}', extra={'pc': pages_count})
+    pages_count = int(total_count / refs_per_page)
+    if total_count % refs_per_page != 0:
+        pages_count += 1
     return pages_count
+
+
+async def negotiate_refs_per_page(
+    sha: str,
+    sess: aiohttp.ClientSession,
+    urlp: GiteaUrlParams,
+    fetchp: GiteaFetchParams | None = None,
+) -> GiteaUrlParams:
+    """Find the largest page size accepted by server.
+
+    :param sha: SHA of the HEAD or another ref to parse.
+    :param sess: Active session.
+    :param urlp: Base URL parameters for repository (pagination etc.).
+    :param fetchp: Fetching parameters. Defaults are used if None.
+    :returns: Copy of urlp with negotiated refs_per_page. Unchanged urlp
+        if page is not available.
+    """
+    urlp, _, _, _ = await get_tree_first_page(sha, sess, urlp, fetchp)
+    return urlp
+
+
+async def iter_tree_entries(
+    sha: str,
+    sess: aiohttp.ClientSession,
+    urlp: GiteaUrlParams,
+    fetchp: GiteaFetchParams | None = None,
+    num_parallel: int = PARALLEL_DOWNLOADS,
+) -> AsyncIterator[dict]:
+    """Iterate over entries of all tree pages in page order.
+
+    First page is requested once and reused, next num_parallel pages
+    are requested in advance while entries are consumed. Listing fails
+    if any page is not available or the number of entries differs from
+    total_count of the tree, so an incomplete tree is never yielded
+    as a complete one.
+
+    :param sha: SHA of the HEAD or another ref to parse.
+    :param sess: Active session.
+    :param urlp: Base URL parameters for repository (pagination etc.).
+    :param fetchp: Fetching parameters. Defaults are used if None.
+    :param num_parallel: Number of tree pages requested concurrently.
+    :yields: JSON dict of the next tree entry.
+    :raises ValueError: Tree or its page is not available or listing
+        is incomplete.
+    """
+    urlp, pages_count, tree, total_count = await get_tree_first_page(
+        sha,
+        sess,
+        urlp,
+        fetchp,
+    )
+    if total_count is None:
+        raise ValueError('Tree {0} is not available'.format(sha))
+
+    entries_count = len(tree)
+    for ref in tree:
+        yield ref
+
+    pending = collections.deque()
+    next_page = 2
+    try:
+        while next_page <= pages_count or pending:
+            while next_page <= pages_count and len(pending) < num_parallel:
+                pending.append(asyncio.create_task(
+                    get_tree_data(sha, sess, urlp, next_page, fetchp),
+                ))
+                next_page += 1
+
+            page_tree = await pending.popleft() or []
+            entries_count += len(page_tree)
+            for ref in page_tree:
+                yield ref
+    finally:
+        await cancel_tasks(pending)
+
+    if entries_count != total_count:
+        msg = 'Tree {0} listing is incomplete: {1} of {2} entries'.format(
+            sha,
+            entries_count,
+            total_count,
+        )
+        raise ValueError(msg)
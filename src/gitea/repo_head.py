@@ -5,6 +5,9 @@ from http import HTTPStatus
 import aiohttp
 
 from gitea.config import REF_HEAD
+from gitea.fetch_params import GiteaFetchParams
+from gitea.http_cache import get_json
+from gitea.metrics import METRICS
 from gitea.url_params import GiteaUrlParams
 
 
@@ -12,14 +15,22 @@ async def get_ref_sha(
     sess: aiohttp.ClientSession,
     urlp: GiteaUrlParams,
     ref: str = REF_HEAD,
+    fetchp: GiteaFetchParams | None = None,
 ) -> str:
     """Get SHA for selected ref (HEAD) of the gitea repository.
 
+    Conditional request is sent if fetchp.http_cache is set.
+
     :param sess: Active session.
     :param urlp: Base URL parameters for repository (pagination etc.).
     :param ref: Name of ref. For example refs/heads/master.
+    :param fetchp: Fetching parameters. Defaults are used if None.
     :returns: SHA of the ref or an empty string if ref not found
+    :raises Exception: Request to URL failed.
     """
+    if fetchp is None:
+        fetchp = GiteaFetchParams()
+
     url = '{0}/repos/{1}/{2}/git/refs'.format(
         urlp.base_api_url,
         urlp.owner,
@@ -29,17 +40,23 @@ async def get_ref_sha(
     logging.info(msg)
 
     try:
-        response = await sess.get(url)
+        with METRICS.timer('ref_seconds'):
+            status, json = await get_json(
+                url,
+                sess,
+                fetchp.http_cache,
+                fetchp.retry,
+                fetchp.loads,
+            )
     except Exception as ex:
         logging.exception('Exception occurred')
         raise ex
 
-    if response.status != HTTPStatus.OK:
-        msg = "Response status: {0}".format(response.status)
+    if status != HTTPStatus.OK:
+        msg = "Response status: {0}".format(status)
         logging.error(msg)
         return None
 
-    json = await response.json()
     return parse_ref(json, ref)
 
 
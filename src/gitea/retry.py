@@ -0,0 +1,372 @@
+"""Retries of requests with backoff and shared rate limiting."""
+
+import asyncio
+import contextlib
+import email.utils
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from http import HTTPStatus
+from typing import AsyncIterator, Awaitable, Callable, Mapping
+
+import aiohttp
+
+from gitea.concurrency import ConcurrencyBudget
+from gitea.config import (
+    MAX_RETRY_AFTER,
+    RETRY_ATTEMPTS,
+    RETRY_BASE_DELAY,
+    RETRY_BUDGET,
+    RETRY_MAX_DELAY,
+)
+from gitea.metrics import METRICS
+
+RETRY_STATUSES = frozenset((
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+))
+RETRY_AFTER_STATUSES = frozenset((
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+))
+RETRY_EXCEPTIONS = (
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    asyncio.TimeoutError,
+)
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter shared by all requests of a run.
+
+    Waiters are served in order of arrival. Bucket may be paused for
+    all requests, for example when server responds with Retry-After.
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        """Init bucket filled up to capacity.
+
+        :param rate: Number of tokens added per second.
+        :param capacity: Max number of tokens (size of burst).
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait for a token and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate,
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, delay: float) -> None:
+        """Stop giving tokens for delay seconds.
+
+        :param delay: Pause in seconds.
+        """
+        self._paused_until = max(
+            self._paused_until,
+            time.monotonic() + delay,
+        )
+
+
+class RetryPolicy(object):
+    """Jittered exponential backoff with a retry budget per run.
+
+    Policy also holds limits shared with requests of other runs:
+    rate limiter and budget of requests and bytes in flight.
+    """
+
+    def __init__(
+        self,
+        attempts: int = RETRY_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+        budget: int = RETRY_BUDGET,
+        max_retry_after: float = MAX_RETRY_AFTER,
+        limiter: TokenBucket | None = None,
+        concurrency: ConcurrencyBudget | None = None,
+        key: str = '',
+    ) -> None:
+        """Init policy.
+
+        :param attempts: Max number of attempts of one request.
+        :param base_delay: Delay before the first retry in seconds.
+        :param max_delay: Max delay between retries in seconds.
+        :param budget: Max number of retries of all requests.
+        :param max_retry_after: Max delay accepted from Retry-After
+            header in seconds.
+        :param limiter: Rate limiter of requests. No limit if None.
+        :param concurrency: Budget of requests and bytes in flight shared
+            with other runs. No limit if None.
+        :param key: Key of the run for fair scheduling in concurrency
+            budget. For example owner/project of repository.
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.max_retry_after = max_retry_after
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.key = key
+
+    async def acquire(self) -> None:
+        """Wait until request may be sent according to rate limit.
+
+        Slot of concurrency budget is taken, it must be returned
+        by release.
+        """
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        if self.concurrency is not None:
+            await self.concurrency.requests.acquire(self.key)
+
+    def release(self) -> None:
+        """Return slot of concurrency budget taken by acquire."""
+        if self.concurrency is not None:
+            self.concurrency.requests.release()
+
+    async def acquire_bytes(self, size: int) -> int:
+        """Wait until response body may be read according to budget.
+
+        :param size: Size of response body in bytes.
+        :returns: Reserved size to pass to release_bytes.
+        """
+        if self.concurrency is None:
+            return 0
+        return await self.concurrency.bytes.acquire(self.key, size)
+
+    def release_bytes(self, size: int) -> None:
+        """Return bytes reserved by acquire_bytes.
+
+        :param size: Reserved size.
+        """
+        if self.concurrency is not None:
+            self.concurrency.bytes.release(size)
+
+    def next_delay(
+        self,
+        attempt: int,
+        retry_after: float | None = None,
+    ) -> float | None:
+        """Take retry from budget and get delay before it.
+
+        :param attempt: Number of failed attempts of the request minus one.
+        :param retry_after: Delay requested by server in seconds.
+        :returns: Delay in seconds or None if request must not be retried.
+        """
+        if attempt + 1 >= self.attempts or self.budget <= 0:
+            return None
+        self.budget -= 1
+
+        if retry_after is not None:
+            delay = min(retry_after, self.max_retry_after)
+            if self.limiter is not None:
+                self.limiter.pause(delay)
+            return delay
+
+        backoff = min(self.max_delay, self.base_delay * (1 << attempt))
+        return random.uniform(0, backoff)
+
+
+def get_retry_after(headers: Mapping) -> float | None:
+    """Parse Retry-After header as seconds or HTTP date.
+
+    :param headers: Response headers.
+    :returns: Delay in seconds or None if header is absent or invalid.
+    """
+    retry_after = headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    if retry_after.strip().isdigit():
+        return float(retry_after)
+
+    try:
+        date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+@contextlib.asynccontextmanager
+async def request(
+    sess: aiohttp.ClientSession,
+    url: str,
+    retry: RetryPolicy | None = None,
+    headers: dict | None = None,
+    size_hint: int = 0,
+) -> AsyncIterator[aiohttp.ClientResponse]:
+    """GET URL retrying connection errors and retryable statuses.
+
+    Response with retryable status is returned to caller when retries
+    are exhausted. Response is released on exit. Request slot and
+    bytes of the response body are held in concurrency budget of the
+    policy until exit. Content-Length of the response is reserved,
+    size_hint is reserved for chunked responses without it.
+
+    :param sess: Active session.
+    :param url: Requested URL.
+    :param retry: Retry policy. Request is sent once if None.
+    :param headers: Request headers.
+    :param size_hint: Expected size of response body in bytes.
+    :yields: Response.
+    """
+    METRICS.inc('requests_total')
+    with METRICS.in_flight('requests_in_flight'):
+        if retry is None:
+            with METRICS.timer('request_seconds'):
+                response = await sess.get(url, headers=headers)
+            async with response:
+                yield response
+            return
+
+        response = await send(sess, url, retry, headers)
+        reserved = 0
+        try:
+            reserved = await retry.acquire_bytes(
+                response.content_length or size_hint,
+            )
+            yield response
+        finally:
+            response.release()
+            retry.release_bytes(reserved)
+            retry.release()
+
+
+async def fetch(
+    sess: aiohttp.ClientSession,
+    url: str,
+    read: Callable[[aiohttp.ClientResponse], Awaitable],
+    retry: RetryPolicy | None = None,
+    headers: dict | None = None,
+    size_hint: int = 0,
+) -> object:
+    """GET URL and read response, retry the request if body read fails.
+
+    Sending and retryable statuses are retried by request. Connection
+    errors, payload errors and timeouts raised by read while the body
+    is read are retried here with the same policy: read is called again
+    with the new response, so it must start from scratch (truncate file,
+    reset digest).
+
+    :param sess: Active session.
+    :param url: Requested URL.
+    :param read: Coroutine function reading response, its result
+        is returned.
+    :param retry: Retry policy. Request is sent once if None.
+    :param headers: Request headers.
+    :param size_hint: Expected size of response body in bytes,
+        see request.
+    :returns: Result of read.
+    :raises Exception: Request or read failed and can't be retried.
+    """
+    attempt = 0
+    while True:
+        async with request(
+            sess,
+            url,
+            retry,
+            headers,
+            size_hint,
+        ) as response:
+            try:
+                return await read(response)
+            except RETRY_EXCEPTIONS as ex:
+                error = ex
+
+        delay = None
+        if retry is not None:
+            delay = retry.next_delay(attempt)
+        if delay is None:
+            raise error
+        METRICS.inc('request_retries_total')
+        msg = 'Retry {0} in {1:.2f}s after read error {2!r}'.format(
+            url,
+            delay,
+            error,
+        )
+        logging.warning(msg)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def send(
+    sess: aiohttp.ClientSession,
+    url: str,
+    retry: RetryPolicy,
+    headers: dict | None = None,
+) -> aiohttp.ClientResponse:
+    """Send GET request until response is not retryable.
+
+    :param sess: Active session.
+    :param url: Requested URL.
+    :param retry: Retry policy.
+    :param headers: Request headers.
+    :returns: Response. Request slot of the policy is held, caller
+        must release it.
+    :raises Exception: Request failed and can't be retried.
+    """
+    attempt = 0
+    while True:
+        await retry.acquire()
+        try:
+            with METRICS.timer('request_seconds'):
+                response = await sess.get(url, headers=headers)
+        except RETRY_EXCEPTIONS as ex:
+            retry.release()
+            delay = retry.next_delay(attempt)
+            if delay is None:
+                raise ex
+            METRICS.inc('request_retries_total')
+            msg = 'Retry {0} in {1:.2f}s after {2!r}'.format(url, delay, ex)
+            logging.warning(msg)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException as ex:
+            retry.release()
+            raise ex
+
+        if response.status in RETRY_STATUSES:
+            retry_after = None
+            if response.status in RETRY_AFTER_STATUSES:
+                retry_after = get_retry_after(response.headers)
+            delay = retry.next_delay(attempt, retry_after)
+            if delay is not None:
+                response.release()
+                retry.release()
+                METRICS.inc('request_retries_total')
+                msg = 'Retry {0} in {1:.2f}s after status {2}'.format(
+                    url,
+                    delay,
+                    response.status,
+                )
+                logging.warning(msg)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+        return response
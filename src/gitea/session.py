@@ -0,0 +1,55 @@
+"""Factory of HTTP sessions with tuned connection pool."""
+
+import aiohttp
+
+from gitea.config import (
+    CONNECT_TIMEOUT,
+    CONNECTIONS_LIMIT,
+    CONNECTIONS_PER_HOST,
+    DNS_CACHE_TTL,
+    KEEPALIVE_TIMEOUT,
+    READ_TIMEOUT,
+    TOTAL_TIMEOUT,
+)
+
+
+def create_session(
+    limit: int = CONNECTIONS_LIMIT,
+    limit_per_host: int = CONNECTIONS_PER_HOST,
+    dns_cache_ttl: int = DNS_CACHE_TTL,
+    keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+    total_timeout: float = TOTAL_TIMEOUT,
+    connect_timeout: float = CONNECT_TIMEOUT,
+    read_timeout: float = READ_TIMEOUT,
+) -> aiohttp.ClientSession:
+    """Create session sharing one pool of keep-alive connections.
+
+    Must be called with running event loop. Session owns the connector
+    and closes it on exit.
+
+    :param limit: Total number of simultaneous connections.
+    :param limit_per_host: Number of simultaneous connections to one host.
+    :param dns_cache_ttl: Time to keep resolved addresses in seconds.
+    :param keepalive_timeout: Time to keep idle connection in seconds.
+    :param total_timeout: Timeout of whole request including reading
+        of response body in seconds. No limit if 0, so long streamed
+        downloads (raw blobs, archives) are bounded by read_timeout only.
+    :param connect_timeout: Timeout of connecting to server in seconds,
+        time of waiting for a free connection of the pool is not limited.
+    :param read_timeout: Timeout of reading a portion of response body
+        in seconds.
+    :returns: New session.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        use_dns_cache=True,
+        ttl_dns_cache=dns_cache_ttl,
+        keepalive_timeout=keepalive_timeout,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=total_timeout or None,
+        sock_connect=connect_timeout,
+        sock_read=read_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
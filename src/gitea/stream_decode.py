@@ -0,0 +1,89 @@
+"""Incremental decoding of blob JSON returned by gitea blob API."""
+
+import base64
+import json
+import re
+
+CONTENT_VALUE_RE = re.compile(rb'"content"\s*:\s*"')
+QUOTE = b'"'
+BACKSLASH = b'\\'
+BASE64_QUANTUM = 4
+
+JSON_ESCAPES = (
+    (b'\\/', b'/'),
+    (b'\\n', b''),
+    (b'\\r', b''),
+)
+
+
+class Base64ContentDecoder(object):
+    r"""Decode \'content\' field of blob JSON chunk by chunk.
+
+    JSON text before and after the content string is kept to parse
+    the rest of the fields (encoding, size etc.) when response ends.
+    Base64 characters of the content are decoded in 4-byte aligned
+    pieces as they arrive, so memory use does not depend on blob size.
+    """
+
+    def __init__(self) -> None:
+        """Create decoder waiting for the content field."""
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._pending = b''
+        self._in_content = False
+        self._content_done = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Feed next chunk of response body.
+
+        :param chunk: Next bytes of JSON response.
+        :returns: Decoded bytes of content available after this chunk.
+        """
+        if self._content_done:
+            self._tail.extend(chunk)
+            return b''
+
+        if not self._in_content:
+            self._head.extend(chunk)
+            match = CONTENT_VALUE_RE.search(self._head)
+            if match is None:
+                return b''
+            chunk = bytes(self._head[match.end():])
+            del self._head[match.end():]
+            self._in_content = True
+
+        end = chunk.find(QUOTE)
+        if end != -1:
+            self._tail.extend(chunk[end:])
+            chunk = chunk[:end]
+            self._in_content = False
+            self._content_done = True
+
+        return self._decode(chunk)
+
+    def finish(self) -> dict:
+        """Check that content is complete and parse the rest of JSON.
+
+        :returns: JSON dict of the response with empty content field.
+        :raises ValueError: Response ended inside of content or content
+            is not valid base64.
+        """
+        if self._in_content or self._pending:
+            raise ValueError('Truncated base64 content')
+        return json.loads(bytes(self._head + self._tail))
+
+    def _decode(self, chunk: bytes) -> bytes:
+        encoded = self._pending + chunk
+        self._pending = b''
+
+        if BACKSLASH in encoded:
+            trailing = len(encoded) - len(encoded.rstrip(BACKSLASH))
+            if trailing % 2:
+                self._pending = BACKSLASH
+                encoded = encoded[:-1]
+            for escaped, unescaped in JSON_ESCAPES:
+                encoded = encoded.replace(escaped, unescaped)
+
+        aligned = len(encoded) - len(encoded) % BASE64_QUANTUM
+        self._pending = encoded[aligned:] + self._pending
+        return base64.b64decode(encoded[:aligned])
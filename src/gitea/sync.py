@@ -0,0 +1,199 @@
+"""Incremental synchronization of directory between two git trees."""
+
+import asyncio
+import contextlib
+import logging
+import os
+from dataclasses import dataclass, field
+
+import aiohttp
+
+from gitea.blob import (
+    FILE_MODES,
+    apply_mode,
+    create_directories,
+    plan_directories,
+)
+from gitea.config import PARALLEL_BLOB_DOWNLOADS
+from gitea.fetch_params import GiteaFetchParams
+from gitea.log_message import BraceMessage
+from gitea.refs_tree import iter_tree_entries, process_blob
+from gitea.url_params import GiteaUrlParams
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TreeDiff(object):
+    """Difference between file entries of two git trees.
+
+    :cvar added: Entries of files missing in the old tree.
+    :cvar modified: Entries of files with changed blob SHA.
+    :cvar removed: Relative paths of files missing in the new tree.
+    :cvar mode_changed: Entries of files with the same blob SHA
+        and changed mode.
+    """
+
+    added: list = field(default_factory=list)
+    modified: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    mode_changed: list = field(default_factory=list)
+
+
+async def sync_tree(
+    old_sha: str,
+    new_sha: str,
+    sess: aiohttp.ClientSession,
+    urlp: GiteaUrlParams,
+    out_dir: str,
+    num_blob_parallel: int = PARALLEL_BLOB_DOWNLOADS,
+    fetchp: GiteaFetchParams | None = None,
+) -> TreeDiff:
+    """Update directory built from old tree to the state of new tree.
+
+    Only added and modified blobs are downloaded, removed files are
+    deleted and modes of files are updated. Nothing is changed if
+    listing of any tree fails. Sync fails if any blob is not downloaded,
+    then out_dir must be synchronized again from old_sha.
+
+    :param old_sha: SHA of the tree out_dir was built from.
+    :param new_sha: SHA of the HEAD or another ref to sync to.
+    :param sess: Active session.
+    :param urlp: Base URL parameters for repository (pagination etc.).
+    :param out_dir: Existing directory with files of the old tree.
+    :param num_blob_parallel: Number of blobs downloaded concurrently.
+    :param fetchp: Fetching parameters. Defaults are used if None.
+    :returns: Applied difference between trees.
+    :raises ValueError: Listing of a tree is not available or incomplete
+        or blob is not downloaded.
+    """
+    if fetchp is None:
+        fetchp = GiteaFetchParams()
+
+    if old_sha == new_sha:
+        logger.info('Tree is up to date')
+        return TreeDiff()
+
+    old_entries, new_entries = await asyncio.gather(
+        get_tree_entries(old_sha, sess, urlp, fetchp),
+        get_tree_entries(new_sha, sess, urlp, fetchp),
+    )
+    diff = diff_trees(old_entries, new_entries)
+    str0 = 'Sync {0}..{1}: '.format(old_sha, new_sha)
+    str1 = 'added {0}, modified {1}, removed {2}, mode changed {3}'.format(
+        len(diff.added),
+        len(diff.modified),
+        len(diff.removed),
+        len(diff.mode_changed),
+    )
+    msg = '{0}{1}'.format(str0, str1)
+    logger.info(msg)
+
+    for relative_path in diff.removed:
+        remove_file(relative_path, out_dir)
+
+    refs = diff.added + diff.modified
+    await asyncio.to_thread(
+        create_directories,
+        plan_directories(ref.get('path') for ref in refs),
+        out_dir,
+    )
+
+    blob_semaphore = asyncio.Semaphore(num_blob_parallel)
+    hashes = await asyncio.gather(*[
+        process_blob(
+            new_sha,
+            ref,
+            sess,
+            out_dir,
+            urlp,
+            0,
+            blob_semaphore,
+            fetchp,
+        )
+        for ref in refs
+    ], return_exceptions=True)
+
+    errors = [error for error in hashes if isinstance(error, Exception)]
+    written = {
+        ref.get('path')
+        for ref, sha256 in zip(refs, hashes)
+        if isinstance(sha256, str)
+    }
+    if len(written) < len(refs):
+        msg = 'Sync {0}..{1}: {2} files not downloaded'.format(
+            old_sha,
+            new_sha,
+            len(refs) - len(written),
+        )
+        logger.error(msg)
+        raise ValueError(msg) from next(iter(errors), None)
+
+    for ref in diff.modified + diff.mode_changed:
+        apply_mode(os.path.join(out_dir, ref.get('path')), ref.get('mode'))
+
+    return diff
+
+
+async def get_tree_entries(
+    sha: str,
+    sess: aiohttp.ClientSession,
+    urlp: GiteaUrlParams,
+    fetchp: GiteaFetchParams | None = None,
+) -> dict:
+    """GET all file entries of the tree.
+
+    :param sha: SHA of the HEAD or another ref to parse.
+    :param sess: Active session.
+    :param urlp: Base URL parameters for repository (pagination etc.).
+    :param fetchp: Fetching parameters. Defaults are used if None.
+    :returns: Dict of file entries by relative path. Symbolic links and
+        other unsupported modes are skipped.
+    :raises ValueError: Listing is not available or incomplete.
+    """
+    return {
+        ref.get('path'): ref
+        async for ref in iter_tree_entries(sha, sess, urlp, fetchp)
+        if ref.get('type') == 'blob' and ref.get('mode') in FILE_MODES
+    }
+
+
+def diff_trees(old_entries: dict, new_entries: dict) -> TreeDiff:
+    """Compare file entries of two trees.
+
+    :param old_entries: Dict of file entries of old tree by path.
+    :param new_entries: Dict of file entries of new tree by path.
+    :returns: Difference between trees.
+    """
+    diff = TreeDiff()
+    for path, ref in new_entries.items():
+        old_ref = old_entries.get(path)
+        if old_ref is None:
+            diff.added.append(ref)
+        elif old_ref.get('sha') != ref.get('sha'):
+            diff.modified.append(ref)
+        elif old_ref.get('mode') != ref.get('mode'):
+            diff.mode_changed.append(ref)
+
+    diff.removed = [path for path in old_entries if path not in new_entries]
+    return diff
+
+
+def remove_file(relative_path: str, out_dir: str) -> None:
+    """Remove file and its parent directories left empty.
+
+    :param relative_path: Relative path to file in the repository.
+    :param out_dir: Root directory of the files.
+    """
+    logger.info(BraceMessage('Remove file: {0}', relative_path))
+
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(out_dir, relative_path))
+
+    subdir = os.path.dirname(relative_path)
+    while subdir:
+        try:
+            os.rmdir(os.path.join(out_dir, subdir))
+        except OSError:
+            break
+        subdir = os.path.dirname(subdir)
@@ -18,6 +18,8 @@ class GiteaUrlParams(object):
     :cvar recursive: Query parameter for ref tree output.
         True by default. Parses full tree with all subtrees.
     :cvar refs_per_page: Number of elements in paginated tree output.
+    :cvar max_refs_per_page: Upper bound of page size negotiated with
+        server. Page size is not negotiated if 0.
     """
 
     base_api_url: str = BASE_API_URL
@@ -25,3 +27,4 @@ class GiteaUrlParams(object):
     project: str = PROJECT
     recursive: bool = True
     refs_per_page: int = REFS_PER_PAGE
+    max_refs_per_page: int = 0
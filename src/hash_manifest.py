@@ -0,0 +1,91 @@
+"""Persistent manifest of file hashes keyed by file stat."""
+
+import json
+import logging
+import os
+import tempfile
+
+from filesystem import FileInfo
+
+MANIFEST_VERSION = 1
+
+
+class HashManifest(object):
+    """Stored SHA-256 hashes of files of a directory.
+
+    Hash of a file is reused while its (relative path, inode, size,
+    mtime_ns) key is unchanged. Files modified not earlier than the
+    start of the scan which produced the manifest are hashed again,
+    because their modification may be hidden by mtime granularity.
+    """
+
+    def __init__(self, time_ns: int = 0, files: dict | None = None) -> None:
+        """Create manifest.
+
+        :param time_ns: Start time of the scan which produced manifest.
+        :param files: Dict of [inode, size, mtime_ns, sha] by relative path.
+        """
+        self.time_ns = time_ns
+        self.files = files or {}
+
+    @classmethod
+    def load(cls, path: str) -> 'HashManifest':
+        """Load manifest from file.
+
+        :param path: Path to manifest file.
+        :returns: Loaded manifest or empty manifest if file is missing
+            or invalid.
+        """
+        try:
+            with open(path, 'rb') as fp:
+                json_data = json.load(fp)
+        except (OSError, ValueError):
+            return cls()
+
+        if json_data.get('version') != MANIFEST_VERSION:
+            msg = 'Unsupported hash manifest version: {0}'.format(path)
+            logging.warning(msg)
+            return cls()
+        return cls(json_data.get('time_ns', 0), json_data.get('files'))
+
+    def save(self, path: str) -> None:
+        """Write manifest to file atomically.
+
+        :param path: Path to manifest file.
+        """
+        json_data = {
+            'version': MANIFEST_VERSION,
+            'time_ns': self.time_ns,
+            'files': self.files,
+        }
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)),
+        )
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(json_data, fp)
+        os.replace(temp_path, path)
+
+    def get(self, relative_path: str, info: FileInfo) -> str | None:
+        """Get stored hash of unchanged file.
+
+        :param relative_path: Path of file relative to scanned directory.
+        :param info: Current stat of file.
+        :returns: Stored SHA-256 or None if file is new or changed.
+        """
+        entry = self.files.get(relative_path)
+        if entry is None or info.mtime_ns >= self.time_ns:
+            return None
+
+        inode, size, mtime_ns, sha = entry
+        if (inode, size, mtime_ns) != (info.inode, info.size, info.mtime_ns):
+            return None
+        return sha
+
+    def set(self, relative_path: str, info: FileInfo, sha: str) -> None:
+        """Store hash of file.
+
+        :param relative_path: Path of file relative to scanned directory.
+        :param info: Stat of file at the time of hashing.
+        :param sha: SHA-256 of file.
+        """
+        self.files[relative_path] = [info.inode, info.size, info.mtime_ns, sha]
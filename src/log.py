@@ -1,6 +1,77 @@
 """Log helper functions of the project."""
+import itertools
+import logging
 import os
-from logging import config, info
+import queue
+from logging import config, handlers
+from types import MappingProxyType
+from typing import Mapping
+
+from gitea.log_message import BraceMessage
+
+# Loggers of hot path stages and rate of sampling of their INFO and
+# DEBUG records: 1 of rate records is emitted. 1 disables sampling.
+# Levels of stages are set in logconfig.ini.
+SAMPLE_RATES = MappingProxyType({
+    'gitea.blob': 1,
+    'gitea.archive': 1,
+    'gitea.blob_cache': 1,
+    'sha256': 1,
+})
+
+
+class LazyQueueHandler(handlers.QueueHandler):
+    """Queue handler passing records to listener thread unformatted.
+
+    Messages are formatted and written by handlers of the listener,
+    so the caller (event loop) only puts record to the queue.
+    """
+
+    def __init__(self, log_queue: queue.SimpleQueue) -> None:
+        """Init handler and listener with no handlers.
+
+        :param log_queue: Queue of records.
+        """
+        super().__init__(log_queue)
+        self.listener = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Pass record as is, it is formatted by listener.
+
+        :param record: Log record.
+        :returns: The same record.
+        """
+        return record
+
+    def close(self) -> None:
+        """Stop listener flushing queued records, close handler."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+
+class SampleFilter(logging.Filter):
+    """Pass 1 of rate records below WARNING, pass all other records."""
+
+    def __init__(self, rate: int) -> None:
+        """Init filter.
+
+        :param rate: Sampling rate.
+        """
+        super().__init__()
+        self.rate = rate
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Check that record is sampled.
+
+        :param record: Log record.
+        :returns: True if record must be emitted.
+        """
+        if record.levelno >= logging.WARNING:
+            return True
+        return next(self._counter) % self.rate == 0
 
 
 def get_project_root_dir() -> str:
@@ -13,10 +84,39 @@ def get_project_root_dir() -> str:
     return dirname.replace('{0}src'.format(os.sep), '')
 
 
-def init_logger() -> None:
-    """Initialize logging logger from config file logconfig.ini."""
+def init_logger(sample_rates: Mapping[str, int] = SAMPLE_RATES) -> None:
+    """Initialize logging logger from config file logconfig.ini.
+
+    Handlers of the root logger from config are moved to a listener
+    thread fed by a queue, so logging calls don't wait for disk.
+    Listener is stopped and queued records are written on
+    logging.shutdown (at exit) or on next call of this func.
+
+    :param sample_rates: Sampling rate by logger name.
+    """
     root_dir = get_project_root_dir()
     log_file_path = '{0}{1}logconfig.ini'.format(root_dir, os.sep)
-    config.fileConfig(log_file_path)
-    msg = 'Load logging config from: {0}'.format(log_file_path)
-    info(msg)
+    config.fileConfig(log_file_path, disable_existing_loggers=False)
+
+    root = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.listener = handlers.QueueListener(
+        log_queue,
+        *root.handlers,
+        respect_handler_level=True,
+    )
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    queue_handler.listener.start()
+
+    for name, rate in sample_rates.items():
+        logger = logging.getLogger(name)
+        for sample_filter in logger.filters[:]:
+            if isinstance(sample_filter, SampleFilter):
+                logger.removeFilter(sample_filter)
+        if rate > 1:
+            logger.addFilter(SampleFilter(rate))
+
+    logging.info(BraceMessage('Load logging config from: {0}', log_file_path))
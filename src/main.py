@@ -1,32 +1,177 @@
 """Main module of the project."""
 
 import asyncio
+import json
+import logging
 import os
+import sys
 import tempfile
 
 import aiohttp
 
 import log
+from gitea.archive import download_archive
+from gitea.blob_cache import BlobCache
+from gitea.config import (
+    ARCHIVE_DOWNLOADS,
+    BLOB_CACHE_DIR,
+    HASH_MANIFEST_PATH,
+    HTTP_CACHE_DIR,
+    MAX_REFS_PER_PAGE,
+    PARALLEL_BLOB_DOWNLOADS,
+    PARALLEL_DOWNLOADS,
+    PROMETHEUS_REPORT_PATH,
+    RATE_BURST,
+    RATE_LIMIT,
+    RAW_BLOB_DOWNLOADS,
+    REFS_PER_PAGE,
+    RUN_REPORT_PATH,
+    STREAM_BLOB_DOWNLOADS,
+)
+from gitea.fetch_params import GiteaFetchParams
+from gitea.file_writer import FileWriter
+from gitea.http_cache import HttpCache
+from gitea.metrics import METRICS, write_report
 from gitea.refs_tree import process_tree_refs_pages
 from gitea.repo_head import get_ref_sha
+from gitea.retry import RetryPolicy, TokenBucket
+from gitea.session import create_session
+from gitea.sync import sync_tree
 from gitea.url_params import GiteaUrlParams
-from sha256 import calc_sha_for_files_in_dir
+from sha256 import calc_sha_for_files_in_dir, collect_stats
 
 
-async def main() -> str:
-    """Entry point."""
+async def main(
+    out_dir: str | None = None,
+    base_sha: str | None = None,
+) -> tuple:
+    """Entry point.
+
+    Full tree is loaded to new temp directory by default, as one
+    archive if ARCHIVE_DOWNLOADS is set. If out_dir
+    and base_sha are set, out_dir built from base_sha is synchronized
+    with the ref incrementally. Metrics of the run are reported at the end.
+
+    :param out_dir: Existing directory with files of base_sha tree.
+    :param base_sha: SHA of the tree out_dir was built from.
+    :returns: Directory with files of the ref and SHA of the ref. Pass
+        them as out_dir and base_sha to synchronize the directory later.
+    """
     log.init_logger()
-    url_params = GiteaUrlParams()
+    METRICS.reset()
+    url_params = GiteaUrlParams(max_refs_per_page=MAX_REFS_PER_PAGE)
+    retry = RetryPolicy()
+    if RATE_LIMIT > 0:
+        retry.limiter = TokenBucket(RATE_LIMIT, RATE_BURST)
+    fetch_params = create_fetch_params(retry)
+
+    async with create_session() as sess, FileWriter() as writer:
+        fetch_params.writer = writer
+        head_sha = await get_ref_sha(sess, url_params, fetchp=fetch_params)
+        if out_dir and base_sha:
+            await sync_tree(
+                base_sha,
+                head_sha,
+                sess,
+                url_params,
+                out_dir,
+                fetchp=fetch_params,
+            )
+            msg = 'Directory {0} synchronized to {1}'.format(out_dir, head_sha)
+            logging.info(msg)
+            calc_sha_for_files_in_dir(
+                out_dir,
+                workers=os.cpu_count() or 1,
+                manifest_path=HASH_MANIFEST_PATH or None,
+            )
+        else:
+            out_dir = tempfile.mkdtemp()
+            manifest = await download_tree(
+                head_sha,
+                sess,
+                url_params,
+                out_dir,
+                fetch_params,
+            )
+            collect_stats(manifest.items(), save_stats=False)
+
+    report_run()
+    return out_dir, head_sha
+
+
+def report_run() -> dict:
+    """Log run report, write it to files configured in config.
+
+    Parameters of the report are values of config. Page size of tree
+    listing used by the run (negotiated with server) is reported as
+    tree_page_size gauge.
+
+    :returns: Report dict.
+    """
+    report = write_report(
+        METRICS,
+        RUN_REPORT_PATH or None,
+        PROMETHEUS_REPORT_PATH or None,
+        parameters={
+            'parallel_downloads': PARALLEL_DOWNLOADS,
+            'parallel_blob_downloads': PARALLEL_BLOB_DOWNLOADS,
+            'configured_refs_per_page': REFS_PER_PAGE,
+            'max_refs_per_page': MAX_REFS_PER_PAGE,
+            'archive_downloads': ARCHIVE_DOWNLOADS,
+            'raw_blob_downloads': RAW_BLOB_DOWNLOADS,
+            'stream_blob_downloads': STREAM_BLOB_DOWNLOADS,
+        },
+    )
+    msg = 'Run report: {0}'.format(json.dumps(report))
+    logging.info(msg)
+    return report
+
+
+def create_fetch_params(retry: RetryPolicy) -> GiteaFetchParams:
+    """Create fetching parameters with caches configured in config.
+
+    :param retry: Retry policy of requests.
+    :returns: Fetching parameters.
+    """
+    fetch_params = GiteaFetchParams(retry=retry)
+    if BLOB_CACHE_DIR:
+        fetch_params.blob_cache = BlobCache(BLOB_CACHE_DIR)
+    if HTTP_CACHE_DIR:
+        fetch_params.http_cache = HttpCache(HTTP_CACHE_DIR)
+    return fetch_params
+
+
+async def download_tree(
+    sha: str,
+    sess: aiohttp.ClientSession,
+    urlp: GiteaUrlParams,
+    out_dir: str,
+    fetchp: GiteaFetchParams,
+) -> dict:
+    """Download full tree as archive or blob by blob.
 
-    async with aiohttp.ClientSession() as sess:
-        head_sha = await get_ref_sha(sess, url_params)
-        temp_dir = tempfile.mkdtemp()
-        await process_tree_refs_pages(head_sha, sess, url_params, temp_dir)
-        calc_sha_for_files_in_dir(temp_dir)
-        return temp_dir
+    :param sha: SHA of the HEAD or another ref.
+    :param sess: Active session.
+    :param urlp: Base URL parameters for repository.
+    :param out_dir: Existing directory for files.
+    :param fetchp: Fetching parameters.
+    :returns: Manifest dict of SHA-256 hashes by absolute file path.
+    """
+    manifest = None
+    if ARCHIVE_DOWNLOADS:
+        manifest = await download_archive(sha, sess, urlp, out_dir, fetchp)
+    if manifest is None:
+        manifest = await process_tree_refs_pages(
+            sha,
+            sess,
+            urlp,
+            out_dir,
+            fetchp=fetchp,
+        )
+    return manifest
 
 
 if __name__ == '__main__':
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(main())
+    asyncio.run(main(*sys.argv[1:3]))
@@ -0,0 +1,151 @@
+"""Mirroring of many repositories and refs over one session."""
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from typing import Iterable
+
+import aiohttp
+
+import log
+from gitea.concurrency import ConcurrencyBudget
+from gitea.config import MAX_REFS_PER_PAGE, RATE_BURST, RATE_LIMIT, REF_HEAD
+from gitea.fetch_params import GiteaFetchParams
+from gitea.file_writer import FileWriter
+from gitea.metrics import METRICS
+from gitea.repo_head import get_ref_sha
+from gitea.retry import RetryPolicy, TokenBucket
+from gitea.session import create_session
+from gitea.url_params import GiteaUrlParams
+from main import create_fetch_params, download_tree, report_run
+
+
+async def mirror(targets: list, out_root: str | None = None) -> dict:
+    """Download trees of many targets concurrently.
+
+    All targets share one session, one file writer, one rate limiter
+    and one budget of requests and bytes in flight. Waiting requests
+    of targets are served in round-robin order, so one huge repository
+    does not starve the others. Metrics of all targets are reported
+    at the end.
+
+    :param targets: Tuples of owner, project and ref.
+    :param out_root: Root directory for files. Tree of each target
+        is loaded to out_root/owner/project/ref. New temp directory
+        is used for each target if None.
+    :returns: Dict of directory with files by target. Value is
+        the exception if target failed.
+    """
+    log.init_logger()
+    METRICS.reset()
+    concurrency = ConcurrencyBudget()
+    limiter = None
+    if RATE_LIMIT > 0:
+        limiter = TokenBucket(RATE_LIMIT, RATE_BURST)
+
+    async with create_session() as sess, FileWriter() as writer:
+        fetch_params = []
+        for owner, project, ref in targets:
+            params = create_fetch_params(RetryPolicy(
+                limiter=limiter,
+                concurrency=concurrency,
+                key='{0}/{1}'.format(owner, project),
+            ))
+            params.writer = writer
+            fetch_params.append(params)
+
+        results = await asyncio.gather(
+            *[
+                mirror_target(target, sess, out_root, params)
+                for target, params in zip(targets, fetch_params)
+            ],
+            return_exceptions=True,
+        )
+
+    for target, result in zip(targets, results):
+        if isinstance(result, BaseException):
+            msg = 'Target {0} failed: {1!r}'.format(target, result)
+            logging.error(msg)
+    report_run()
+    return dict(zip(targets, results))
+
+
+async def mirror_target(
+    target: tuple,
+    sess: aiohttp.ClientSession,
+    out_root: str | None,
+    fetchp: GiteaFetchParams,
+) -> str:
+    """Download tree of the ref of one repository.
+
+    :param target: Tuple of owner, project and ref.
+    :param sess: Active session.
+    :param out_root: Root directory for files. New temp directory
+        is used if None.
+    :param fetchp: Fetching parameters.
+    :returns: Directory with files of the ref.
+    :raises ValueError: Ref is not found.
+    """
+    owner, project, ref = target
+    url_params = GiteaUrlParams(
+        owner=owner,
+        project=project,
+        max_refs_per_page=MAX_REFS_PER_PAGE,
+    )
+    head_sha = await get_ref_sha(sess, url_params, ref, fetchp=fetchp)
+    if not head_sha:
+        raise ValueError('Ref not found: {0}'.format(target))
+
+    if out_root is None:
+        out_dir = tempfile.mkdtemp()
+    else:
+        out_dir = os.path.join(out_root, owner, project, *ref.split('/'))
+        os.makedirs(out_dir, exist_ok=True)
+
+    manifest = await download_tree(
+        head_sha,
+        sess,
+        url_params,
+        out_dir,
+        fetchp,
+    )
+    msg = 'Target {0} mirrored to {1}: {2} files, SHA {3}'.format(
+        target,
+        out_dir,
+        len(manifest),
+        head_sha,
+    )
+    logging.info(msg)
+    return out_dir
+
+
+def parse_targets(lines: Iterable[str]) -> list:
+    """Parse targets, one per line: owner project [ref].
+
+    Empty lines and lines starting with # are skipped.
+
+    :param lines: Lines of targets file.
+    :returns: Tuples of owner, project and ref.
+    :raises ValueError: Line has wrong number of fields.
+    """
+    targets = []
+    for line in lines:
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        if len(fields) not in {2, 3}:
+            raise ValueError('Wrong target: {0}'.format(line.strip()))
+        if len(fields) == 2:
+            fields.append(REF_HEAD)
+        targets.append(tuple(fields))
+    return targets
+
+
+if __name__ == '__main__':
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    with open(sys.argv[1]) as targets_file:
+        mirror_targets = parse_targets(targets_file)
+    asyncio.run(mirror(mirror_targets, *sys.argv[2:3]))
@@ -1,49 +1,339 @@
 """Calculations of SHA-256 hash for files."""
 
 import hashlib
+import itertools
 import logging
+import mmap
+import os
+import time
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from functools import partial
+from types import MappingProxyType
+from typing import Any, BinaryIO, Callable, Iterable, Iterator
 
-from filesystem import get_files_recursive
+from filesystem import walk_files
+from gitea.log_message import BraceMessage
+from gitea.metrics import METRICS
+from hash_manifest import HashManifest
 
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
+PROCESS_CHUNK_SIZE = 16
 
-def calc_sha256(file_path: str, block_size: int = 4096) -> str:
+BLOCK_SIZE = 1 << 20
+MMAP_FILE_SIZE = 64 << 20
+BACKEND_AUTO = 'auto'
+BACKEND_READ = 'read'
+BACKEND_READINTO = 'readinto'
+BACKEND_FILE_DIGEST = 'file_digest'
+BACKEND_MMAP = 'mmap'
+
+Hash = Any
+
+logger = logging.getLogger(__name__)
+
+
+def calc_sha256(
+    file_path: str,
+    block_size: int = BLOCK_SIZE,
+    backend: str = BACKEND_AUTO,
+) -> str:
     """Calculate SHA-256 for file.
 
+    Backend 'auto' reads small files (not larger than block_size) in
+    a single call, maps files of MMAP_FILE_SIZE and larger to memory
+    and uses hashlib.file_digest (readinto a reused buffer) otherwise.
+
     :param file_path: Path to file.
     :param block_size: Size of block to read in bytes.
+    :param backend: Hashing backend: 'auto', 'read', 'readinto',
+        'file_digest' or 'mmap'.
     :returns: SHA-256 hash for file.
+    :raises ValueError: Unknown backend.
+    """
+    timer = METRICS.timer('hash_seconds')
+    with timer, open(file_path, 'rb', buffering=0) as fp:
+        file_size = os.fstat(fp.fileno()).st_size
+        if backend == BACKEND_AUTO:
+            backend = choose_backend(file_size, block_size)
+
+        hash_file = HASH_BACKENDS.get(backend)
+        if hash_file is None:
+            raise ValueError('Unknown backend: {0}'.format(backend))
+        sha = hash_file(fp, block_size).hexdigest()
+
+    METRICS.inc('hashed_files_total')
+    METRICS.inc('hashed_bytes_total', file_size)
+    return sha
+
+
+def choose_backend(file_size: int, block_size: int) -> str:
+    """Choose hashing backend by size of file.
+
+    :param file_size: Size of file in bytes.
+    :param block_size: Size of block to read in bytes.
+    :returns: Name of backend.
+    """
+    if file_size <= block_size:
+        return BACKEND_READ
+    if file_size >= MMAP_FILE_SIZE:
+        return BACKEND_MMAP
+    if hasattr(hashlib, 'file_digest'):
+        return BACKEND_FILE_DIGEST
+    return BACKEND_READINTO
+
+
+def hash_read(fp: BinaryIO, block_size: int) -> Hash:
+    """Hash file by blocks of new bytes objects.
+
+    :param fp: File opened in binary mode.
+    :param block_size: Size of block to read in bytes.
+    :returns: SHA-256 hash object.
+    """
+    sha256_hash = hashlib.sha256()
+    while True:
+        block = fp.read(block_size)
+        if not block:
+            break
+        sha256_hash.update(block)
+    return sha256_hash
+
+
+def hash_readinto(fp: BinaryIO, block_size: int) -> Hash:
+    """Hash file by blocks read into a reused buffer.
+
+    :param fp: File opened in binary mode.
+    :param block_size: Size of block to read in bytes.
+    :returns: SHA-256 hash object.
+    """
+    sha256_hash = hashlib.sha256()
+    buffer = memoryview(bytearray(block_size))
+    while True:
+        size = fp.readinto(buffer)
+        if not size:
+            break
+        sha256_hash.update(buffer[:size])
+    return sha256_hash
+
+
+def hash_file_digest(fp: BinaryIO, block_size: int) -> Hash:
+    """Hash file by hashlib.file_digest.
+
+    :param fp: File opened in binary mode.
+    :param block_size: Not used, file_digest chooses its own buffer.
+    :returns: SHA-256 hash object.
+    """
+    if not hasattr(hashlib, 'file_digest'):
+        return hash_readinto(fp, block_size)
+    return hashlib.file_digest(fp, 'sha256')
+
+
+def hash_mmap(fp: BinaryIO, block_size: int) -> Hash:
+    """Hash file mapped to memory.
+
+    :param fp: File opened in binary mode.
+    :param block_size: Size of block to read if file is empty
+        and can not be mapped.
+    :returns: SHA-256 hash object.
     """
+    if not os.fstat(fp.fileno()).st_size:
+        return hash_read(fp, block_size)
+
     sha256_hash = hashlib.sha256()
-    with open(file_path, 'rb') as fp:
-        while True:
-            block = fp.read(block_size)
-            if not block:
-                break
-            sha256_hash.update(block)
-    return sha256_hash.hexdigest()
+    with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        sha256_hash.update(mapped)
+    return sha256_hash
+
+
+HASH_BACKENDS = MappingProxyType({
+    BACKEND_READ: hash_read,
+    BACKEND_READINTO: hash_readinto,
+    BACKEND_FILE_DIGEST: hash_file_digest,
+    BACKEND_MMAP: hash_mmap,
+})
 
 
 def calc_sha_for_files_in_dir(
     directory: str,
     save_stats: bool = False,
+    workers: int = 1,
+    executor: str = EXECUTOR_THREAD,
+    ordered: bool = True,
+    backend: str = BACKEND_AUTO,
+    manifest_path: str | None = None,
+    strict: bool = False,
 ) -> dict:
     """Calculate SHA256 checksum for each file in directory recursively.
 
+    Files are hashed one by one if workers is 1. Otherwise files are
+    hashed by pool of threads (hashlib releases GIL for large buffers)
+    or processes (better for many small files).
+
+    If manifest_path is set, hashes of files unchanged since the previous
+    scan are taken from the manifest file instead of reading the files,
+    and the updated manifest is written back.
+
     :param directory: Directory to parse.
     :param save_stats: Save filename and SHA to dict if True
+    :param workers: Number of hashing workers.
+    :param executor: Type of workers pool: 'thread' or 'process'.
+    :param ordered: Return results in walk order if True, in completion
+        order otherwise.
+    :param backend: Hashing backend of calc_sha256.
+    :param manifest_path: Path to persistent hash manifest file.
+        Manifest is not used if None.
+    :param strict: Hash all files ignoring stored manifest. Manifest is
+        still written if manifest_path is set.
     :returns: Dict with stats or empty dict depends on save_stats.
     """
     msg = 'Calculation of hashes for directory: {0}'.format(directory)
-    logging.info(msg)
+    logger.info(msg)
 
-    stats = {}
+    if manifest_path is None:
+        results = hash_files(
+            walk_files(directory),
+            workers,
+            executor,
+            ordered,
+            backend,
+        )
+        return collect_stats(results, save_stats)
+
+    new_manifest = HashManifest(time.time_ns())
+    manifest = HashManifest()
+    if not strict:
+        manifest = HashManifest.load(manifest_path)
+
+    infos = {}
+    reused = {}
+    for info in walk_files(directory, with_stat=True):
+        relative_path = os.path.relpath(info.path, directory)
+        infos[info.path] = (relative_path, info)
+        sha = manifest.get(relative_path, info)
+        if sha is not None:
+            reused[info.path] = sha
+
+    msg = 'Hashes reused from manifest: {0} of {1}'.format(
+        len(reused),
+        len(infos),
+    )
+    logger.info(msg)
+
+    hashed = hash_files(
+        [path for path in infos if path not in reused],
+        workers,
+        executor,
+        ordered,
+        backend,
+    )
+    if ordered:
+        hashed = dict(hashed)
+        results = [
+            (path, reused.get(path) or hashed.get(path)) for path in infos
+        ]
+    else:
+        results = itertools.chain(reused.items(), hashed)
+
+    stats = collect_stats(results, save_stats=True)
+    for file_path, sha in stats.items():
+        new_manifest.set(*infos[file_path], sha)
+    new_manifest.save(manifest_path)
+
+    if save_stats:
+        return stats
+    return {}
+
+
+def hash_files(
+    file_paths: Iterable[str],
+    workers: int,
+    executor: str,
+    ordered: bool,
+    backend: str,
+) -> Iterator[tuple]:
+    """Hash files one by one or by pool of workers.
+
+    :param file_paths: Paths to files.
+    :param workers: Number of hashing workers.
+    :param executor: Type of workers pool: 'thread' or 'process'.
+    :param ordered: Yield results in order of file_paths if True,
+        in completion order otherwise.
+    :param backend: Hashing backend of calc_sha256.
+    :yields: Tuple of file path and SHA-256 hash.
+    :raises ValueError: Unknown executor type.
+    """
+    hash_file = partial(calc_sha256, backend=backend)
+    if workers <= 1:
+        yield from ((path, hash_file(path)) for path in file_paths)
+        return
 
-    for file_path in get_files_recursive(directory):
-        sha = calc_sha256(file_path)
+    if executor == EXECUTOR_THREAD:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    elif executor == EXECUTOR_PROCESS:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError('Unknown executor: {0}'.format(executor))
+
+    with pool:
+        if ordered:
+            yield from map_ordered(pool, hash_file, file_paths)
+        else:
+            yield from map_completed(pool, hash_file, file_paths)
+
+
+def map_ordered(
+    pool: Executor,
+    hash_file: Callable[[str], str],
+    file_paths: Iterable[str],
+) -> Iterator[tuple]:
+    """Hash files by pool, yield results in order of file_paths.
+
+    :param pool: Pool of workers.
+    :param hash_file: Function calculating SHA-256 for file path.
+    :param file_paths: Paths to files.
+    :yields: Tuple of file path and SHA-256 hash.
+    """
+    file_paths = list(file_paths)
+    yield from zip(
+        file_paths,
+        pool.map(hash_file, file_paths, chunksize=PROCESS_CHUNK_SIZE),
+    )
+
+
+def map_completed(
+    pool: Executor,
+    hash_file: Callable[[str], str],
+    file_paths: Iterable[str],
+) -> Iterator[tuple]:
+    """Hash files by pool, yield results in order of completion.
+
+    :param pool: Pool of workers.
+    :param hash_file: Function calculating SHA-256 for file path.
+    :param file_paths: Paths to files.
+    :yields: Tuple of file path and SHA-256 hash.
+    """
+    futures = {pool.submit(hash_file, path): path for path in file_paths}
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+
+def collect_stats(results: Iterable[tuple], save_stats: bool) -> dict:
+    """Log hashes of files and collect them to dict.
+
+    :param results: Tuples of file path and SHA-256 hash.
+    :param save_stats: Save filename and SHA to dict if True
+    :returns: Dict with stats or empty dict depends on save_stats.
+    """
+    stats = {}
 
+    for file_path, sha in results:
         if save_stats:
             stats[file_path] = sha
 
-        msg = 'File: {0}. SHA256: {1}'.format(file_path, sha)
-        logging.info(msg)
+        logger.info(BraceMessage('File: {0}. SHA256: {1}', file_path, sha))
     return stats
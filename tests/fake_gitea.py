@@ -0,0 +1,260 @@
+"""Local fake gitea server with synthetic repositories for benchmarks."""
+import asyncio
+import base64
+import hashlib
+import io
+import random
+import tarfile
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+TREE_SHA = 'f' * 40
+DEFAULT_REF = 'refs/heads/master'
+API_PREFIX = '/api/v1/repos/{owner}/{project}'
+
+
+@dataclass
+class SyntheticRepo(object):
+    """Repository of generated files.
+
+    :cvar files_count: Number of files.
+    :cvar min_size: Min size of file in bytes.
+    :cvar max_size: Max size of file in bytes. Sizes are distributed
+        log-uniformly between min_size and max_size.
+    :cvar depth: Depth of directories of files.
+    :cvar fanout: Number of subdirectories of each directory.
+    :cvar executable_ratio: Ratio of executable files.
+    :cvar seed: Seed of generator, same seed gives same repository.
+    """
+
+    files_count: int = 100
+    min_size: int = 16
+    max_size: int = 16384
+    depth: int = 3
+    fanout: int = 4
+    executable_ratio: float = 0.1
+    seed: int = 0
+    blobs: dict = field(default_factory=dict, init=False)
+    entries: list = field(default_factory=list, init=False)
+    shas: dict = field(default_factory=dict, init=False)
+
+    def __post_init__(self) -> None:
+        rnd = random.Random(self.seed)
+        directories = set()
+        for index in range(self.files_count):
+            parts = [
+                'dir{0}'.format(rnd.randrange(self.fanout))
+                for _ in range(rnd.randint(0, self.depth))
+            ]
+            for level in range(1, len(parts) + 1):
+                directories.add('/'.join(parts[:level]))
+            path = '/'.join(parts + ['file{0}'.format(index)])
+
+            ratio = self.max_size / self.min_size
+            size = int(self.min_size * ratio ** rnd.random())
+            data = rnd.randbytes(size)
+            sha = git_blob_sha(data)
+            self.blobs[sha] = data
+            is_executable = rnd.random() < self.executable_ratio
+            self.entries.append({
+                'path': path,
+                'mode': '100755' if is_executable else '100644',
+                'type': 'blob',
+                'size': size,
+                'sha': sha,
+            })
+
+        for directory in sorted(directories):
+            self.entries.append({
+                'path': directory,
+                'mode': '040000',
+                'type': 'tree',
+                'sha': hashlib.sha1(directory.encode()).hexdigest(),
+            })
+        self.entries.sort(key=lambda entry: entry['path'])
+        self.shas = {
+            entry['path']: entry['sha']
+            for entry in self.entries
+            if entry['type'] == 'blob'
+        }
+
+    @property
+    def total_size(self) -> int:
+        """Total size of files in bytes.
+
+        :returns: Size in bytes.
+        """
+        return sum(len(data) for data in self.blobs.values())
+
+    def expected_hashes(self) -> dict:
+        """SHA-256 of files by relative path.
+
+        :returns: Dict of hashes.
+        """
+        return {
+            entry['path']: hashlib.sha256(self.blobs[entry['sha']]).hexdigest()
+            for entry in self.entries
+            if entry['type'] == 'blob'
+        }
+
+
+@dataclass
+class Faults(object):
+    """Faults injected into responses.
+
+    :cvar latency: Delay of each response in seconds.
+    :cvar error_rate: Ratio of responses failed with 503 and Retry-After.
+    :cvar seed: Seed of generator of errors.
+    """
+
+    latency: float = 0
+    error_rate: float = 0
+    seed: int = 0
+
+
+class FakeGitea(object):
+    """aiohttp server implementing refs, trees, blobs, raw and archive."""
+
+    def __init__(
+        self,
+        repos: dict,
+        faults: Faults | None = None,
+        max_page_size: int = 1000,
+    ) -> None:
+        """Init server.
+
+        :param repos: SyntheticRepo by tuple of owner and project.
+        :param faults: Injected faults. No faults if None.
+        :param max_page_size: Max number of tree entries in page.
+        """
+        self.repos = repos
+        self.faults = faults or Faults()
+        self.max_page_size = max_page_size
+        self.requests_count = 0
+        self.errors_count = 0
+        self._random = random.Random(self.faults.seed)
+        self._archives = {}
+        self._runner = None
+        self.base_api_url = ''
+
+    async def __aenter__(self) -> 'FakeGitea':
+        app = web.Application(middlewares=[self._inject_faults])
+        app.add_routes([
+            web.get(API_PREFIX + '/git/refs', self._refs),
+            web.get(API_PREFIX + '/git/trees/{sha}', self._tree),
+            web.get(API_PREFIX + '/git/blobs/{sha}', self._blob),
+            web.get(API_PREFIX + '/raw/{path:.+}', self._raw),
+            web.get(API_PREFIX + '/archive/{sha}.tar.gz', self._archive),
+        ])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_api_url = 'http://127.0.0.1:{0}/api/v1'.format(port)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._runner.cleanup()
+
+    @web.middleware
+    async def _inject_faults(self, request, handler):
+        self.requests_count += 1
+        if self.faults.latency:
+            await asyncio.sleep(self.faults.latency)
+        if self._random.random() < self.faults.error_rate:
+            self.errors_count += 1
+            raise web.HTTPServiceUnavailable(headers={'Retry-After': '0'})
+        return await handler(request)
+
+    def _get_repo(self, request) -> SyntheticRepo:
+        repo = self.repos.get((
+            request.match_info['owner'],
+            request.match_info['project'],
+        ))
+        if repo is None:
+            raise web.HTTPNotFound()
+        return repo
+
+    async def _refs(self, request):
+        self._get_repo(request)
+        return web.json_response([
+            {'ref': DEFAULT_REF, 'object': {'sha': TREE_SHA}},
+        ])
+
+    async def _tree(self, request):
+        repo = self._get_repo(request)
+        page = int(request.query.get('page', 1))
+        per_page = min(
+            int(request.query.get('per_page', 30)),
+            self.max_page_size,
+        )
+        start = (page - 1) * per_page
+        entries = [
+            dict(entry, url='{0}/repos/{1}/{2}/git/blobs/{3}'.format(
+                self.base_api_url,
+                request.match_info['owner'],
+                request.match_info['project'],
+                entry['sha'],
+            ))
+            for entry in repo.entries[start:start + per_page]
+        ]
+        return web.json_response({
+            'sha': request.match_info['sha'],
+            'tree': entries,
+            'truncated': start + per_page < len(repo.entries),
+            'page': page,
+            'total_count': len(repo.entries),
+        })
+
+    async def _blob(self, request):
+        repo = self._get_repo(request)
+        data = repo.blobs.get(request.match_info['sha'])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.json_response({
+            'content': base64.b64encode(data).decode('ascii'),
+            'encoding': 'base64',
+            'sha': request.match_info['sha'],
+            'size': len(data),
+        })
+
+    async def _raw(self, request):
+        repo = self._get_repo(request)
+        sha = repo.shas.get(request.match_info['path'])
+        if sha is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=repo.blobs[sha])
+
+    async def _archive(self, request):
+        repo = self._get_repo(request)
+        key = (request.match_info['owner'], request.match_info['project'])
+        if key not in self._archives:
+            self._archives[key] = make_archive(
+                request.match_info['project'],
+                repo,
+            )
+        return web.Response(body=self._archives[key])
+
+
+def git_blob_sha(data: bytes) -> str:
+    header = 'blob {0}\0'.format(len(data)).encode()
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def make_archive(project: str, repo: SyntheticRepo) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for entry in repo.entries:
+            info = tarfile.TarInfo('{0}/{1}'.format(project, entry['path']))
+            if entry['type'] == 'tree':
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                archive.addfile(info)
+                continue
+            data = repo.blobs[entry['sha']]
+            info.size = len(data)
+            info.mode = 0o755 if entry['mode'] == '100755' else 0o644
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
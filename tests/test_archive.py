@@ -0,0 +1,197 @@
+"""Test archive.py functions."""
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import zlib
+from http import HTTPStatus
+
+import aiohttp
+import aioresponses
+import pytest
+
+from gitea.archive import ChunkReader, download_archive, get_archive_url
+from gitea.fetch_params import GiteaFetchParams
+from gitea.url_params import GiteaUrlParams
+
+ARCHIVE_SHA = 'c0ffee'
+FILE_DATA = b'data' * 1000
+
+
+def add_member(archive: tarfile.TarFile, name: str, **kwargs) -> None:
+    data = kwargs.pop('data', b'')
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    for key, value in kwargs.items():
+        setattr(info, key, value)
+    archive.addfile(info, io.BytesIO(data))
+
+
+def get_archive_bytes() -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        add_member(archive, 'project/', type=tarfile.DIRTYPE, mode=0o755)
+        add_member(archive, 'project/dir/', type=tarfile.DIRTYPE)
+        add_member(archive, 'project/dir/file', data=FILE_DATA, mode=0o644)
+        add_member(archive, 'project/exec', data=b'#!/bin/sh', mode=0o755)
+        add_member(archive, 'project/nested/deep/file', data=b'deep')
+        add_member(
+            archive,
+            'project/link',
+            type=tarfile.SYMTYPE,
+            linkname='dir/file',
+        )
+        add_member(archive, 'project/../evil', data=b'evil')
+    return buffer.getvalue()
+
+
+def gzip_bytes(data: bytes) -> bytes:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+@pytest.mark.asyncio()
+async def test_chunk_reader():
+    compressed = gzip_bytes(b'abcde')
+    reader = ChunkReader(queue_size=4)
+    for chunk in (compressed[:5], compressed[5:], b''):
+        assert await reader.put(chunk)
+
+    assert reader.read(2) == b'ab'
+    assert reader.read(10) == b'cde'
+    assert reader.read() == b''
+
+    reader.close()
+    assert not await reader.put(b'f')
+
+
+@pytest.mark.asyncio()
+async def test_chunk_reader_close_wakes_put():
+    reader = ChunkReader(queue_size=1)
+    assert await reader.put(b'a')
+
+    put = asyncio.create_task(reader.put(b'b'))
+    await asyncio.sleep(0)
+    assert not put.done()
+
+    await asyncio.to_thread(reader.close)
+    assert not await asyncio.wait_for(put, 1)
+
+
+@pytest.mark.asyncio()
+async def test_chunk_reader_truncated():
+    reader = ChunkReader()
+    await reader.put(gzip_bytes(b'abcde')[:-4])
+    await reader.put(b'')
+
+    with pytest.raises(EOFError):
+        reader.read()
+
+
+@pytest.mark.asyncio()
+async def test_download_archive():
+    out_dir = tempfile.mkdtemp()
+    urlp = GiteaUrlParams()
+    with aioresponses.aioresponses() as aresp:
+        aresp.get(
+            get_archive_url(ARCHIVE_SHA, urlp),
+            status=HTTPStatus.OK,
+            body=get_archive_bytes(),
+        )
+        async with aiohttp.ClientSession() as sess:
+            manifest = await download_archive(
+                ARCHIVE_SHA,
+                sess,
+                urlp,
+                out_dir,
+                GiteaFetchParams(chunk_size=100),
+            )
+
+    file_path = os.path.join(out_dir, 'dir', 'file')
+    assert manifest == {
+        file_path: hashlib.sha256(FILE_DATA).hexdigest(),
+        os.path.join(out_dir, 'exec'): (
+            hashlib.sha256(b'#!/bin/sh').hexdigest()
+        ),
+        os.path.join(out_dir, 'nested', 'deep', 'file'): (
+            hashlib.sha256(b'deep').hexdigest()
+        ),
+    }
+    assert os.access(os.path.join(out_dir, 'exec'), os.X_OK)
+    assert not os.access(file_path, os.X_OK)
+    assert not os.path.lexists(os.path.join(out_dir, 'link'))
+    assert not os.path.exists(os.path.join(os.path.dirname(out_dir), 'evil'))
+
+    shutil.rmtree(out_dir)
+
+
+@pytest.mark.asyncio()
+async def test_download_archive_many():
+    archives_count = 6
+    urlp = GiteaUrlParams()
+    out_dirs = [tempfile.mkdtemp() for _ in range(archives_count)]
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=2),
+    )
+    with aioresponses.aioresponses() as aresp:
+        aresp.get(
+            get_archive_url(ARCHIVE_SHA, urlp),
+            status=HTTPStatus.OK,
+            body=get_archive_bytes(),
+            repeat=True,
+        )
+        async with aiohttp.ClientSession() as sess:
+            manifests = await asyncio.wait_for(
+                asyncio.gather(*[
+                    download_archive(
+                        ARCHIVE_SHA,
+                        sess,
+                        urlp,
+                        out_dir,
+                        GiteaFetchParams(chunk_size=100),
+                    )
+                    for out_dir in out_dirs
+                ]),
+                timeout=10,
+            )
+
+    assert [len(manifest) for manifest in manifests] == [3] * archives_count
+
+    for out_dir in out_dirs:
+        shutil.rmtree(out_dir)
+
+
+@pytest.mark.asyncio()
+async def test_download_archive_not_found():
+    urlp = GiteaUrlParams()
+    with aioresponses.aioresponses() as aresp:
+        aresp.get(
+            get_archive_url(ARCHIVE_SHA, urlp),
+            status=HTTPStatus.NOT_FOUND,
+        )
+        async with aiohttp.ClientSession() as sess:
+            manifest = await download_archive(ARCHIVE_SHA, sess, urlp, '')
+
+    assert manifest is None
+
+
+@pytest.mark.asyncio()
+async def test_download_archive_broken():
+    out_dir = tempfile.mkdtemp()
+    urlp = GiteaUrlParams()
+    with aioresponses.aioresponses() as aresp:
+        aresp.get(
+            get_archive_url(ARCHIVE_SHA, urlp),
+            status=HTTPStatus.OK,
+            body=get_archive_bytes()[:-10],
+        )
+        async with aiohttp.ClientSession() as sess:
+            with pytest.raises(EOFError):
+                await download_archive(ARCHIVE_SHA, sess, urlp, out_dir)
+
+    shutil.rmtree(out_dir)
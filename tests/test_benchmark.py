@@ -0,0 +1,244 @@
+"""Benchmarks of full tree download against local fake gitea server.
+
+Size of synthetic repository is set by environment variables
+BENCH_FILES, BENCH_MIN_SIZE, BENCH_MAX_SIZE, BENCH_DEPTH, BENCH_LATENCY
+and BENCH_ERROR_RATE. Defaults are small to keep the suite fast.
+If BENCH_OUTPUT is set, results (files/s, MB/s, peak RSS sampled
+during the run and its growth over RSS at the start of the run) are
+appended to it as JSON lines. Benchmarks are deselected by default,
+run them with: pytest -m benchmark
+"""
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pytest
+from fake_gitea import TREE_SHA, FakeGitea, Faults, SyntheticRepo
+from pytest_mock import MockerFixture
+
+import main
+from gitea.fetch_params import GiteaFetchParams
+from gitea.refs_tree import process_tree_refs_pages
+from gitea.session import create_session
+from gitea.url_params import GiteaUrlParams
+
+OWNER = 'radium'
+PROJECT = 'bench'
+MODES = ('buffered', 'stream', 'raw', 'archive')
+STATM_PATH = '/proc/self/statm'
+RSS_SAMPLE_INTERVAL = 0.005
+
+
+def get_env_number(name: str, default: float) -> float:
+    return type(default)(os.environ.get(name, default))
+
+
+def create_repo() -> SyntheticRepo:
+    return SyntheticRepo(
+        files_count=get_env_number('BENCH_FILES', 60),
+        min_size=get_env_number('BENCH_MIN_SIZE', 16),
+        max_size=get_env_number('BENCH_MAX_SIZE', 65536),
+        depth=get_env_number('BENCH_DEPTH', 3),
+    )
+
+
+def create_faults() -> Faults:
+    return Faults(
+        latency=get_env_number('BENCH_LATENCY', 0.0),
+        error_rate=get_env_number('BENCH_ERROR_RATE', 0.0),
+    )
+
+
+def get_rss() -> int:
+    """Get current RSS of the test process in bytes, 0 if unknown."""
+    try:
+        with open(STATM_PATH) as fp:
+            pages = int(fp.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class RssSampler(object):
+    """Peak RSS of the test process sampled while the run is in progress.
+
+    ru_maxrss is the peak of the whole process, so every benchmark after
+    the largest one would report the same value.
+    """
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self) -> 'RssSampler':
+        self.baseline = get_rss()
+        self.peak = self.baseline
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self.peak = max(self.peak, get_rss())
+
+    @property
+    def growth(self) -> int:
+        """Growth of RSS during the run in bytes."""
+        return self.peak - self.baseline
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, get_rss())
+
+
+def record_result(
+    name: str,
+    repo: SyntheticRepo,
+    elapsed: float,
+    server: FakeGitea,
+    rss: RssSampler,
+) -> dict:
+    result = {
+        'name': name,
+        'files': repo.files_count,
+        'bytes': repo.total_size,
+        'seconds': elapsed,
+        'files_per_second': repo.files_count / elapsed,
+        'mb_per_second': repo.total_size / elapsed / (1 << 20),
+        'peak_rss_bytes': rss.peak,
+        'rss_growth_bytes': rss.growth,
+        'requests': server.requests_count,
+        'injected_errors': server.errors_count,
+    }
+    output_path = os.environ.get('BENCH_OUTPUT')
+    if output_path:
+        with open(output_path, 'a', encoding='utf-8') as fp:
+            fp.write('{0}\n'.format(json.dumps(result)))
+    return result
+
+
+def get_tree_hashes(out_dir: str) -> dict:
+    hashes = {}
+    for root, _, files in os.walk(out_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as fp:
+                relative_path = os.path.relpath(path, out_dir)
+                hashes[relative_path.replace(os.sep, '/')] = hashlib.sha256(
+                    fp.read(),
+                ).hexdigest()
+    return hashes
+
+
+def patch_main(mocker: MockerFixture, server: FakeGitea, mode: str) -> None:
+    mocker.patch('main.log.init_logger')
+    mocker.patch('main.ARCHIVE_DOWNLOADS', mode == 'archive')
+    mocker.patch('main.GiteaUrlParams', functools.partial(
+        GiteaUrlParams,
+        base_api_url=server.base_api_url,
+        owner=OWNER,
+        project=PROJECT,
+    ))
+    mocker.patch('main.GiteaFetchParams', functools.partial(
+        GiteaFetchParams,
+        stream_blobs=mode == 'stream',
+        raw_blobs=mode == 'raw',
+    ))
+
+
+@pytest.mark.benchmark()
+@pytest.mark.asyncio()
+@pytest.mark.parametrize('mode', MODES)
+async def test_bench_main(mocker: MockerFixture, mode: str):
+    repo = create_repo()
+    async with FakeGitea({(OWNER, PROJECT): repo}, create_faults()) as server:
+        patch_main(mocker, server, mode)
+
+        with RssSampler() as rss:
+            start = time.perf_counter()
+            out_dir, head_sha = await main.main()
+            elapsed = time.perf_counter() - start
+
+        assert head_sha == TREE_SHA
+        assert get_tree_hashes(out_dir) == repo.expected_hashes()
+        result = record_result(
+            'main_{0}'.format(mode),
+            repo,
+            elapsed,
+            server,
+            rss,
+        )
+
+    assert result['files_per_second'] > 0
+    shutil.rmtree(out_dir)
+
+
+@pytest.mark.benchmark()
+@pytest.mark.asyncio()
+async def test_bench_process_tree_refs_pages():
+    repo = create_repo()
+    out_dir = tempfile.mkdtemp()
+    async with FakeGitea(
+        {(OWNER, PROJECT): repo},
+        create_faults(),
+        max_page_size=20,
+    ) as server:
+        urlp = GiteaUrlParams(
+            base_api_url=server.base_api_url,
+            owner=OWNER,
+            project=PROJECT,
+            max_refs_per_page=50,
+        )
+        async with create_session() as sess:
+            with RssSampler() as rss:
+                start = time.perf_counter()
+                manifest = await process_tree_refs_pages(
+                    TREE_SHA,
+                    sess,
+                    urlp,
+                    out_dir,
+                )
+                elapsed = time.perf_counter() - start
+
+        expected = {
+            os.path.join(out_dir, *path.split('/')): sha
+            for path, sha in repo.expected_hashes().items()
+        }
+        assert manifest == expected
+        record_result(
+            'process_tree_refs_pages',
+            repo,
+            elapsed,
+            server,
+            rss,
+        )
+
+    shutil.rmtree(out_dir)
+
+
+@pytest.mark.benchmark()
+@pytest.mark.asyncio()
+async def test_bench_main_injected_errors(mocker: MockerFixture):
+    repo = create_repo()
+    faults = Faults(error_rate=0.1, seed=1)
+    async with FakeGitea({(OWNER, PROJECT): repo}, faults) as server:
+        patch_main(mocker, server, 'buffered')
+
+        with RssSampler() as rss:
+            start = time.perf_counter()
+            out_dir, _ = await main.main()
+            elapsed = time.perf_counter() - start
+
+        assert server.errors_count > 0
+        assert get_tree_hashes(out_dir) == repo.expected_hashes()
+        record_result('main_injected_errors', repo, elapsed, server, rss)
+
+    shutil.rmtree(out_dir)
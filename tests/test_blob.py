@@ -10,9 +10,14 @@ import aiofiles
 import aiohttp
 import aioresponses
 import pytest
+from aiohttp import web
 from aiohttp.http_exceptions import HttpProcessingError
 
 from gitea import blob
+from gitea.blob_digest import BlobDigest
+from gitea.metrics import METRICS
+from gitea.retry import RetryPolicy
+from gitea.url_params import GiteaUrlParams
 
 PATH_KEY = 'path'
 SHA_KEY = 'sha'
@@ -64,13 +69,16 @@ async def test_write_blob_to_file(file_size: int = 8192):
 
     for blob_path in WRITE_FILES:
         absolute_path = (root_dir + os.sep + blob_path)
+        digest = BlobDigest()
 
         assert await blob.write_blob_to_file(
             TEST_BLOB_BYTES,
             relative_path=blob_path,
             temp_dir=root_dir,
             is_executable=True,
+            digest=digest,
         )
+        assert digest.hexdigest() == get_sha_from_bytes(TEST_BLOB_BYTES)
 
         assert os.path.exists(absolute_path)
         assert os.path.isfile(absolute_path)
@@ -159,3 +167,194 @@ async def test_get_blob_data():
 
             with pytest.raises(HttpProcessingError):
                 await blob.get_blob_data(TEST_BLOB_URL, sess)
+
+
+
+@pytest.mark.asyncio()
+async def test_get_blob_data_loads(mocker):
+    loads = mocker.Mock(return_value=get_blob_stub_data())
+    with aioresponses.aioresponses() as aresp:
+        aresp.get(TEST_BLOB_URL, status=HTTPStatus.OK, body=b'{}')
+        async with aiohttp.ClientSession() as sess:
+            blob_data = await blob.get_blob_data(
+                TEST_BLOB_URL,
+                sess,
+                loads=loads,
+            )
+
+    loads.assert_called_once_with(b'{}')
+    assert blob_data.decode('ascii') == DEBUG_DATA_VALUE
+
+
+TEST_RAW_URL = (
+    'https://gitea.radium.group/api/v1/repos/radium/' +
+    'project-configuration/raw/dir/some%20file?ref=' +
+    'eb4dc314435649737ad343ef82240b96256d5eb8'
+)
+
+
+def test_get_raw_blob_url():
+    url = blob.get_raw_blob_url(
+        'eb4dc314435649737ad343ef82240b96256d5eb8',
+        'dir/some file',
+        GiteaUrlParams(),
+    )
+    assert url == TEST_RAW_URL
+
+
+@pytest.mark.asyncio()
+async def test_stream_raw_blob_to_file():
+    METRICS.reset()
+    root_dir = tempfile.mkdtemp()
+    absolute_path = os.path.join(root_dir, 'dir', 'blob')
+
+    with aioresponses.aioresponses() as aresp:
+        async with aiohttp.ClientSession() as sess:
+            aresp.get(
+                TEST_RAW_URL,
+                status=HTTPStatus.OK,
+                body=TEST_BLOB_BYTES,
+            )
+
+            assert await blob.stream_raw_blob_to_file(
+                TEST_RAW_URL,
+                sess,
+                relative_path='dir{0}blob'.format(os.sep),
+                temp_dir=root_dir,
+                is_executable=True,
+                chunk_size=1000,
+            )
+
+            with open(absolute_path, 'rb') as fp:
+                assert fp.read() == TEST_BLOB_BYTES
+            assert os.access(absolute_path, os.X_OK)
+            assert METRICS.histograms['write_seconds'].count == 1
+
+            aresp.get(TEST_RAW_URL, status=HTTPStatus.NOT_FOUND)
+
+            assert not await blob.stream_raw_blob_to_file(
+                TEST_RAW_URL,
+                sess,
+                relative_path='blob2',
+                temp_dir=root_dir,
+                is_executable=False,
+                chunk_size=1000,
+            )
+
+    shutil.rmtree(root_dir)
+
+
+@pytest.mark.asyncio()
+async def test_stream_blob_to_file():
+    root_dir = tempfile.mkdtemp()
+    absolute_path = os.path.join(root_dir, 'blob')
+    stub_data = get_blob_stub_data()
+    stub_data['content'] = base64.b64encode(TEST_BLOB_BYTES).decode('ascii')
+
+    digest = BlobDigest()
+
+    with aioresponses.aioresponses() as aresp:
+        async with aiohttp.ClientSession() as sess:
+            aresp.get(TEST_BLOB_URL, status=HTTPStatus.OK, payload=stub_data)
+
+            assert await blob.stream_blob_to_file(
+                TEST_BLOB_URL,
+                sess,
+                relative_path='blob',
+                temp_dir=root_dir,
+                is_executable=False,
+                chunk_size=1000,
+                digest=digest,
+            )
+            assert digest.hexdigest() == get_sha_from_bytes(TEST_BLOB_BYTES)
+            with open(absolute_path, 'rb') as fp:
+                assert fp.read() == TEST_BLOB_BYTES
+
+            aresp.get(
+                TEST_BLOB_URL,
+                status=HTTPStatus.OK,
+                payload=get_blob_stub_data_base16(),
+            )
+
+            assert not await blob.stream_blob_to_file(
+                TEST_BLOB_URL,
+                sess,
+                relative_path='blob16',
+                temp_dir=root_dir,
+                is_executable=False,
+                chunk_size=1000,
+            )
+            assert not os.path.exists(os.path.join(root_dir, 'blob16'))
+
+            aresp.get(TEST_BLOB_URL, status=HTTPStatus.BAD_REQUEST)
+
+            assert not await blob.stream_blob_to_file(
+                TEST_BLOB_URL,
+                sess,
+                relative_path='blob400',
+                temp_dir=root_dir,
+                is_executable=False,
+                chunk_size=1000,
+            )
+
+    shutil.rmtree(root_dir)
+
+
+@pytest.mark.asyncio()
+async def test_stream_raw_blob_to_file_dropped_body():
+    root_dir = tempfile.mkdtemp()
+    responses = []
+
+    async def handler(request):
+        responses.append(request.path)
+        response = web.StreamResponse()
+        response.content_length = len(TEST_BLOB_BYTES)
+        await response.prepare(request)
+        if len(responses) == 1:
+            await response.write(TEST_BLOB_BYTES[:10])
+            request.transport.close()
+            return response
+        await response.write(TEST_BLOB_BYTES)
+        return response
+
+    app = web.Application()
+    app.router.add_get('/raw', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = 'http://127.0.0.1:{0}/raw'.format(runner.addresses[0][1])
+
+    digest = BlobDigest(git_size=len(TEST_BLOB_BYTES))
+    async with aiohttp.ClientSession() as sess:
+        assert await blob.stream_raw_blob_to_file(
+            url,
+            sess,
+            relative_path='blob',
+            temp_dir=root_dir,
+            is_executable=False,
+            chunk_size=4,
+            digest=digest,
+            retry=RetryPolicy(base_delay=0),
+        )
+    await runner.cleanup()
+
+    assert len(responses) == 2
+    assert digest.hexdigest() == get_sha_from_bytes(TEST_BLOB_BYTES)
+    with open(os.path.join(root_dir, 'blob'), 'rb') as fp:
+        assert fp.read() == TEST_BLOB_BYTES
+
+    shutil.rmtree(root_dir)
+
+
+def test_plan_directories():
+    plan = blob.plan_directories(['a/b/c/file', 'a/file', 'd/e/file', 'file'])
+    assert plan == ['a', 'd', 'a/b', 'd/e', 'a/b/c']
+
+    temp_dir = tempfile.mkdtemp()
+    blob.create_directories(plan, temp_dir)
+    blob.create_directories(plan, temp_dir)
+    assert os.path.isdir(os.path.join(temp_dir, 'a', 'b', 'c'))
+    assert os.path.isdir(os.path.join(temp_dir, 'd', 'e'))
+
+    shutil.rmtree(temp_dir)
@@ -0,0 +1,81 @@
+"""Test blob_cache.py functions."""
+import os
+import shutil
+import tempfile
+
+from gitea.blob_cache import BlobCache
+
+BLOB_SIZE = 100
+
+
+def make_blob_file(directory: str, name: str) -> str:
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as fp:
+        fp.write(os.urandom(BLOB_SIZE))
+    return path
+
+
+def read_file(path: str) -> bytes:
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+def test_store_and_restore():
+    cache_dir = tempfile.mkdtemp()
+    work_dir = tempfile.mkdtemp()
+    cache = BlobCache(cache_dir)
+    blob_path = make_blob_file(work_dir, 'blob')
+    restored_path = os.path.join(work_dir, 'restored')
+
+    assert not cache.restore('abcdef', restored_path)
+
+    cache.store('abcdef', blob_path)
+    assert os.path.isfile(os.path.join(cache_dir, 'ab', 'abcdef'))
+
+    assert BlobCache(cache_dir).restore('abcdef', restored_path)
+    assert read_file(restored_path) == read_file(blob_path)
+
+    shutil.rmtree(cache_dir)
+    shutil.rmtree(work_dir)
+
+
+def test_evict_least_recently_used():
+    cache_dir = tempfile.mkdtemp()
+    work_dir = tempfile.mkdtemp()
+    cache = BlobCache(cache_dir, max_size=BLOB_SIZE * 2)
+    restored_path = os.path.join(work_dir, 'restored')
+
+    for sha in ('aa01', 'bb02'):
+        cache.store(sha, make_blob_file(work_dir, sha))
+    os.utime(cache.get_path('aa01'), ns=(1, 1))
+    os.utime(cache.get_path('bb02'), ns=(2, 2))
+
+    # aa01 becomes recently used, so bb02 is evicted
+    assert cache.restore('aa01', restored_path)
+    cache.store('cc03', make_blob_file(work_dir, 'cc03'))
+
+    assert os.path.exists(cache.get_path('aa01'))
+    assert not os.path.exists(cache.get_path('bb02'))
+    assert os.path.exists(cache.get_path('cc03'))
+
+    shutil.rmtree(cache_dir)
+    shutil.rmtree(work_dir)
+
+
+def test_discard():
+    cache_dir = tempfile.mkdtemp()
+    work_dir = tempfile.mkdtemp()
+    cache = BlobCache(cache_dir)
+    bad_path = make_blob_file(work_dir, 'bad')
+    good_path = make_blob_file(work_dir, 'good')
+
+    cache.store('abcdef', bad_path)
+    cache.discard('abcdef')
+    cache.discard('abcdef')
+    assert not os.path.exists(cache.get_path('abcdef'))
+
+    cache.store('abcdef', good_path)
+    assert read_file(cache.get_path('abcdef')) == read_file(good_path)
+
+    shutil.rmtree(cache_dir)
+    shutil.rmtree(work_dir)
@@ -0,0 +1,35 @@
+"""Test blob_digest.py functions."""
+import hashlib
+
+from gitea.blob_digest import BlobDigest
+
+TEST_DATA = b'hello world\n'
+# git hash-object for TEST_DATA
+TEST_GIT_SHA = '3b18e512dba79e4c8300dd08aeb37f8e728b8dad'
+
+
+def test_blob_digest():
+    digest = BlobDigest(git_size=len(TEST_DATA))
+    digest.update(TEST_DATA[:5])
+    digest.update(TEST_DATA[5:])
+
+    assert digest.hexdigest() == hashlib.sha256(TEST_DATA).hexdigest()
+    assert digest.verify(TEST_GIT_SHA)
+    assert not digest.verify('0' * 40)
+
+
+def test_blob_digest_without_git_sha():
+    digest = BlobDigest()
+    digest.update(TEST_DATA)
+
+    assert digest.verify('0' * 40)
+
+
+def test_blob_digest_reset():
+    digest = BlobDigest(git_size=len(TEST_DATA))
+    digest.update(b'partial')
+    digest.reset()
+    digest.update(TEST_DATA)
+
+    assert digest.hexdigest() == hashlib.sha256(TEST_DATA).hexdigest()
+    assert digest.verify(TEST_GIT_SHA)
@@ -0,0 +1,80 @@
+"""Test concurrency.py functions."""
+import asyncio
+
+import pytest
+
+from gitea.concurrency import FairSemaphore
+
+
+@pytest.mark.asyncio()
+async def test_fair_semaphore_round_robin():
+    semaphore = FairSemaphore(1)
+    order = []
+
+    async def worker(key: str):
+        await semaphore.acquire(key)
+        order.append(key)
+        await asyncio.sleep(0)
+        semaphore.release()
+
+    await semaphore.acquire('hold')
+    tasks = [
+        asyncio.create_task(worker(key))
+        for key in ('big', 'big', 'big', 'small', 'other')
+    ]
+    await asyncio.sleep(0)
+    semaphore.release()
+    await asyncio.gather(*tasks)
+
+    assert order == ['big', 'small', 'other', 'big', 'big']
+    assert semaphore.available == 1
+
+
+@pytest.mark.asyncio()
+async def test_fair_semaphore_amount():
+    semaphore = FairSemaphore(10)
+
+    assert await semaphore.acquire('a', 100) == 10
+    waiter = asyncio.create_task(semaphore.acquire('b', 4))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    semaphore.release(10)
+    assert await waiter == 4
+    assert semaphore.available == 6
+
+
+@pytest.mark.asyncio()
+async def test_fair_semaphore_cancel():
+    semaphore = FairSemaphore(1)
+    await semaphore.acquire('a')
+
+    cancelled = asyncio.create_task(semaphore.acquire('a'))
+    waiter = asyncio.create_task(semaphore.acquire('b'))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+
+    semaphore.release()
+    assert await waiter == 1
+    assert semaphore.available == 0
+
+
+@pytest.mark.asyncio()
+async def test_fair_semaphore_release_before_cancelled_runs():
+    semaphore = FairSemaphore(2)
+    await semaphore.acquire('a', 2)
+
+    cancelled = asyncio.create_task(semaphore.acquire('a', 2))
+    waiter = asyncio.create_task(semaphore.acquire('b'))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    semaphore.release(2)
+
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert await waiter == 1
+    assert semaphore.available == 1
+    semaphore.release()
+    assert semaphore.available == 2
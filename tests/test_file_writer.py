@@ -0,0 +1,77 @@
+"""Test file_writer.py functions."""
+import asyncio
+import os
+import shutil
+import tempfile
+
+import pytest
+from pytest_mock import MockerFixture
+
+from gitea import file_writer
+from gitea.file_writer import FileWriter
+
+
+@pytest.mark.asyncio()
+async def test_file_writer():
+    temp_dir = tempfile.mkdtemp()
+    paths = [os.path.join(temp_dir, str(index)) for index in range(10)]
+
+    async with FileWriter(threads=2, queue_size=2) as writer:
+        await asyncio.gather(*[
+            writer.write(path, path.encode(), index % 2 == 0)
+            for index, path in enumerate(paths)
+        ])
+
+    for index, path in enumerate(paths):
+        with open(path, 'rb') as fp:
+            assert fp.read() == path.encode()
+        assert os.access(path, os.X_OK) == (index % 2 == 0)
+
+    shutil.rmtree(temp_dir)
+
+
+@pytest.mark.asyncio()
+async def test_file_writer_error():
+    temp_dir = tempfile.mkdtemp()
+
+    async with FileWriter(threads=1) as writer:
+        with pytest.raises(FileNotFoundError):
+            await writer.write(
+                os.path.join(temp_dir, 'missing', 'file'),
+                b'data',
+                False,
+            )
+
+    shutil.rmtree(temp_dir)
+
+
+@pytest.mark.asyncio()
+async def test_file_writer_backpressure(mocker: MockerFixture):
+    temp_dir = tempfile.mkdtemp()
+    released = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    write_file = file_writer.write_file
+
+    def slow_write(path, data, is_executable):
+        asyncio.run_coroutine_threadsafe(released.wait(), loop).result()
+        write_file(path, data, is_executable)
+
+    mocker.patch('gitea.file_writer.write_file', slow_write)
+
+    async with FileWriter(threads=1, queue_size=1) as writer:
+        writes = [
+            asyncio.create_task(
+                writer.write(os.path.join(temp_dir, str(index)), b'', False),
+            )
+            for index in range(3)
+        ]
+        await asyncio.sleep(0.01)
+        # one file is written, one is queued, one waits for the queue
+        assert writer._queue.full()
+        assert not any(write.done() for write in writes)
+
+        released.set()
+        await asyncio.gather(*writes)
+
+    assert len(os.listdir(temp_dir)) == 3
+    shutil.rmtree(temp_dir)
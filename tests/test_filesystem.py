@@ -1,11 +1,17 @@
 """Test filesystem functions."""
 import os
 import shutil
+import sys
 import tempfile
 
 from pytest_mock import MockerFixture
 
-from filesystem import get_directories, get_files, get_files_recursive
+from filesystem import (
+    get_directories,
+    get_files,
+    get_files_recursive,
+    walk_files,
+)
 
 os_listdir = 'os.listdir'
 some_dir = 'some_dir'
@@ -103,3 +109,65 @@ def test_get_files_recursively():
     shutil.rmtree(root_dir)
 
     assert len(ls) == count
+
+
+def make_test_tree() -> str:
+    root_dir = tempfile.mkdtemp()
+    make_files_in_dir(root_dir, 2)
+    for subdir in ('1', '2', '2{0}2.1'.format(os.sep), 'skip'):
+        os.makedirs(os.path.join(root_dir, subdir))
+        make_files_in_dir(os.path.join(root_dir, subdir), 2)
+    with open(os.path.join(root_dir, '2', 'data.txt'), 'w') as fp:
+        fp.write('data')
+    return root_dir
+
+
+def test_walk_files():
+    root_dir = make_test_tree()
+
+    assert list(walk_files(root_dir)) == list(get_files_recursive(root_dir))
+
+    shutil.rmtree(root_dir)
+
+
+def test_walk_files_filters():
+    root_dir = make_test_tree()
+
+    txt_files = list(walk_files(root_dir, include=['*.txt']))
+    assert txt_files == [os.path.join(root_dir, '2', 'data.txt')]
+
+    files = list(walk_files(root_dir, exclude=['skip', '2/*.txt']))
+    assert len(files) == 8
+    assert all(os.sep + 'skip' + os.sep not in path for path in files)
+
+    shutil.rmtree(root_dir)
+
+
+def test_walk_files_with_stat():
+    root_dir = make_test_tree()
+
+    infos = list(walk_files(root_dir, include=['2/data.txt'], with_stat=True))
+    assert len(infos) == 1
+    assert infos[0].path == os.path.join(root_dir, '2', 'data.txt')
+    assert infos[0].size == 4
+    assert infos[0].mtime == os.stat(infos[0].path).st_mtime
+
+    shutil.rmtree(root_dir)
+
+
+def test_walk_files_deep_tree():
+    root_dir = tempfile.mkdtemp()
+    deep_dir = root_dir
+    for _ in range(sys.getrecursionlimit() + 10):
+        deep_dir = os.path.join(deep_dir, 'd')
+        os.mkdir(deep_dir)
+    make_files_in_dir(deep_dir, 1)
+
+    files = list(walk_files(root_dir))
+    assert len(files) == 1
+
+    os.remove(files[0])
+    while deep_dir != root_dir:
+        os.rmdir(deep_dir)
+        deep_dir = os.path.dirname(deep_dir)
+    os.rmdir(root_dir)
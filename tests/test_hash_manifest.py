@@ -0,0 +1,89 @@
+"""Test hash_manifest.py functions."""
+import os
+import time
+
+from pytest_mock import MockerFixture
+
+import sha256
+from filesystem import FileInfo
+from hash_manifest import HashManifest
+
+TEST_PATH = 'dir/file'
+TEST_SHA = 'sha'
+
+
+def get_file_info(mtime_ns: int = 10, size: int = 4) -> FileInfo:
+    return FileInfo(TEST_PATH, size, mtime_ns / 1e9, mtime_ns, 1)
+
+
+def test_manifest_get():
+    manifest = HashManifest(time_ns=100)
+    manifest.set(TEST_PATH, get_file_info(), TEST_SHA)
+
+    assert manifest.get(TEST_PATH, get_file_info()) == TEST_SHA
+    assert manifest.get('other', get_file_info()) is None
+    assert manifest.get(TEST_PATH, get_file_info(size=5)) is None
+    assert manifest.get(TEST_PATH, get_file_info(mtime_ns=20)) is None
+    # modified after the scan has started
+    assert manifest.get(TEST_PATH, get_file_info(mtime_ns=100)) is None
+
+
+def test_manifest_save_load(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    manifest = HashManifest(time_ns=100)
+    manifest.set(TEST_PATH, get_file_info(), TEST_SHA)
+    manifest.save(manifest_path)
+
+    loaded = HashManifest.load(manifest_path)
+
+    assert loaded.time_ns == 100
+    assert loaded.get(TEST_PATH, get_file_info()) == TEST_SHA
+    assert not HashManifest.load(str(tmp_path / 'missing')).files
+
+
+def make_old_files(directory: str, count: int) -> None:
+    old_time_ns = time.time_ns() - 10 ** 10
+    for index in range(count):
+        path = os.path.join(directory, str(index))
+        with open(path, 'wb') as fp:
+            fp.write(os.urandom(100))
+        os.utime(path, ns=(old_time_ns, old_time_ns))
+
+
+def test_calc_sha_for_files_in_dir_manifest(tmp_path, mocker: MockerFixture):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    make_old_files(str(data_dir), 3)
+    manifest_path = str(tmp_path / 'manifest.json')
+
+    stats = sha256.calc_sha_for_files_in_dir(
+        str(data_dir),
+        save_stats=True,
+        manifest_path=manifest_path,
+    )
+    assert stats == sha256.calc_sha_for_files_in_dir(
+        str(data_dir),
+        save_stats=True,
+    )
+
+    hash_mock = mocker.patch(
+        'sha256.calc_sha256',
+        side_effect=sha256.calc_sha256,
+    )
+    (data_dir / '0').write_bytes(b'changed')
+
+    new_stats = sha256.calc_sha_for_files_in_dir(
+        str(data_dir),
+        save_stats=True,
+        manifest_path=manifest_path,
+    )
+    assert hash_mock.call_count == 1
+    assert new_stats[str(data_dir / '0')] != stats[str(data_dir / '0')]
+    assert new_stats[str(data_dir / '1')] == stats[str(data_dir / '1')]
+
+    sha256.calc_sha_for_files_in_dir(
+        str(data_dir),
+        manifest_path=manifest_path,
+        strict=True,
+    )
+    assert hash_mock.call_count == 4
@@ -0,0 +1,85 @@
+"""Test http_cache.py functions."""
+import os
+import shutil
+import tempfile
+from http import HTTPStatus
+
+import aiohttp
+import aioresponses
+import pytest
+from yarl import URL
+
+from gitea.http_cache import HttpCache, get_json
+
+TEST_URL = 'https://gitea.radium.group/api/v1/repos/radium/refs'
+TEST_ETAG = '"etag"'
+TEST_PAYLOAD = {'debug': 1}
+
+
+def test_http_cache_store():
+    cache_dir = tempfile.mkdtemp()
+    cache = HttpCache(cache_dir)
+
+    assert cache.load(TEST_URL) is None
+
+    cache.store(TEST_URL, {}, b'{}')
+    assert cache.load(TEST_URL) is None
+
+    cache.store(TEST_URL, {'ETag': TEST_ETAG}, b'{"a":\n1}')
+    assert cache.load(TEST_URL) == (
+        {'If-None-Match': TEST_ETAG},
+        b'{"a":\n1}',
+    )
+    assert len(os.listdir(cache_dir)) == 1
+
+    shutil.rmtree(cache_dir)
+
+
+def test_http_cache_load_corrupted():
+    cache_dir = tempfile.mkdtemp()
+    cache = HttpCache(cache_dir)
+    cache.store(TEST_URL, {'ETag': TEST_ETAG}, b'{}')
+    path = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+    with open(path, 'wb') as fp:
+        fp.write(b'{"ETag":')
+
+    assert cache.load(TEST_URL) is None
+
+    shutil.rmtree(cache_dir)
+
+
+@pytest.mark.asyncio()
+async def test_get_json_not_modified():
+    cache_dir = tempfile.mkdtemp()
+    cache = HttpCache(cache_dir)
+
+    with aioresponses.aioresponses() as aresp:
+        async with aiohttp.ClientSession() as sess:
+            aresp.get(
+                TEST_URL,
+                status=HTTPStatus.OK,
+                payload=TEST_PAYLOAD,
+                headers={'ETag': TEST_ETAG},
+            )
+            aresp.get(TEST_URL, status=HTTPStatus.NOT_MODIFIED)
+
+            assert await get_json(TEST_URL, sess, cache) == (
+                HTTPStatus.OK,
+                TEST_PAYLOAD,
+            )
+            assert await get_json(TEST_URL, sess, cache) == (
+                HTTPStatus.OK,
+                TEST_PAYLOAD,
+            )
+
+            requests = aresp.requests[('GET', URL(TEST_URL))]
+            assert requests[1].kwargs['headers'] == {
+                'If-None-Match': TEST_ETAG,
+            }
+
+            aresp.get(TEST_URL, status=HTTPStatus.NOT_FOUND)
+            status, json = await get_json(TEST_URL, sess, cache)
+            assert status == HTTPStatus.NOT_FOUND
+            assert json is None
+
+    shutil.rmtree(cache_dir)
@@ -59,7 +59,7 @@ async def test_process_tree_refs_pages():
 
 @pytest.mark.asyncio()
 async def test_main():
-    temp_dir = await main.main()
+    temp_dir, _ = await main.main()
     count = len(list(filesystem.get_files_recursive(temp_dir)))
     shutil.rmtree(temp_dir)
     assert count == 10
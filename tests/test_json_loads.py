@@ -0,0 +1,12 @@
+"""Test json_loads.py functions."""
+import json
+
+from gitea import json_loads
+
+
+def test_get_default_loads(mocker):
+    loads = json_loads.get_default_loads()
+    assert loads(b'{"tree": [1]}') == {'tree': [1]}
+
+    mocker.patch.object(json_loads, 'orjson', None)
+    assert json_loads.get_default_loads() is json.loads
@@ -3,6 +3,7 @@ import logging
 from pathlib import Path
 
 import log
+from gitea.log_message import BraceMessage
 
 
 def test_get_project_root_dir():
@@ -13,3 +14,41 @@ def test_get_project_root_dir():
 def test_logging():
     log.init_logger()
     assert logging.getLogger()
+
+
+def test_brace_message():
+    message = BraceMessage('Page {0}. path: {1}', 1, 'dir/file')
+    assert str(message) == 'Page 1. path: dir/file'
+
+
+def test_queue_pipeline(mocker):
+    log.init_logger()
+    root = logging.getLogger()
+    assert len(root.handlers) == 1
+    queue_handler = root.handlers[0]
+    assert isinstance(queue_handler, log.LazyQueueHandler)
+
+    listener = queue_handler.listener
+    emit = mocker.patch.object(listener.handlers[0], 'emit')
+    logging.getLogger('gitea.blob').info(BraceMessage('Lazy {0}', 1))
+
+    log.init_logger()
+    assert queue_handler.listener is None
+    assert any(
+        call.args[0].getMessage() == 'Lazy 1' for call in emit.call_args_list
+    )
+
+
+def test_sample_filter():
+    log.init_logger({'gitea.blob': 3})
+    sample_filter = logging.getLogger('gitea.blob').filters[0]
+    records = [
+        logging.makeLogRecord({'levelno': level})
+        for level in [logging.INFO] * 6 + [logging.WARNING]
+    ]
+    assert [sample_filter.filter(record) for record in records] == [
+        True, False, False, True, False, False, True,
+    ]
+
+    log.init_logger()
+    assert not logging.getLogger('gitea.blob').filters
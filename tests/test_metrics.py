@@ -0,0 +1,90 @@
+"""Test metrics.py functions."""
+import json
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+from gitea.metrics import Histogram, Metrics, Stopwatch, write_report
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(1, 10))
+    for value in (0.5, 1, 5, 20):
+        histogram.observe(value)
+
+    assert list(histogram.cumulative()) == [
+        (1, 2), (10, 3), (float('inf'), 4),
+    ]
+    summary = histogram.to_dict()
+    assert summary['count'] == 4
+    assert summary['sum'] == 26.5
+    assert summary['max'] == 20
+    assert summary['buckets'] == {'1': 2, '10': 3, '+Inf': 4}
+
+
+def test_metrics():
+    metrics = Metrics()
+    metrics.inc('requests_total')
+    metrics.inc('downloaded_bytes_total', 100)
+    metrics.inc('downloaded_bytes_total', 50)
+    with metrics.timer('hash_seconds'):
+        with metrics.in_flight('requests_in_flight'):
+            with metrics.in_flight('requests_in_flight'):
+                assert metrics.gauges['requests_in_flight'] == 2
+
+    metrics.set('tree_page_size', 100)
+    metrics.set('tree_page_size', 50)
+
+    report = metrics.to_dict({'refs_per_page': 5})
+    assert report['parameters'] == {'refs_per_page': 5}
+    assert report['counters'] == {
+        'downloaded_bytes_total': 150,
+        'requests_total': 1,
+    }
+    assert report['gauges'] == {
+        'requests_in_flight': 0,
+        'requests_in_flight_max': 2,
+        'tree_page_size': 50,
+    }
+    assert report['histograms']['hash_seconds']['count'] == 1
+
+    metrics.reset()
+    assert metrics.to_dict()['counters'] == {}
+
+
+def test_stopwatch():
+    stopwatch = Stopwatch()
+    for _ in range(2):
+        with stopwatch.measure():
+            time.sleep(0.01)
+
+    assert stopwatch.elapsed >= 0.02
+
+
+def test_write_report():
+    temp_dir = tempfile.mkdtemp()
+    report_path = os.path.join(temp_dir, 'report.json')
+    prometheus_path = os.path.join(temp_dir, 'metrics.prom')
+    metrics = Metrics()
+    metrics.inc('requests_total', 3)
+    metrics.observe('request_seconds', 0.02)
+
+    report = write_report(metrics, report_path, prometheus_path)
+
+    with open(report_path) as fp:
+        assert json.load(fp) == report
+    with open(prometheus_path) as fp:
+        text = fp.read()
+    assert '# TYPE gitea_sync_requests_total counter' in text
+    assert 'gitea_sync_requests_total 3' in text
+    assert 'gitea_sync_request_seconds_bucket{le="0.025"} 1' in text
+    assert 'gitea_sync_request_seconds_bucket{le="+Inf"} 1' in text
+    assert 'gitea_sync_request_seconds_count 1' in text
+    assert sorted(os.listdir(temp_dir)) == ['metrics.prom', 'report.json']
+    if os.name == 'posix':
+        for path in (report_path, prometheus_path):
+            assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+
+    shutil.rmtree(temp_dir)
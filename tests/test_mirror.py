@@ -0,0 +1,65 @@
+"""Test mirror.py functions."""
+import os
+import shutil
+import tempfile
+
+import pytest
+from pytest_mock import MockerFixture
+
+import mirror
+
+TARGETS = (
+    ('radium', 'first', 'refs/heads/master'),
+    ('radium', 'second', 'refs/tags/v1'),
+    ('radium', 'missing', 'refs/heads/master'),
+)
+
+
+def test_parse_targets():
+    lines = [
+        '# owner project ref',
+        'radium first',
+        '',
+        'radium second refs/tags/v1',
+    ]
+    assert mirror.parse_targets(lines) == [
+        ('radium', 'first', 'refs/heads/master'),
+        ('radium', 'second', 'refs/tags/v1'),
+    ]
+
+    with pytest.raises(ValueError, match='Wrong target'):
+        mirror.parse_targets(['radium'])
+
+
+@pytest.mark.asyncio()
+async def test_mirror(mocker: MockerFixture):
+    out_root = tempfile.mkdtemp()
+    keys = []
+
+    async def fake_ref_sha(sess, urlp, ref, fetchp):
+        if urlp.project == 'missing':
+            return ''
+        return '{0}-sha'.format(urlp.project)
+
+    async def fake_download(sha, sess, urlp, out_dir, fetchp):
+        keys.append((fetchp.retry.key, fetchp.retry.concurrency))
+        return {os.path.join(out_dir, 'file'): sha}
+
+    mocker.patch('mirror.log.init_logger')
+    mocker.patch('mirror.get_ref_sha', fake_ref_sha)
+    mocker.patch('mirror.download_tree', fake_download)
+
+    results = await mirror.mirror(list(TARGETS), out_root)
+
+    assert results[TARGETS[0]] == os.path.join(
+        out_root, 'radium', 'first', 'refs', 'heads', 'master',
+    )
+    assert results[TARGETS[1]] == os.path.join(
+        out_root, 'radium', 'second', 'refs', 'tags', 'v1',
+    )
+    assert isinstance(results[TARGETS[2]], ValueError)
+    assert os.path.isdir(results[TARGETS[1]])
+    assert sorted(key for key, _ in keys) == ['radium/first', 'radium/second']
+    assert keys[0][1] is keys[1][1]
+
+    shutil.rmtree(out_root)
@@ -1,16 +1,32 @@
 """Test refs_tree.py functions."""
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
 from http import HTTPStatus
 
 import aiohttp
 import aioresponses
 import pytest
 from aiohttp.http_exceptions import HttpProcessingError
+from pytest_mock import MockerFixture
+from yarl import URL
 
+from gitea.blob import BlobDownloadError, BlobIntegrityError
+from gitea.blob_cache import BlobCache
+from gitea.fetch_params import GiteaFetchParams
+from gitea.metrics import METRICS
 from gitea.refs_tree import (
     get_tree_data,
     get_tree_refs_page,
     get_tree_refs_pages_count,
+    iter_tree_entries,
+    negotiate_refs_per_page,
+    process_tree_refs_page,
+    process_tree_refs_pages,
 )
+from gitea.retry import RetryPolicy
 from gitea.url_params import GiteaUrlParams
 
 TEST_REF_URL = (
@@ -55,13 +71,23 @@ async def test_get_tree_refs_page():
                 ),
             )
 
+            with pytest.raises(HttpProcessingError):
+                await get_tree_refs_page(
+                    REFS_SHA,
+                    REFS_PAGE,
+                    sess,
+                    GiteaUrlParams(),
+                )
+
+            aresp.get(TEST_REF_URL, status=HTTPStatus.NOT_FOUND)
+
             json = await get_tree_refs_page(
                 REFS_SHA,
                 REFS_PAGE,
                 sess,
                 GiteaUrlParams(),
             )
-            assert not json
+            assert json is None
 
 
 @pytest.mark.asyncio()
@@ -104,12 +130,12 @@ async def test_get_tree_refs_pages_count_empty():
                 ),
             )
 
-            pages_count = await get_tree_refs_pages_count(
-                REFS_SHA,
-                sess,
-                GiteaUrlParams(),
-            )
-            assert pages_count == 0
+            with pytest.raises(HttpProcessingError):
+                await get_tree_refs_pages_count(
+                    REFS_SHA,
+                    sess,
+                    GiteaUrlParams(),
+                )
 
 
 @pytest.mark.asyncio()
@@ -139,10 +165,599 @@ async def test_get_tree_data():
                 ),
             )
 
-            json = await get_tree_data(
+            with pytest.raises(HttpProcessingError):
+                await get_tree_data(
+                    REFS_SHA,
+                    sess,
+                    GiteaUrlParams(),
+                    REFS_PAGE,
+                )
+
+            aresp.get(TEST_REF_URL, status=HTTPStatus.BAD_GATEWAY)
+
+            with pytest.raises(ValueError, match='not available'):
+                await get_tree_data(
+                    REFS_SHA,
+                    sess,
+                    GiteaUrlParams(),
+                    REFS_PAGE,
+                )
+
+
+@pytest.mark.asyncio()
+async def test_process_tree_refs_pages_sliding_window(mocker: MockerFixture):
+    num_parallel = 3
+    pages_count = 10
+    in_flight = []
+    max_in_flight = []
+    processed = []
+
+    async def fake_page(*args, **kwargs):
+        page = args[4]
+        in_flight.append(page)
+        max_in_flight.append(len(in_flight))
+        # page 1 is a straggler, others finish fast
+        await asyncio.sleep(0.05 if page == 1 else 0.001)
+        in_flight.remove(page)
+        processed.append(page)
+        return {}
+
+    mocker.patch(
+        'gitea.refs_tree.get_tree_first_page',
+        return_value=(GiteaUrlParams(), pages_count, [], 0),
+    )
+    mocker.patch('gitea.refs_tree.process_tree_refs_page', fake_page)
+
+    await process_tree_refs_pages(
+        REFS_SHA,
+        None,
+        GiteaUrlParams(),
+        'temp_dir',
+        num_parallel=num_parallel,
+    )
+
+    assert sorted(processed) == list(range(1, pages_count + 1))
+    assert max(max_in_flight) == num_parallel
+    # the straggler does not block the rest of the pages
+    assert processed[-1] == 1
+
+
+@pytest.mark.asyncio()
+async def test_process_tree_refs_pages_failed_page(mocker: MockerFixture):
+    unwound = []
+
+    async def fake_page(*args, **kwargs):
+        page = args[4]
+        if page == 1:
+            raise ValueError('page 1 failed')
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.001)
+            unwound.append(page)
+            raise
+
+    mocker.patch(
+        'gitea.refs_tree.get_tree_first_page',
+        return_value=(GiteaUrlParams(), 3, [], 0),
+    )
+    mocker.patch('gitea.refs_tree.process_tree_refs_page', fake_page)
+
+    with pytest.raises(ValueError, match='page 1 failed'):
+        await process_tree_refs_pages(
+            REFS_SHA,
+            None,
+            GiteaUrlParams(),
+            'temp_dir',
+            num_parallel=3,
+        )
+
+    assert sorted(unwound) == [2, 3]
+
+
+@pytest.mark.asyncio()
+async def test_process_tree_refs_page_failed_blob(mocker: MockerFixture):
+    unwound = []
+
+    async def fake_process_blob(sha, ref, *args):
+        if ref['path'] == 'dir/file0':
+            raise BlobDownloadError(ref['path'], ref['sha'])
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.001)
+            unwound.append(ref['path'])
+            raise
+
+    mocker.patch('gitea.refs_tree.process_blob', fake_process_blob)
+    temp_dir = tempfile.mkdtemp()
+
+    with pytest.raises(BlobDownloadError):
+        await process_tree_refs_page(
+            REFS_SHA,
+            None,
+            temp_dir,
+            GiteaUrlParams(),
+            REFS_PAGE,
+            tree=get_tree_stub_data(3),
+        )
+
+    assert sorted(unwound) == ['dir/file1', 'dir/file2']
+    shutil.rmtree(temp_dir)
+
+
+def get_tree_stub_data(count: int) -> list:
+    return [
+        {
+            'path': 'dir/file{0}'.format(index),
+            'mode': '100644',
+            'type': 'blob',
+            'sha': 'sha{0}'.format(index),
+            'url': 'url{0}'.format(index),
+        }
+        for index in range(count)
+    ] + [{'path': 'dir', 'mode': '040000', 'type': 'tree'}]
+
+
+@pytest.mark.asyncio()
+async def test_process_tree_refs_page_blob_pool(mocker: MockerFixture):
+    blobs_count = 7
+    blob_limit = 3
+    in_flight = []
+    max_in_flight = []
+    written = []
+
+    async def fake_blob_data(url, sess, retry=None, loads=None, size=None):
+        in_flight.append(url)
+        max_in_flight.append(len(in_flight))
+        await asyncio.sleep(0.001)
+        in_flight.remove(url)
+        return url.encode('ascii')
+
+    async def fake_write(blob_data, relative_path, temp_dir, **kwargs):
+        written.append(relative_path)
+        return True
+
+    mocker.patch(
+        'gitea.refs_tree.get_tree_data',
+        return_value=get_tree_stub_data(blobs_count),
+    )
+    mocker.patch('gitea.refs_tree.get_blob_data', fake_blob_data)
+    mocker.patch('gitea.refs_tree.write_blob_to_file', fake_write)
+
+    temp_dir = tempfile.mkdtemp()
+    semaphore = asyncio.Semaphore(blob_limit)
+    await asyncio.gather(*[
+        process_tree_refs_page(
+            REFS_SHA,
+            None,
+            temp_dir,
+            GiteaUrlParams(),
+            page,
+            blob_semaphore=semaphore,
+        )
+        for page in (1, 2)
+    ])
+
+    assert len(written) == blobs_count * 2
+    assert max(max_in_flight) == blob_limit
+    assert os.path.isdir(os.path.join(temp_dir, 'dir'))
+
+    shutil.rmtree(temp_dir)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize(('raw_ok', 'blob_calls'), [
+    (True, 0),
+    (False, 1),
+],
+)
+async def test_process_tree_refs_page_raw_fallback(
+    mocker: MockerFixture,
+    raw_ok: bool,
+    blob_calls: int,
+):
+    mocker.patch(
+        'gitea.refs_tree.get_tree_data',
+        return_value=get_tree_stub_data(1),
+    )
+    raw_mock = mocker.patch(
+        'gitea.refs_tree.stream_raw_blob_to_file',
+        return_value=raw_ok,
+    )
+    blob_mock = mocker.patch('gitea.refs_tree.get_blob_data')
+    mocker.patch('gitea.refs_tree.write_blob_to_file')
+
+    temp_dir = tempfile.mkdtemp()
+    await process_tree_refs_page(
+        REFS_SHA,
+        None,
+        temp_dir,
+        GiteaUrlParams(),
+        REFS_PAGE,
+        fetchp=GiteaFetchParams(raw_blobs=True),
+    )
+
+    assert raw_mock.call_count == 1
+    assert blob_mock.call_count == blob_calls
+
+    shutil.rmtree(temp_dir)
+
+
+def get_verified_tree_stub_data(count: int) -> list:
+    tree = get_tree_stub_data(count)
+    for ref in tree[:count]:
+        data = ref['url'].encode('ascii')
+        header = 'blob {0}\0'.format(len(data)).encode('ascii')
+        ref.update({
+            'sha': hashlib.sha1(header + data).hexdigest(),
+            'size': len(data),
+        })
+    return tree
+
+
+@pytest.mark.asyncio()
+async def test_process_tree_refs_page_blob_cache(mocker: MockerFixture):
+    temp_dir = tempfile.mkdtemp()
+    cache = BlobCache(tempfile.mkdtemp())
+
+    async def fake_blob_data(url, sess, retry=None, loads=None, size=None):
+        return url.encode('ascii')
+
+    mocker.patch(
+        'gitea.refs_tree.get_tree_data',
+        return_value=get_verified_tree_stub_data(2),
+    )
+    blob_mock = mocker.patch(
+        'gitea.refs_tree.get_blob_data',
+        side_effect=fake_blob_data,
+    )
+
+    for _ in range(2):
+        manifest = await process_tree_refs_page(
+            REFS_SHA,
+            None,
+            temp_dir,
+            GiteaUrlParams(),
+            REFS_PAGE,
+            fetchp=GiteaFetchParams(blob_cache=cache),
+        )
+        assert manifest == {
+            os.path.join(temp_dir, 'dir', 'file0'): hashlib.sha256(
+                b'url0',
+            ).hexdigest(),
+            os.path.join(temp_dir, 'dir', 'file1'): hashlib.sha256(
+                b'url1',
+            ).hexdigest(),
+        }
+
+    assert blob_mock.call_count == 2
+    with open(os.path.join(temp_dir, 'dir', 'file1'), 'rb') as fp:
+        assert fp.read() == b'url1'
+
+    shutil.rmtree(temp_dir)
+    shutil.rmtree(cache.directory)
+
+
+TEST_PROBE_URL = (
+    'https://gitea.radium.group/api/v1/repos/radium/' +
+    'project-configuration/git/trees/' +
+    'eb4dc314435649737ad343ef82240b96256d5eb8' +
+    '?recursive=true&page=1&per_page=100'
+)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize(('truncated', 'total_count', 'refs_per_page_exp'), [
+    (True, 50, 3),
+    (False, 50, 3),
+    (None, 50, 3),
+    (False, 3, 100),
+],
+)
+async def test_negotiate_refs_per_page(
+    truncated: bool | None,
+    total_count: int,
+    refs_per_page_exp: int,
+):
+    payload = {TREE_KEY: get_tree_stub_data(2), 'total_count': total_count}
+    if truncated is not None:
+        payload['truncated'] = truncated
+
+    with aioresponses.aioresponses() as aresp:
+        async with aiohttp.ClientSession() as sess:
+            aresp.get(TEST_PROBE_URL, status=HTTPStatus.OK, payload=payload)
+
+            urlp = await negotiate_refs_per_page(
                 REFS_SHA,
                 sess,
-                GiteaUrlParams(),
-                REFS_PAGE,
+                GiteaUrlParams(max_refs_per_page=100),
             )
-            assert not json
+            assert urlp.refs_per_page == refs_per_page_exp
+            assert urlp.max_refs_per_page == 100
+            assert METRICS.gauges['tree_page_size'] == refs_per_page_exp
+
+            aresp.get(TEST_PROBE_URL, status=HTTPStatus.NOT_FOUND)
+
+            urlp = await negotiate_refs_per_page(
+                REFS_SHA,
+                sess,
+                GiteaUrlParams(max_refs_per_page=100),
+            )
+            assert urlp.refs_per_page == REFS_PER_PAGE
+
+
+def get_tree_page_url(page: int, per_page: int) -> str:
+    return (
+        'https://gitea.radium.group/api/v1/repos/radium/' +
+        'project-configuration/git/trees/' +
+        'eb4dc314435649737ad343ef82240b96256d5eb8' +
+        '?recursive=true&page={0}&per_page={1}'.format(page, per_page)
+    )
+
+
+@pytest.mark.asyncio()
+async def test_iter_tree_entries():
+    pages = [get_tree_stub_data(2), get_tree_stub_data(2), [{'path': 'x'}]]
+
+    with aioresponses.aioresponses() as aresp:
+        async with aiohttp.ClientSession() as sess:
+            aresp.get(
+                get_tree_page_url(1, 100),
+                status=HTTPStatus.OK,
+                payload={
+                    TREE_KEY: pages[0],
+                    'truncated': True,
+                    'total_count': 7,
+                },
+            )
+            for page in (2, 3):
+                aresp.get(
+                    get_tree_page_url(page, 3),
+                    status=HTTPStatus.OK,
+                    payload={TREE_KEY: pages[page - 1], 'total_count': 7},
+                )
+
+            entries = [
+                ref async for ref in iter_tree_entries(
+                    REFS_SHA,
+                    sess,
+                    GiteaUrlParams(max_refs_per_page=100),
+                )
+            ]
+
+            assert entries == pages[0] + pages[1] + pages[2]
+            assert len(aresp.requests) == 3
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize(('responses', 'blob_calls'), [
+    ([b'good'], 1),
+    ([b'bad', b'good'], 2),
+],
+)
+async def test_process_tree_refs_page_verify(
+    mocker: MockerFixture,
+    responses: list,
+    blob_calls: int,
+):
+    temp_dir = tempfile.mkdtemp()
+    git_sha = hashlib.sha1(b'blob 4\0good').hexdigest()
+    ref = get_tree_stub_data(1)[0]
+    ref.update({'sha': git_sha, 'size': 4})
+
+    mocker.patch('gitea.refs_tree.get_tree_data', return_value=[ref])
+    blob_mock = mocker.patch(
+        'gitea.refs_tree.get_blob_data',
+        side_effect=responses,
+    )
+
+    manifest = await process_tree_refs_page(
+        REFS_SHA,
+        None,
+        temp_dir,
+        GiteaUrlParams(),
+        REFS_PAGE,
+        fetchp=GiteaFetchParams(verify_blobs=True, verify_retries=2),
+    )
+
+    assert blob_mock.call_count == blob_calls
+    assert list(manifest.values()) == [hashlib.sha256(b'good').hexdigest()]
+    assert os.path.exists(os.path.join(temp_dir, 'dir', 'file0'))
+
+    shutil.rmtree(temp_dir)
+
+
+@pytest.mark.asyncio()
+async def test_process_tree_refs_page_verify_mismatch(mocker: MockerFixture):
+    temp_dir = tempfile.mkdtemp()
+    git_sha = hashlib.sha1(b'blob 4\0good').hexdigest()
+    ref = get_tree_stub_data(1)[0]
+    ref.update({'sha': git_sha, 'size': 4})
+
+    mocker.patch('gitea.refs_tree.get_tree_data', return_value=[ref])
+    blob_mock = mocker.patch(
+        'gitea.refs_tree.get_blob_data',
+        return_value=b'bad!',
+    )
+
+    with pytest.raises(BlobIntegrityError) as exc_info:
+        await process_tree_refs_page(
+            REFS_SHA,
+            None,
+            temp_dir,
+            GiteaUrlParams(),
+            REFS_PAGE,
+            fetchp=GiteaFetchParams(verify_blobs=True, verify_retries=2),
+        )
+
+    assert blob_mock.call_count == 3
+    assert exc_info.value.sha == git_sha
+    assert not os.path.exists(os.path.join(temp_dir, 'dir', 'file0'))
+
+    shutil.rmtree(temp_dir)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize(('page2_status', 'total_count', 'error'), [
+    (HTTPStatus.BAD_GATEWAY, 7, 'page 2 is not available'),
+    (HTTPStatus.OK, 8, 'incomplete: 7 of 8'),
+],
+)
+async def test_iter_tree_entries_incomplete(
+    page2_status: int,
+    total_count: int,
+    error: str,
+):
+    pages = [get_tree_stub_data(2), get_tree_stub_data(2), [{'path': 'x'}]]
+
+    with aioresponses.aioresponses() as aresp:
+        async with aiohttp.ClientSession() as sess:
+            aresp.get(
+                get_tree_page_url(1, 100),
+                status=HTTPStatus.OK,
+                payload={
+                    TREE_KEY: pages[0],
+                    'truncated': True,
+                    'total_count': total_count,
+                },
+            )
+            aresp.get(
+                get_tree_page_url(2, 3),
+                status=page2_status,
+                payload={TREE_KEY: pages[1], 'total_count': total_count},
+            )
+            aresp.get(
+                get_tree_page_url(3, 3),
+                status=HTTPStatus.OK,
+                payload={TREE_KEY: pages[2], 'total_count': total_count},
+            )
+
+            with pytest.raises(ValueError, match=error):
+                async for _ in iter_tree_entries(
+                    REFS_SHA,
+                    sess,
+                    GiteaUrlParams(max_refs_per_page=100),
+                ):
+                    continue
+
+
+@pytest.mark.asyncio()
+async def test_process_tree_refs_page_blob_cache_corrupted(
+    mocker: MockerFixture,
+):
+    temp_dir = tempfile.mkdtemp()
+    cache = BlobCache(tempfile.mkdtemp())
+    ref = get_verified_tree_stub_data(1)[0]
+
+    mocker.patch('gitea.refs_tree.get_tree_data', return_value=[ref])
+    mocker.patch('gitea.refs_tree.get_blob_data', return_value=b'bad!')
+
+    manifest = await process_tree_refs_page(
+        REFS_SHA,
+        None,
+        temp_dir,
+        GiteaUrlParams(),
+        REFS_PAGE,
+        fetchp=GiteaFetchParams(blob_cache=cache),
+    )
+
+    assert manifest == {
+        os.path.join(temp_dir, 'dir', 'file0'): hashlib.sha256(
+            b'bad!',
+        ).hexdigest(),
+    }
+    assert not os.path.exists(cache.get_path(ref['sha']))
+
+    shutil.rmtree(temp_dir)
+    shutil.rmtree(cache.directory)
+
+
+@pytest.mark.asyncio()
+async def test_process_tree_refs_page_blob_cache_discard(
+    mocker: MockerFixture,
+):
+    temp_dir = tempfile.mkdtemp()
+    cache = BlobCache(tempfile.mkdtemp())
+    ref = get_verified_tree_stub_data(1)[0]
+    bad_path = os.path.join(temp_dir, 'bad')
+    with open(bad_path, 'wb') as fp:
+        fp.write(b'bad!')
+    cache.store(ref['sha'], bad_path)
+
+    mocker.patch('gitea.refs_tree.get_tree_data', return_value=[ref])
+    blob_mock = mocker.patch(
+        'gitea.refs_tree.get_blob_data',
+        return_value=b'url0',
+    )
+
+    for _ in range(2):
+        await process_tree_refs_page(
+            REFS_SHA,
+            None,
+            temp_dir,
+            GiteaUrlParams(),
+            REFS_PAGE,
+            fetchp=GiteaFetchParams(blob_cache=cache),
+        )
+
+    assert blob_mock.call_count == 1
+    with open(cache.get_path(ref['sha']), 'rb') as fp:
+        assert fp.read() == b'url0'
+
+    shutil.rmtree(temp_dir)
+    shutil.rmtree(cache.directory)
+
+
+@pytest.mark.asyncio()
+async def test_process_tree_refs_pages_blob_failed():
+    blob_url = 'https://gitea.radium.group/api/v1/blobs/b'
+    tree = [
+        {
+            'path': path,
+            'mode': '100644',
+            'type': 'blob',
+            'sha': path,
+            'url': '{0}/{1}'.format(blob_url, path),
+        }
+        for path in ('a.txt', 'b.txt')
+    ]
+    temp_dir = tempfile.mkdtemp()
+    with aioresponses.aioresponses() as aresp:
+        async with aiohttp.ClientSession() as sess:
+            aresp.get(
+                TEST_REF_URL,
+                status=HTTPStatus.OK,
+                payload={TREE_KEY: tree, 'total_count': len(tree)},
+            )
+            aresp.get(
+                '{0}/a.txt'.format(blob_url),
+                status=HTTPStatus.OK,
+                payload={'content': 'YQ==', 'encoding': 'base64'},
+            )
+            aresp.get(
+                '{0}/b.txt'.format(blob_url),
+                status=HTTPStatus.BAD_GATEWAY,
+                repeat=True,
+            )
+
+            with pytest.raises(BlobDownloadError) as exc_info:
+                await process_tree_refs_pages(
+                    REFS_SHA,
+                    sess,
+                    GiteaUrlParams(refs_per_page=REFS_PER_PAGE),
+                    temp_dir,
+                    fetchp=GiteaFetchParams(
+                        retry=RetryPolicy(attempts=3, base_delay=0),
+                    ),
+                )
+
+            requests = aresp.requests[(
+                'GET',
+                URL('{0}/b.txt'.format(blob_url)),
+            )]
+            assert len(requests) == 3
+
+    assert exc_info.value.path == 'b.txt'
+    assert exc_info.value.sha == 'b.txt'
+    shutil.rmtree(temp_dir)
@@ -0,0 +1,199 @@
+"""Test retry.py functions."""
+import time
+from email.utils import formatdate
+from http import HTTPStatus
+
+import aiohttp
+import aioresponses
+import pytest
+from aiohttp import web
+from pytest_mock import MockerFixture
+
+from gitea.blob import get_blob_data, get_blob_response_size
+from gitea.concurrency import ConcurrencyBudget
+from gitea.http_cache import get_json
+from gitea.metrics import METRICS
+from gitea.retry import (
+    RetryPolicy,
+    TokenBucket,
+    fetch,
+    get_retry_after,
+    request,
+)
+
+TEST_URL = 'https://gitea.radium.group/api/v1/repos/radium/refs'
+TEST_PAYLOAD = {'debug': 1}
+
+
+def test_next_delay():
+    policy = RetryPolicy(attempts=3, base_delay=1, max_delay=2, budget=10)
+
+    assert 0 <= policy.next_delay(0) <= 1
+    assert 0 <= policy.next_delay(1) <= 2
+    assert policy.next_delay(2) is None
+    assert policy.next_delay(0, retry_after=500) == policy.max_retry_after
+    assert policy.budget == 7
+
+
+def test_next_delay_budget():
+    policy = RetryPolicy(attempts=10, budget=1)
+
+    assert policy.next_delay(0, retry_after=0) == 0
+    assert policy.next_delay(0) is None
+
+
+def test_get_retry_after():
+    assert get_retry_after({}) is None
+    assert get_retry_after({'Retry-After': '3'}) == 3
+    assert get_retry_after({'Retry-After': 'soon'}) is None
+
+    date = formatdate(time.time() + 100, usegmt=True)
+    assert 90 < get_retry_after({'Retry-After': date}) <= 100
+
+
+@pytest.mark.asyncio()
+async def test_token_bucket():
+    bucket = TokenBucket(rate=100, capacity=2)
+
+    start = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    assert time.monotonic() - start >= 0.015
+
+    bucket.pause(0.05)
+    start = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - start >= 0.04
+
+
+@pytest.mark.asyncio()
+async def test_request_retry():
+    METRICS.reset()
+    policy = RetryPolicy(attempts=4, base_delay=0, budget=10)
+    with aioresponses.aioresponses() as mocked:
+        mocked.get(TEST_URL, status=HTTPStatus.BAD_GATEWAY)
+        mocked.get(
+            TEST_URL,
+            status=HTTPStatus.TOO_MANY_REQUESTS,
+            headers={'Retry-After': '0'},
+        )
+        mocked.get(TEST_URL, exception=aiohttp.ServerDisconnectedError())
+        mocked.get(TEST_URL, status=HTTPStatus.OK, payload=TEST_PAYLOAD)
+        async with aiohttp.ClientSession() as sess:
+            status, json = await get_json(TEST_URL, sess, retry=policy)
+
+    assert status == HTTPStatus.OK
+    assert json == TEST_PAYLOAD
+    assert policy.budget == 7
+    assert METRICS.counters['requests_total'] == 1
+    assert METRICS.counters['request_retries_total'] == 3
+    assert METRICS.histograms['request_seconds'].count == 4
+    assert METRICS.gauges['requests_in_flight'] == 0
+
+
+@pytest.mark.asyncio()
+async def test_request_retry_exhausted():
+    policy = RetryPolicy(attempts=2, base_delay=0)
+    with aioresponses.aioresponses() as mocked:
+        mocked.get(TEST_URL, status=HTTPStatus.SERVICE_UNAVAILABLE)
+        mocked.get(TEST_URL, status=HTTPStatus.SERVICE_UNAVAILABLE)
+        mocked.get(TEST_URL, exception=aiohttp.ServerDisconnectedError())
+        mocked.get(TEST_URL, exception=aiohttp.ServerDisconnectedError())
+        async with aiohttp.ClientSession() as sess:
+            status, json = await get_json(TEST_URL, sess, retry=policy)
+            assert status == HTTPStatus.SERVICE_UNAVAILABLE
+            assert json is None
+
+            with pytest.raises(aiohttp.ServerDisconnectedError):
+                await get_json(TEST_URL, sess, retry=policy)
+
+
+@pytest.mark.asyncio()
+async def test_request_not_retried():
+    policy = RetryPolicy(base_delay=0)
+    with aioresponses.aioresponses() as mocked:
+        mocked.get(TEST_URL, status=HTTPStatus.NOT_FOUND)
+        async with aiohttp.ClientSession() as sess:
+            status, _ = await get_json(TEST_URL, sess, retry=policy)
+
+    assert status == HTTPStatus.NOT_FOUND
+    assert policy.budget == RetryPolicy().budget
+
+
+@pytest.mark.asyncio()
+async def test_request_concurrency_released():
+    concurrency = ConcurrencyBudget(max_requests=2, max_bytes=100)
+    policy = RetryPolicy(base_delay=0, concurrency=concurrency, key='repo')
+    with aioresponses.aioresponses() as mocked:
+        mocked.get(TEST_URL, status=HTTPStatus.BAD_GATEWAY)
+        mocked.get(TEST_URL, status=HTTPStatus.OK, payload=TEST_PAYLOAD)
+        async with aiohttp.ClientSession() as sess:
+            _, json = await get_json(TEST_URL, sess, retry=policy)
+
+    assert json == TEST_PAYLOAD
+    assert concurrency.requests.available == 2
+    assert concurrency.bytes.available == 100
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize(('attempts', 'is_read'), [
+    (3, True),
+    (2, False),
+],
+)
+async def test_fetch_retries_body_read(attempts: int, is_read: bool):
+    policy = RetryPolicy(attempts=attempts, base_delay=0, budget=10)
+    reads = []
+
+    async def read(response):
+        reads.append(response.status)
+        if len(reads) < 3:
+            raise aiohttp.ClientPayloadError('Payload is not completed')
+        return await response.read()
+
+    with aioresponses.aioresponses() as mocked:
+        for _ in range(3):
+            mocked.get(TEST_URL, status=HTTPStatus.OK, body=b'body')
+        async with aiohttp.ClientSession() as sess:
+            if is_read:
+                assert await fetch(sess, TEST_URL, read, policy) == b'body'
+            else:
+                with pytest.raises(aiohttp.ClientPayloadError):
+                    await fetch(sess, TEST_URL, read, policy)
+
+    assert len(reads) == attempts
+
+
+@pytest.mark.asyncio()
+async def test_request_reserves_chunked_response(mocker: MockerFixture):
+    body = b'{"content": "Ym9keQ==", "encoding": "base64"}'
+
+    async def handler(request):
+        response = web.StreamResponse()
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        await response.write(body)
+        return response
+
+    app = web.Application()
+    app.router.add_get('/blob', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = 'http://127.0.0.1:{0}/blob'.format(runner.addresses[0][1])
+
+    concurrency = ConcurrencyBudget(max_requests=2, max_bytes=1000)
+    policy = RetryPolicy(base_delay=0, concurrency=concurrency, key='repo')
+    acquire_spy = mocker.spy(policy, 'acquire_bytes')
+    async with aiohttp.ClientSession() as sess:
+        async with request(sess, url, policy, size_hint=300) as response:
+            assert response.content_length is None
+            assert concurrency.bytes.available == 700
+            assert await response.read() == body
+
+        assert await get_blob_data(url, sess, policy, size=4) == b'body'
+    await runner.cleanup()
+
+    assert acquire_spy.call_args.args == (get_blob_response_size(4),)
+    assert concurrency.bytes.available == 1000
@@ -0,0 +1,33 @@
+"""Test session.py functions."""
+import pytest
+
+from gitea.session import create_session
+
+
+@pytest.mark.asyncio()
+async def test_create_session():
+    async with create_session(
+        limit=10,
+        limit_per_host=2,
+        dns_cache_ttl=5,
+        total_timeout=20,
+        connect_timeout=3,
+        read_timeout=4,
+    ) as sess:
+        connector = sess.connector
+        assert connector.limit == 10
+        assert connector.limit_per_host == 2
+        assert connector.use_dns_cache
+        assert sess.timeout.total == 20
+        assert sess.timeout.sock_connect == 3
+        assert sess.timeout.sock_read == 4
+    assert sess.closed
+    assert connector.closed
+
+
+@pytest.mark.asyncio()
+async def test_create_session_without_total_timeout():
+    async with create_session(total_timeout=0) as sess:
+        assert sess.timeout.total is None
+        assert sess.timeout.connect is None
+        assert sess.timeout.sock_read
@@ -2,6 +2,8 @@
 import hashlib
 import os
 
+import pytest
+
 import filesystem
 import log
 import sha256
@@ -45,3 +47,69 @@ def test_calc_sha_for_files_in_dir():
             test_hash.update(fp.read())
 
         assert stats.get(file_path) == test_hash.hexdigest()
+
+
+@pytest.mark.parametrize(('executor', 'ordered'), [
+    (sha256.EXECUTOR_THREAD, True),
+    (sha256.EXECUTOR_THREAD, False),
+    (sha256.EXECUTOR_PROCESS, True),
+    (sha256.EXECUTOR_PROCESS, False),
+])
+def test_calc_sha_for_files_in_dir_parallel(executor: str, ordered: bool):
+    stats = sha256.calc_sha_for_files_in_dir(
+        get_test_dir(),
+        save_stats=True,
+    )
+    parallel_stats = sha256.calc_sha_for_files_in_dir(
+        get_test_dir(),
+        save_stats=True,
+        workers=4,
+        executor=executor,
+        ordered=ordered,
+    )
+
+    assert parallel_stats == stats
+    if ordered:
+        assert list(parallel_stats) == list(stats)
+
+
+def test_calc_sha_for_files_in_dir_unknown_executor():
+    with pytest.raises(ValueError, match='Unknown executor'):
+        sha256.calc_sha_for_files_in_dir(
+            get_test_dir(),
+            workers=2,
+            executor='fiber',
+        )
+
+
+@pytest.mark.parametrize('backend', [
+    sha256.BACKEND_AUTO,
+    sha256.BACKEND_READ,
+    sha256.BACKEND_READINTO,
+    sha256.BACKEND_FILE_DIGEST,
+    sha256.BACKEND_MMAP,
+])
+@pytest.mark.parametrize('file_size', [0, 100, 5000])
+def test_sha256_backends(tmp_path, backend: str, file_size: int):
+    file_contents = os.urandom(file_size)
+    file_path = tmp_path / 'file'
+    file_path.write_bytes(file_contents)
+
+    sha = sha256.calc_sha256(str(file_path), block_size=1024, backend=backend)
+
+    assert sha == hashlib.sha256(file_contents).hexdigest()
+
+
+def test_sha256_unknown_backend():
+    with pytest.raises(ValueError, match='Unknown backend'):
+        sha256.calc_sha256(__file__, backend='gpu')
+
+
+@pytest.mark.parametrize(('file_size', 'backend_exp'), [
+    (10, sha256.BACKEND_READ),
+    (sha256.BLOCK_SIZE, sha256.BACKEND_READ),
+    (sha256.BLOCK_SIZE + 1, sha256.BACKEND_FILE_DIGEST),
+    (sha256.MMAP_FILE_SIZE, sha256.BACKEND_MMAP),
+])
+def test_choose_backend(file_size: int, backend_exp: str):
+    assert sha256.choose_backend(file_size, sha256.BLOCK_SIZE) == backend_exp
@@ -0,0 +1,64 @@
+"""Test stream_decode.py functions."""
+import base64
+import json
+import os
+
+import pytest
+
+from gitea.stream_decode import Base64ContentDecoder
+
+TEST_BYTES = os.urandom(1000)
+
+
+def get_blob_json(content: str) -> bytes:
+    return json.dumps({
+        'url': 'url',
+        'content': content,
+        'encoding': 'base64',
+        'size': len(TEST_BYTES),
+    }).encode('ascii')
+
+
+def decode_by_chunks(body: bytes, chunk_size: int) -> tuple:
+    decoder = Base64ContentDecoder()
+    decoded = bytearray()
+    for index in range(0, len(body), chunk_size):
+        decoded.extend(decoder.feed(body[index:index + chunk_size]))
+    return bytes(decoded), decoder.finish()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 7, 64, 100000])
+def test_decode_by_chunks(chunk_size: int):
+    content = base64.b64encode(TEST_BYTES).decode('ascii')
+    decoded, fields = decode_by_chunks(get_blob_json(content), chunk_size)
+
+    assert decoded == TEST_BYTES
+    assert fields.get('encoding') == 'base64'
+    assert fields.get('size') == len(TEST_BYTES)
+    assert fields.get('url') == 'url'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 64])
+def test_decode_escaped_content(chunk_size: int):
+    content = base64.encodebytes(TEST_BYTES).decode('ascii')
+    body = get_blob_json(content).replace(b'/', b'\\/')
+    decoded, _ = decode_by_chunks(body, chunk_size)
+
+    assert decoded == TEST_BYTES
+
+
+def test_decode_truncated():
+    content = base64.b64encode(TEST_BYTES).decode('ascii')
+    body = get_blob_json(content)
+    decoder = Base64ContentDecoder()
+    decoder.feed(body[:len(body) // 2])
+
+    with pytest.raises(ValueError, match='Truncated'):
+        decoder.finish()
+
+
+def test_decode_without_content():
+    decoder = Base64ContentDecoder()
+
+    assert decoder.feed(b'{"encoding": "base16"}') == b''
+    assert decoder.finish() == {'encoding': 'base16'}
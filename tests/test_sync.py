@@ -0,0 +1,151 @@
+"""Test sync.py functions."""
+import os
+import shutil
+import stat
+import tempfile
+
+import pytest
+from pytest_mock import MockerFixture
+
+from gitea.blob import BlobDownloadError
+from gitea.sync import diff_trees, remove_file, sync_tree
+from gitea.url_params import GiteaUrlParams
+
+OLD_SHA = 'old'
+NEW_SHA = 'new'
+
+
+def make_ref(path: str, sha: str, mode: str = '100644') -> dict:
+    return {'path': path, 'sha': sha, 'mode': mode, 'type': 'blob'}
+
+
+OLD_ENTRIES = {
+    'same': make_ref('same', '1'),
+    'dir/modified': make_ref('dir/modified', '2', '100755'),
+    'gone/removed': make_ref('gone/removed', '3'),
+    'exec': make_ref('exec', '4'),
+}
+NEW_ENTRIES = {
+    'same': make_ref('same', '1'),
+    'dir/modified': make_ref('dir/modified', '22'),
+    'exec': make_ref('exec', '4', '100755'),
+    'dir/added': make_ref('dir/added', '5'),
+}
+
+
+def test_diff_trees():
+    diff = diff_trees(OLD_ENTRIES, NEW_ENTRIES)
+
+    assert [ref['path'] for ref in diff.added] == ['dir/added']
+    assert [ref['path'] for ref in diff.modified] == ['dir/modified']
+    assert diff.removed == ['gone/removed']
+    assert [ref['path'] for ref in diff.mode_changed] == ['exec']
+
+
+def write_file(out_dir: str, relative_path: str, data: bytes) -> str:
+    path = os.path.join(out_dir, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fp:
+        fp.write(data)
+    return path
+
+
+def test_remove_file():
+    out_dir = tempfile.mkdtemp()
+    write_file(out_dir, 'a/b/c', b'c')
+    write_file(out_dir, 'a/d', b'd')
+
+    remove_file('a/b/c', out_dir)
+
+    assert not os.path.exists(os.path.join(out_dir, 'a', 'b'))
+    assert os.path.exists(os.path.join(out_dir, 'a', 'd'))
+    shutil.rmtree(out_dir)
+
+
+@pytest.mark.asyncio()
+async def test_sync_tree(mocker: MockerFixture):
+    out_dir = tempfile.mkdtemp()
+    for relative_path, ref in OLD_ENTRIES.items():
+        path = write_file(out_dir, relative_path, ref['sha'].encode())
+        if ref['mode'] == '100755':
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+    async def fake_entries(sha, sess, urlp, fetchp):
+        return OLD_ENTRIES if sha == OLD_SHA else NEW_ENTRIES
+
+    async def fake_process_blob(sha, ref, sess, temp_dir, *args):
+        write_file(temp_dir, ref['path'], ref['sha'].encode())
+        return ref['sha']
+
+    mocker.patch('gitea.sync.get_tree_entries', fake_entries)
+    blob_mock = mocker.patch(
+        'gitea.sync.process_blob',
+        side_effect=fake_process_blob,
+    )
+
+    await sync_tree(OLD_SHA, NEW_SHA, None, GiteaUrlParams(), out_dir)
+
+    assert blob_mock.call_count == 2
+    assert not os.path.exists(os.path.join(out_dir, 'gone'))
+    with open(os.path.join(out_dir, 'dir', 'modified'), 'rb') as fp:
+        assert fp.read() == b'22'
+    assert not os.access(os.path.join(out_dir, 'dir', 'modified'), os.X_OK)
+    assert os.access(os.path.join(out_dir, 'exec'), os.X_OK)
+    assert os.path.exists(os.path.join(out_dir, 'dir', 'added'))
+
+    shutil.rmtree(out_dir)
+
+
+@pytest.mark.asyncio()
+async def test_sync_tree_listing_failed(mocker: MockerFixture):
+    out_dir = tempfile.mkdtemp()
+    for relative_path, ref in OLD_ENTRIES.items():
+        write_file(out_dir, relative_path, ref['sha'].encode())
+
+    async def fake_page(sha, page, sess, urlp, fetchp):
+        if sha == NEW_SHA:
+            return None
+        return {
+            'tree': list(OLD_ENTRIES.values()),
+            'total_count': len(OLD_ENTRIES),
+        }
+
+    mocker.patch('gitea.refs_tree.get_tree_refs_page', fake_page)
+    blob_mock = mocker.patch('gitea.sync.process_blob')
+
+    with pytest.raises(ValueError, match='not available'):
+        await sync_tree(OLD_SHA, NEW_SHA, None, GiteaUrlParams(), out_dir)
+
+    assert blob_mock.call_count == 0
+    for relative_path in OLD_ENTRIES:
+        assert os.path.exists(os.path.join(out_dir, relative_path))
+
+    shutil.rmtree(out_dir)
+
+
+@pytest.mark.asyncio()
+async def test_sync_tree_download_failed(mocker: MockerFixture):
+    out_dir = tempfile.mkdtemp()
+    for relative_path, ref in OLD_ENTRIES.items():
+        write_file(out_dir, relative_path, ref['sha'].encode())
+
+    async def fake_entries(sha, sess, urlp, fetchp):
+        return OLD_ENTRIES if sha == OLD_SHA else NEW_ENTRIES
+
+    async def fake_process_blob(sha, ref, sess, temp_dir, *args):
+        if ref['path'] == 'dir/modified':
+            raise BlobDownloadError(ref['path'], ref['sha'])
+        write_file(temp_dir, ref['path'], ref['sha'].encode())
+        return ref['sha']
+
+    mocker.patch('gitea.sync.get_tree_entries', fake_entries)
+    mocker.patch('gitea.sync.process_blob', fake_process_blob)
+
+    with pytest.raises(ValueError, match='1 files not downloaded') as info:
+        await sync_tree(OLD_SHA, NEW_SHA, None, GiteaUrlParams(), out_dir)
+
+    assert isinstance(info.value.__cause__, BlobDownloadError)
+    assert os.path.exists(os.path.join(out_dir, 'dir', 'added'))
+    assert not os.access(os.path.join(out_dir, 'exec'), os.X_OK)
+
+    shutil.rmtree(out_dir)